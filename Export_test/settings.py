@@ -29,11 +29,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'dispatch_app.middleware.StaticFilesMiddleware',  # STATIC_ROOT, when not behind nginx (off under DEBUG)
+    'dispatch_app.middleware.RequestMetricsMiddleware',  # first, so it times everything below
     'django.middleware.security.SecurityMiddleware',
+    'dispatch_app.middleware.CompressionMiddleware',  # gzip/brotli; where Django puts GZipMiddleware
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'dispatch_app.middleware.ProfilingMiddleware',  # ?_profile=1 or X-Profile header, staff only
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -42,7 +46,8 @@ ROOT_URLCONF = 'Export_test.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django templates, plus render timing for RequestMetricsMiddleware
+        'BACKEND': 'dispatch_app.middleware.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,4 +82,108 @@ ALLOWED_HOSTS = [
     '192.5.20.83',    # ← Your server's public IPv4 address
 ]
 STATIC_URL = '/static/'
+STATICFILES_DIRS = [BASE_DIR / 'static']  # our CSS/JS and the vendored libraries (static/vendor/)
+STATIC_ROOT = BASE_DIR / 'staticfiles'  # collectstatic output
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    # Content-hashed names plus .gz/.br copies (dispatch_app/storage.py)
+    'staticfiles': {'BACKEND': 'dispatch_app.storage.CompressedManifestStaticFilesStorage'},
+}
+
+# Uploaded files (import jobs and their error reports)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# "fragments" holds rendered home rows and printable documents (dispatch_app/fragments.py).
+# Process-local here; point it at Redis/memcached to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+# Sessions without a query per request. signed_cookies keeps the (small) session in the signed cookie
+# itself. 'django.contrib.sessions.backends.cached_db' keeps it in the database and reads it from
+# SESSION_CACHE_ALIAS; use it with a cache shared by all workers (Redis/memcached), not LocMem.
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+SESSION_CACHE_ALIAS = 'default'
+
+# request.user from a process-local cache (dispatch_app/auth.py) instead of a query per request
+AUTHENTICATION_BACKENDS = ['dispatch_app.auth.CachedModelBackend']
+
+# Live updates on the home page (/events/home/, dispatch_app/events.py): how often each process checks
+# ChangeLog for new changes, the keep-alive interval, and how long one stream lasts before the
+# browser reconnects. Serve under ASGI: with WSGI every open home page holds a worker thread.
+HOME_EVENTS_POLL_SECONDS = 2
+HOME_EVENTS_HEARTBEAT_SECONDS = 15
+HOME_EVENTS_MAX_SECONDS = 300
+
+# Lines expiring at most this many days after their loading date are flagged on the dispatch form
+# and listed on /reports/expiry/
+EXPIRY_WARNING_DAYS = 30
+
+# Seconds a browser may reuse customer/product auto-fill lookups before revalidating (ETag)
+AUTOFILL_MAX_AGE = 300
+
+# Process-local master-data cache (dispatch_app/master_cache.py): max rows kept per table,
+# and how often each process checks TableVersion for changes made by other processes
+MASTER_CACHE_MAX_SIZE = 10000
+MASTER_CACHE_CHECK_SECONDS = 5
+
+# Per-view budgets for RequestMetricsMiddleware (keyed by URL name). Requests over budget are
+# logged as JSON lines to slow_requests.log.
+REQUEST_BUDGETS = {
+    'default': {'queries': 50, 'ms': 1000},
+    'home': {'queries': 15, 'ms': 500},
+    'dispatch_note': {'queries': 10, 'ms': 500},
+    'loading_sheet': {'queries': 10, 'ms': 500},
+    'pallet_labels': {'queries': 10, 'ms': 500},
+    'get_customer_details': {'queries': 3, 'ms': 100},
+    'get_product_details': {'queries': 3, 'ms': 100},
+    'reports': {'queries': 20, 'ms': 3000},
+}
+# Add a Server-Timing header (db / tpl / total) for the browser dev tools
+REQUEST_METRICS_SERVER_TIMING = DEBUG
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': BASE_DIR / 'slow_requests.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'dispatch_app.slow_requests': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+# Response compression (CompressionMiddleware): brotli when the package is installed, else gzip
+COMPRESS_MIN_SIZE = 500  # bytes
+COMPRESS_BROTLI_QUALITY = 5
+
+PROFILE_TOP_FUNCTIONS = 40  # functions listed in ?_profile=1 reports (MEDIA_ROOT/profiles/)
+
+# /metrics: counters shared by all worker processes through this SQLite file
+METRICS_DB = BASE_DIR / 'metrics.sqlite3'
+METRICS_FLUSH_SECONDS = 5
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # scrapers allowed without login
+METRICS_TOKEN = ''  # or let scrapers send "Authorization: Bearer <token>"
@@ -0,0 +1,660 @@
+# dispatch_app/api.py
+"""JSON API for the ERP and the warehouse scanners.
+
+Plain Django views returning JsonResponse (DjangoJSONEncoder turns dates
+into ISO strings and Decimals into strings). Clients authenticate with the
+normal session login or with HTTP Basic credentials.
+"""
+import base64
+import binascii
+import gzip
+import json
+from datetime import datetime
+from functools import wraps
+
+from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.forms.models import model_to_dict
+from django.http import HttpResponse, JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+
+from . import master_cache
+from .forms import DispatchDetailsForm
+from .models import TRACE_FIELDS, CatalogChange, ChangeLog, Customer, Dispatch, DispatchDetails, Products
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BULK_CREATE = 5000
+DEFAULT_CHANGES_BATCH = 500
+MAX_CHANGES_BATCH = 5000
+
+DISPATCH_FIELDS = [
+    'DispatchID', 'OrderNo', 'InvoiceNo', 'Customer', 'CustomerName', 'Address', 'Country',
+    'ContactNo', 'ContactPerson', 'OrderDate', 'LoadingDate', 'DeliveryDate', 'TransportNo',
+    'DriverName', 'DriverMobile', 'Seal', 'Status', 'created_at', 'updated_at', 'version',
+]
+# API name -> values() lookup, where they differ
+DISPATCH_LOOKUPS = {'Customer': 'Customer_id', 'CustomerName': 'Customer__Customer'}
+LINE_FIELDS = [
+    'ID', 'Code', 'LocalCode', 'Description', 'UOM', 'PackInCarton', 'Qty', 'ParPallet',
+    'ProductionDate', 'ExpairyDate',
+]
+LINE_LOOKUPS = {'Code': 'Code_id'}
+WRITABLE_DISPATCH_FIELDS = [
+    'OrderNo', 'InvoiceNo', 'Customer', 'Address', 'Country', 'ContactNo', 'ContactPerson',
+    'OrderDate', 'LoadingDate', 'DeliveryDate', 'TransportNo', 'DriverName', 'DriverMobile',
+    'Seal', 'Status',
+]
+WRITABLE_LINE_FIELDS = [f for f in LINE_FIELDS if f != 'ID']
+PRODUCT_FIELDS = ['Code', 'LocalCode', 'Description', 'ParPallet', 'UOM', 'PacInCtn']
+CUSTOMER_FIELDS = ['CustomerID', 'Customer', 'DispatchTo', 'Address', 'Country', 'ContactNo', 'ContactPerson']
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors
+
+
+def api_error(message, status=400, errors=None):
+    data = {'error': message}
+    if errors:
+        data['errors'] = errors
+    return JsonResponse(data, status=status)
+
+
+def api_view(methods):
+    """Authenticate (session or HTTP Basic), restrict methods and turn ApiError into JSON.
+
+    Basic-auth requests carry no cookies, so CSRF is only enforced for
+    session-authenticated writes.
+    """
+    def decorator(view_func):
+        @csrf_exempt
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return api_error(f'Method {request.method} not allowed', status=405)
+
+            basic_user = basic_auth_user(request)
+            if basic_user is not None:
+                request.user = basic_user
+            elif not request.user.is_authenticated:
+                response = api_error('Authentication required', status=401)
+                response['WWW-Authenticate'] = 'Basic realm="dispatch"'
+                return response
+            elif request.method not in ('GET', 'HEAD', 'OPTIONS'):
+                reason = CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {})
+                if reason is not None:
+                    return api_error('CSRF verification failed', status=403)
+
+            try:
+                return view_func(request, *args, **kwargs)
+            except ApiError as e:
+                return api_error(str(e), status=e.status, errors=e.errors)
+        return wrapper
+    return decorator
+
+
+def basic_auth_user(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith('Basic '):
+        return None
+    try:
+        username, _, password = base64.b64decode(header[6:]).decode('utf-8').partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    user = authenticate(request, username=username, password=password)
+    return user if user is not None and user.is_active else None
+
+
+def parse_fields(param, allowed, default):
+    if not param:
+        return list(default)
+    fields = [f.strip() for f in param.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return fields
+
+
+def parse_date_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ApiError(f"{name} must be a date (YYYY-MM-DD)")
+
+
+def parse_int_param(request, name, default=None, minimum=None, maximum=None):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(f"{name} must be an integer")
+    if minimum is not None and value < minimum:
+        raise ApiError(f"{name} must be at least {minimum}")
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def filter_dispatches(request, queryset):
+    """The filters of the home page (status) plus date ranges and customer."""
+    status = request.GET.get('status', '')
+    if status and status != 'all':
+        queryset = queryset.filter(Status__in=status.split(','))
+
+    for field in ('OrderDate', 'LoadingDate', 'DeliveryDate'):
+        param = {'OrderDate': 'order_date', 'LoadingDate': 'loading_date',
+                 'DeliveryDate': 'delivery_date'}[field]
+        start = parse_date_param(request, f'{param}_from')
+        end = parse_date_param(request, f'{param}_to')
+        if start:
+            queryset = queryset.filter(**{f'{field}__gte': start})
+        if end:
+            queryset = queryset.filter(**{f'{field}__lte': end})
+
+    customer = parse_int_param(request, 'customer')
+    if customer is not None:
+        queryset = queryset.filter(Customer_id=customer)
+    customer_name = request.GET.get('customer_name')
+    if customer_name:
+        queryset = queryset.filter(Customer__Customer=customer_name)
+
+    ids = request.GET.get('ids')
+    if ids:
+        try:
+            queryset = queryset.filter(DispatchID__in=[int(i) for i in ids.split(',') if i])
+        except ValueError:
+            raise ApiError("ids must be a comma-separated list of DispatchIDs")
+    updated_since = request.GET.get('updated_since')
+    if updated_since:
+        since = parse_datetime(updated_since)
+        if since is None:
+            raise ApiError("updated_since must be an ISO 8601 datetime")
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        queryset = queryset.filter(updated_at__gte=since)
+    return queryset
+
+
+def lines_for(dispatch_ids, line_fields):
+    """{DispatchID: [line, ...]} for a page of dispatches, in one query."""
+    lookups = [LINE_LOOKUPS.get(f, f) for f in line_fields]
+    lines = {pk: [] for pk in dispatch_ids}
+    rows = (
+        DispatchDetails.objects.filter(DispatchID__in=dispatch_ids)
+        .order_by('DispatchID', 'ID')
+        .values_list('DispatchID', *lookups)
+    )
+    for dispatch_id, *values in rows:
+        lines[dispatch_id].append(dict(zip(line_fields, values)))
+    return lines
+
+
+@api_view(['GET', 'POST'])
+def dispatches(request):
+    if request.method == 'POST':
+        return bulk_create_dispatches(request)
+    return list_dispatches(request)
+
+
+def list_dispatches(request):
+    """Keyset-paginated dispatch list: ?after=<DispatchID>&limit=N&fields=...&line_fields=...
+
+    Always two queries per page (dispatches + their lines), whatever the page size.
+    """
+    fields = parse_fields(request.GET.get('fields'), DISPATCH_FIELDS + ['lines'], DISPATCH_FIELDS + ['lines'])
+    line_fields = parse_fields(request.GET.get('line_fields'), LINE_FIELDS, LINE_FIELDS)
+    limit = parse_int_param(request, 'limit', DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    after = parse_int_param(request, 'after')
+
+    with_lines = 'lines' in fields
+    fields = [f for f in fields if f != 'lines']
+    # DispatchID is always fetched: it is the cursor and the key for lines
+    lookups = ['DispatchID'] + [DISPATCH_LOOKUPS.get(f, f) for f in fields if f != 'DispatchID']
+    names = ['DispatchID'] + [f for f in fields if f != 'DispatchID']
+
+    queryset = filter_dispatches(request, Dispatch.objects.all())
+    if after is not None:
+        queryset = queryset.filter(DispatchID__gt=after)
+    rows = list(queryset.order_by('DispatchID').values_list(*lookups)[:limit + 1])
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    results = [dict(zip(names, row)) for row in rows]
+
+    if with_lines and results:
+        lines = lines_for([r['DispatchID'] for r in results], line_fields)
+        for result in results:
+            result['lines'] = lines[result['DispatchID']]
+    if 'DispatchID' not in fields:
+        for result in results:
+            del result['DispatchID']
+
+    next_url = None
+    if has_more:
+        params = request.GET.copy()
+        params['after'] = rows[-1][0]
+        next_url = f"{reverse('api_dispatches')}?{params.urlencode()}"
+
+    return JsonResponse({
+        'count': len(results),
+        'next': next_url,
+        'next_cursor': rows[-1][0] if has_more else None,
+        'results': results,
+    })
+
+
+def read_json(request):
+    try:
+        return json.loads(request.body or b'null')
+    except (ValueError, UnicodeDecodeError):
+        raise ApiError('Request body must be valid JSON')
+
+
+def bulk_create_dispatches(request):
+    """Create many dispatches with their lines in one transaction.
+
+    Body: [{...dispatch fields..., "lines": [{...line fields...}]}, ...]
+    (or {"dispatches": [...]}). Either everything is created or nothing is,
+    and the response lists the errors per item.
+    """
+    payload = read_json(request)
+    if isinstance(payload, dict):
+        payload = payload.get('dispatches')
+    if not isinstance(payload, list) or not payload:
+        raise ApiError('Expected a non-empty list of dispatches')
+    if len(payload) > MAX_BULK_CREATE:
+        raise ApiError(f'At most {MAX_BULK_CREATE} dispatches per request', status=413)
+
+    dispatches, lines, errors = build_dispatches(payload, request.user)
+    if errors:
+        raise ApiError('Validation failed, nothing was created', errors=errors)
+
+    try:
+        with transaction.atomic():
+            Dispatch.objects.bulk_create(dispatches)
+            for dispatch, dispatch_lines in zip(dispatches, lines):
+                for line in dispatch_lines:
+                    line.DispatchID = dispatch
+            all_lines = DispatchDetails.objects.bulk_create([line for group in lines for line in group])
+            ChangeLog.record_many(dispatches + all_lines, 'save')  # bulk_create sends no signals
+    except IntegrityError:
+        # A concurrent request took one of the OrderNos after build_dispatches() checked them
+        order_nos = [d.OrderNo for d in dispatches]
+        taken = set(Dispatch.objects.filter(OrderNo__in=order_nos).values_list('OrderNo', flat=True))
+        if not taken:
+            raise
+        raise ApiError('Validation failed, nothing was created', errors={
+            index: {'OrderNo': [f"OrderNo {order_no!r} already exists"]}
+            for index, order_no in enumerate(order_nos) if order_no in taken
+        })
+
+    return JsonResponse({
+        'created': [{'DispatchID': d.DispatchID, 'OrderNo': d.OrderNo} for d in dispatches],
+    }, status=201)
+
+
+def fill_from_product(line, product):
+    """Same defaults as the form's auto-fill, for values the client left out."""
+    line.LocalCode = line.LocalCode or product.LocalCode
+    line.Description = line.Description or product.Description
+    line.UOM = line.UOM or product.UOM
+    if line.PackInCarton is None:
+        line.PackInCarton = product.PacInCtn
+    if line.ParPallet is None:
+        line.ParPallet = product.ParPallet
+
+
+def build_dispatches(payload, user):
+    """Validate the payload without a query per item.
+
+    Customers and products come from the master-data cache, and OrderNo
+    uniqueness is checked with a single query.
+    """
+    errors = {}
+    order_nos = [item.get('OrderNo') for item in payload if isinstance(item, dict)]
+    taken = set(Dispatch.objects.filter(OrderNo__in=order_nos).values_list('OrderNo', flat=True))
+    seen = set()
+    customers = master_cache.customers.get_many(
+        item.get('Customer') for item in payload if isinstance(item, dict)
+        and isinstance(item.get('Customer'), int)
+    )
+    product_codes = {
+        str(line.get('Code'))
+        for item in payload if isinstance(item, dict)
+        for line in (item.get('lines') or []) if isinstance(line, dict)
+    }
+    products = master_cache.products.get_many(product_codes)
+
+    dispatches, lines = [], []
+    for index, item in enumerate(payload):
+        if not isinstance(item, dict):
+            errors[index] = {'__all__': ['Expected an object']}
+            continue
+        item_errors = {}
+        unknown = set(item) - set(WRITABLE_DISPATCH_FIELDS) - {'lines'}
+        if unknown:
+            item_errors['__all__'] = [f"Unknown field(s): {', '.join(sorted(unknown))}"]
+
+        dispatch = Dispatch(
+            **{f: item.get(f) for f in WRITABLE_DISPATCH_FIELDS if f not in ('Customer', 'Status')},
+            Status=item.get('Status') or 'draft',
+            created_by=user,
+        )
+        customer = customers.get(item.get('Customer'))
+        if customer is None:
+            item_errors['Customer'] = [f"Customer {item.get('Customer')!r} not found"]
+        else:
+            dispatch.Customer = customer
+        try:
+            dispatch.clean_fields(exclude=['Customer', 'created_by', 'updated_by', 'created_at', 'updated_at'])
+        except ValidationError as e:
+            for field, messages in e.message_dict.items():
+                item_errors.setdefault(field, []).extend(messages)
+
+        order_no = item.get('OrderNo')
+        if order_no in taken or order_no in seen:
+            item_errors.setdefault('OrderNo', []).append(f"OrderNo {order_no!r} already exists")
+        seen.add(order_no)
+
+        dispatch_lines = []
+        raw_lines = item.get('lines') or []
+        if not isinstance(raw_lines, list):
+            item_errors['lines'] = ['Expected a list']
+            raw_lines = []
+        for line_index, raw in enumerate(raw_lines):
+            line_errors = {}
+            if not isinstance(raw, dict):
+                item_errors.setdefault('lines', {})[line_index] = {'__all__': ['Expected an object']}
+                continue
+            line = DispatchDetails(**{f: raw.get(f) for f in WRITABLE_LINE_FIELDS if f != 'Code'})
+            product = products.get(str(raw.get('Code')))
+            if product is None:
+                line_errors['Code'] = [f"Product {raw.get('Code')!r} not found"]
+            else:
+                line.Code = product
+                fill_from_product(line, product)
+            try:
+                line.clean_fields(exclude=['DispatchID', 'Code'])
+            except ValidationError as e:
+                line_errors.update(e.message_dict)
+            if line_errors:
+                item_errors.setdefault('lines', {})[line_index] = line_errors
+            dispatch_lines.append(line)
+
+        if item_errors:
+            errors[index] = item_errors
+        dispatches.append(dispatch)
+        lines.append(dispatch_lines)
+
+    return dispatches, lines, errors
+
+
+@api_view(['GET'])
+def changes(request):
+    """Dispatch/line changes after a cursor: ?since=<cursor>&limit=N
+
+    Follow ``cursor`` until ``has_more`` is false, then store it for the
+    next sync. ``since=latest`` returns the current cursor without history
+    (take it before a full export). Each change names the dispatch to
+    refetch, e.g. with /api/dispatches/?ids=...
+    """
+    limit = parse_int_param(request, 'limit', DEFAULT_CHANGES_BATCH, minimum=1, maximum=MAX_CHANGES_BATCH)
+    if request.GET.get('since') == 'latest':
+        latest = ChangeLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        return JsonResponse({'changes': [], 'cursor': latest, 'has_more': False})
+
+    since = parse_int_param(request, 'since', 0, minimum=0)
+    rows = list(
+        ChangeLog.objects.filter(id__gt=since).order_by('id')
+        .values('id', 'table', 'object_id', 'dispatch_id', 'action', 'changed_at')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return JsonResponse({
+        'changes': rows,
+        'cursor': rows[-1]['id'] if rows else since,
+        'has_more': has_more,
+    })
+
+
+# 🔎 Batch recall trace
+
+@api_view(['GET'])
+def trace(request):
+    """Who received a batch: ?code=X&produced_from=YYYY-MM-DD&produced_to=YYYY-MM-DD&after=<LineID>&limit=N
+
+    One query per page: the lines come from details_trace_idx, joined to
+    their dispatch and customer by primary key.
+    """
+    code = request.GET.get('code', '').strip()
+    if not code:
+        raise ApiError("code is required")
+    start = parse_date_param(request, 'produced_from')
+    end = parse_date_param(request, 'produced_to')
+    limit = parse_int_param(request, 'limit', DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    after = parse_int_param(request, 'after')
+
+    lines = DispatchDetails.objects.trace(code, start, end)
+    if after is not None:
+        lines = lines.filter(ID__gt=after)
+    rows = list(lines.order_by('ID').values_list(*TRACE_FIELDS.values())[:limit + 1])
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    results = [dict(zip(TRACE_FIELDS, row)) for row in rows]
+
+    next_url = None
+    if has_more:
+        params = request.GET.copy()
+        params['after'] = results[-1]['LineID']
+        next_url = f"{reverse('api_trace')}?{params.urlencode()}"
+
+    return JsonResponse({
+        'code': code,
+        'produced_from': start,
+        'produced_to': end,
+        'count': len(results),
+        'next': next_url,
+        'results': results,
+    })
+
+
+# 📦 Catalog snapshot for offline clients
+
+_snapshot_cache = {}  # {'version': n, 'body': gzipped JSON} for the latest full snapshot
+
+
+def catalog_version(request):
+    # Read once per request, and before the rows: a change landing in between
+    # is then sent again with the next delta rather than missed.
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = CatalogChange.latest_version()
+    return request._catalog_version
+
+
+def catalog_etag(request):
+    return f"catalog-{request.GET.get('since_version', 'full')}-{catalog_version(request)}"
+
+
+def gzip_json_response(body, request, gzipped=None):
+    """Send JSON bytes gzip-compressed when the client accepts it."""
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(gzipped or gzip.compress(body), content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def dump_json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+
+
+@api_view(['GET'])
+@condition(etag_func=catalog_etag)
+def catalog_snapshot(request):
+    """All Products and active Customers with the catalog version.
+
+    ?since_version=N returns only what changed after version N: the current
+    rows that were added/edited, and the keys that were deleted (for
+    customers, also deactivated). Clients apply it and keep ``version``.
+    """
+    version = catalog_version(request)
+    since = parse_int_param(request, 'since_version', minimum=0)
+
+    if since is None:
+        cached = _snapshot_cache.get('full')
+        if cached is None or cached[0] != version:
+            body = dump_json({
+                'version': version,
+                'full': True,
+                'products': list(Products.objects.order_by('Code').values(*PRODUCT_FIELDS)),
+                'customers': list(
+                    Customer.objects.filter(Status=True).order_by('CustomerID').values(*CUSTOMER_FIELDS)
+                ),
+            })
+            cached = (version, body, gzip.compress(body))
+            _snapshot_cache['full'] = cached
+        return gzip_json_response(cached[1], request, gzipped=cached[2])
+
+    if since > version:
+        raise ApiError(f"since_version {since} is newer than the current version {version}")
+
+    changed = {Products._meta.db_table: set(), Customer._meta.db_table: set()}
+    for table, key in CatalogChange.objects.filter(id__gt=since, id__lte=version).values_list('table', 'key'):
+        changed.setdefault(table, set()).add(key)
+
+    product_keys = changed[Products._meta.db_table]
+    products = list(Products.objects.filter(Code__in=product_keys).values(*PRODUCT_FIELDS))
+    customer_keys = {int(k) for k in changed[Customer._meta.db_table]}
+    customers = list(
+        Customer.objects.filter(CustomerID__in=customer_keys, Status=True).values(*CUSTOMER_FIELDS)
+    )
+    body = dump_json({
+        'version': version,
+        'since_version': since,
+        'full': False,
+        'products': products,
+        'customers': customers,
+        'deleted': {
+            'products': sorted(product_keys - {p['Code'] for p in products}),
+            'customers': sorted(customer_keys - {c['CustomerID'] for c in customers}),
+        },
+    })
+    return gzip_json_response(body, request)
+
+
+# ✏️ Single-line edits with optimistic concurrency
+
+def line_data(line):
+    return {f: getattr(line, LINE_LOOKUPS.get(f, f)) for f in LINE_FIELDS}
+
+
+def expected_version(request, payload):
+    """The Dispatch.version the client last saw: "version" in the body or an If-Match header."""
+    version = payload.get('version') if isinstance(payload, dict) else None
+    if version is None:
+        version = request.META.get('HTTP_IF_MATCH', '').strip('"') or request.GET.get('version')
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        raise ApiError('The dispatch version is required ("version" or an If-Match header)', status=428)
+
+
+def claim_version(dispatch_id, version, user):
+    """Bump Dispatch.version if it is still `version`; 409 if someone else got there first.
+
+    Must run inside the transaction that writes the line.
+    """
+    claimed = Dispatch.objects.filter(pk=dispatch_id, version=version).update(
+        version=F('version') + 1, updated_by=user, updated_at=timezone.now()
+    )
+    if not claimed:
+        current = Dispatch.objects.filter(pk=dispatch_id).values_list('version', flat=True).first()
+        if current is None:
+            raise ApiError('Dispatch not found', status=404)
+        raise ApiError(
+            'The dispatch was changed by someone else; reload it and try again',
+            status=409, errors={'version': current},
+        )
+    return version + 1
+
+
+def validate_line(payload, line):
+    """Run the edit form's validation on one line, starting from its current values."""
+    unknown = set(payload) - set(WRITABLE_LINE_FIELDS) - {'version'}
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    data = model_to_dict(line, fields=WRITABLE_LINE_FIELDS) if line.pk else {}
+    data.update({f: payload[f] for f in WRITABLE_LINE_FIELDS if f in payload})
+    if 'Code' in payload and line.pk and payload['Code'] != line.Code_id:
+        # New product: take its defaults unless they were sent too
+        for field in ('LocalCode', 'Description', 'UOM', 'PackInCarton', 'ParPallet'):
+            if field not in payload:
+                data[field] = None
+    form = DispatchDetailsForm(data=data, instance=line)
+    if not form.is_valid():
+        raise ApiError('Validation failed', errors={
+            field: [e['message'] for e in errors] for field, errors in form.errors.get_json_data().items()
+        })
+    if not form.cleaned_data.get('Code'):
+        raise ApiError('Validation failed', errors={'Code': ['Product code is required.']})
+    line = form.save(commit=False)
+    fill_from_product(line, line.Code)
+    return line
+
+
+@api_view(['POST'])
+def dispatch_lines(request, dispatch_id):
+    """Add one line: {"version": n, "Code": ..., "Qty": ...}"""
+    payload = read_json(request)
+    if not isinstance(payload, dict):
+        raise ApiError('Expected an object')
+    version = expected_version(request, payload)
+    line = validate_line(payload, DispatchDetails(DispatchID_id=dispatch_id))
+    with transaction.atomic():
+        new_version = claim_version(dispatch_id, version, request.user)
+        line.save()
+    return JsonResponse({'version': new_version, 'line': line_data(line)}, status=201)
+
+
+@api_view(['PATCH', 'PUT', 'DELETE'])
+def dispatch_line(request, dispatch_id, line_id):
+    """Update (PATCH/PUT with the changed fields) or delete one line."""
+    payload = read_json(request) if request.body else {}
+    version = expected_version(request, payload)
+    line = DispatchDetails.objects.filter(pk=line_id, DispatchID_id=dispatch_id).first()
+    if line is None:
+        raise ApiError('Line not found', status=404)
+
+    if request.method == 'DELETE':
+        with transaction.atomic():
+            new_version = claim_version(dispatch_id, version, request.user)
+            line.delete()
+        return JsonResponse({'version': new_version, 'deleted': line_id})
+
+    if not isinstance(payload, dict):
+        raise ApiError('Expected an object')
+    line = validate_line(payload, line)
+    with transaction.atomic():
+        new_version = claim_version(dispatch_id, version, request.user)
+        line.save()
+    return JsonResponse({'version': new_version, 'line': line_data(line)})
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class DispatchAppConfig(AppConfig):
+    name = 'dispatch_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connects the receivers)
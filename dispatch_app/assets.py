@@ -0,0 +1,56 @@
+# dispatch_app/assets.py
+"""Third-party CSS/JS, served from our own static files.
+
+The pinned files below live in static/vendor/. `python manage.py
+vendor_assets` downloads any that are missing (commit them afterwards).
+Templates use {% asset_url 'bootstrap.css' %}; until a file has been
+vendored it falls back to its CDN URL, so a fresh checkout still renders.
+"""
+from functools import lru_cache
+
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+
+BOOTSTRAP = '5.1.3'
+FONTAWESOME = '6.0.0'
+JQUERY = '3.7.1'
+
+# name -> (static path, upstream URL)
+VENDOR_ASSETS = {
+    'bootstrap.css': (
+        f'vendor/bootstrap/{BOOTSTRAP}/bootstrap.min.css',
+        f'https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP}/dist/css/bootstrap.min.css',
+    ),
+    'bootstrap.js': (
+        f'vendor/bootstrap/{BOOTSTRAP}/bootstrap.bundle.min.js',
+        f'https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP}/dist/js/bootstrap.bundle.min.js',
+    ),
+    'fontawesome.css': (
+        f'vendor/fontawesome/{FONTAWESOME}/css/all.min.css',
+        f'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/{FONTAWESOME}/css/all.min.css',
+    ),
+    'jquery.js': (
+        f'vendor/jquery/jquery-{JQUERY}.min.js',
+        f'https://code.jquery.com/jquery-{JQUERY}.min.js',
+    ),
+}
+
+# Files the CSS above loads with url(...); ManifestStaticFilesStorage needs them all
+VENDOR_DEPENDENCIES = {
+    'fontawesome.css': [
+        (f'vendor/fontawesome/{FONTAWESOME}/webfonts/{font}.{ext}',
+         f'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/{FONTAWESOME}/webfonts/{font}.{ext}')
+        for font in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility')
+        for ext in ('woff2', 'ttf')
+    ],
+}
+
+
+@lru_cache(maxsize=None)
+def is_vendored(path):
+    return finders.find(path) is not None
+
+
+def asset_url(name):
+    path, cdn_url = VENDOR_ASSETS[name]
+    return static(path) if is_vendored(path) else cdn_url
@@ -0,0 +1,33 @@
+# dispatch_app/auth.py
+"""Authentication backend that serves request.user from master_cache.users.
+
+ModelBackend loads the logged-in user with a query on every request. This
+backend looks the user up in a process-local MasterDataCache instead, so
+with signed-cookie or cached sessions (settings.SESSION_ENGINE) a warm
+request runs no query before the view.
+
+Saving or deleting a user bumps its TableVersion (signals.py): this
+process drops its copies when the transaction commits, the others within
+MASTER_CACHE_CHECK_SECONDS. Saves that only touch last_login (every
+login) are left out.
+"""
+import copy
+
+from django.contrib.auth.backends import ModelBackend
+
+from . import master_cache
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        return self.checked(master_cache.users.get(user_id))
+
+    async def aget_user(self, user_id):
+        return self.checked(await master_cache.users.aget(user_id))
+
+    def checked(self, user):
+        if user is None or not self.user_can_authenticate(user):
+            return None
+        # A copy per request: permission caches and anything a view sets on
+        # request.user must not leak into other requests
+        return copy.copy(user)
@@ -0,0 +1,171 @@
+# dispatch_app/customer_stats.py
+"""Per-customer order statistics, maintained incrementally.
+
+Every dispatch and line change goes through ChangeLog.record_many() (the
+post_save/post_delete signals and every bulk write), which passes the
+dispatch ids to dispatches_changed(). Once the transaction commits,
+refresh() reads those dispatches as they are now (one query) and compares
+them with their DispatchStats rows (what they had added so far). Only the
+difference is applied to CustomerStats (lifetime) and CustomerMonthStats
+(per month), so the cost of a change does not depend on how many orders
+the customer has.
+
+The customer detail page reads one CustomerStats row and at most
+TRAILING_MONTHS CustomerMonthStats rows. Cancelled dispatches are not
+counted. `manage.py rebuild_customer_stats` recomputes everything from the
+dispatches: run it once after migrating, and after any write that bypasses
+the ORM.
+"""
+import threading
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, When
+
+from .models import CustomerMonthStats, CustomerStats, Dispatch, DispatchStats
+
+TRAILING_MONTHS = 12  # the current month and the 11 before it
+ZERO = Decimal('0')
+
+_pending = threading.local()  # dispatch ids waiting for the commit, per thread (= per connection)
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def trailing_start(today):
+    """First day of the oldest month in the trailing window."""
+    months = today.year * 12 + today.month - 1 - (TRAILING_MONTHS - 1)
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def pallets_sum():
+    """Sum of Qty / ParPallet over a dispatch's lines; the product's ParPallet when the line has none."""
+    return Sum(
+        Case(
+            When(Q(details__ParPallet__gt=0), then=F('details__Qty') / F('details__ParPallet')),
+            When(Q(details__Code__ParPallet__gt=0), then=F('details__Qty') / F('details__Code__ParPallet')),
+        ),
+        output_field=DecimalField(max_digits=20, decimal_places=4),
+    )
+
+
+def dispatches_changed(dispatch_ids):
+    """Refresh the stats of these dispatches after the current transaction commits (at once outside one)."""
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.update(dispatch_ids)
+    transaction.on_commit(flush)
+
+
+def flush():
+    # A transaction that saved 20 lines registered 20 callbacks: the first refreshes everything.
+    # Ids left over from a rolled-back transaction are refreshed too, which is harmless.
+    ids = getattr(_pending, 'ids', None)
+    if ids:
+        _pending.ids = set()
+        refresh(ids)
+
+
+def current_stats(dispatch_ids):
+    """{DispatchID: unsaved DispatchStats} for the counted (not cancelled) dispatches, in one query."""
+    rows = (
+        Dispatch.objects.filter(pk__in=dispatch_ids).exclude(Status='cancelled')
+        .values('DispatchID', 'Customer_id', 'OrderDate')
+        .annotate(qty=Sum('details__Qty'), pallets=pallets_sum())
+    )
+    return {
+        row['DispatchID']: DispatchStats(
+            dispatch_id=row['DispatchID'],
+            customer_id=row['Customer_id'],
+            Month=month_of(row['OrderDate']),
+            OrderDate=row['OrderDate'],
+            Qty=row['qty'] or ZERO,
+            Pallets=row['pallets'] or ZERO,
+        )
+        for row in rows
+    }
+
+
+def stats_key(stats):
+    return None if stats is None else (stats.customer_id, stats.OrderDate, stats.Qty, stats.Pallets)
+
+
+def add_to(model, key, orders, qty, pallets, **extra):
+    updated = model.objects.filter(**key).update(
+        Orders=F('Orders') + orders, Qty=F('Qty') + qty, Pallets=F('Pallets') + pallets, **extra
+    )
+    if not updated:
+        model.objects.create(**key, Orders=orders, Qty=qty, Pallets=pallets, **extra)
+
+
+def last_order_date(customer_id):
+    """Newest counted OrderDate, read backwards from dispatch_customer_date_idx."""
+    return (
+        Dispatch.objects.filter(Customer_id=customer_id).exclude(Status='cancelled')
+        .order_by('-OrderDate').values_list('OrderDate', flat=True).first()
+    )
+
+
+def refresh(dispatch_ids):
+    """Apply the changes of these dispatches to their customers' stats; returns the customers touched."""
+    dispatch_ids = sorted(dispatch_ids)
+    with transaction.atomic():
+        before = {s.pk: s for s in DispatchStats.objects.select_for_update().filter(pk__in=dispatch_ids)}
+        after = current_stats(dispatch_ids)
+
+        # (customer, month) -> [orders, qty, pallets] to add
+        deltas = defaultdict(lambda: [0, ZERO, ZERO])
+        changed = []
+        for pk in dispatch_ids:
+            old, new = before.get(pk), after.get(pk)
+            if stats_key(old) == stats_key(new):
+                continue
+            changed.append(pk)
+            for stats, sign in ((old, -1), (new, 1)):
+                if stats is not None:
+                    delta = deltas[(stats.customer_id, stats.Month)]
+                    delta[0] += sign
+                    delta[1] += sign * stats.Qty
+                    delta[2] += sign * stats.Pallets
+        if not changed:
+            return set()
+
+        DispatchStats.objects.filter(pk__in=[pk for pk in changed if pk in before]).delete()
+        DispatchStats.objects.bulk_create([after[pk] for pk in changed if pk in after])
+
+        lifetime = defaultdict(lambda: [0, ZERO, ZERO])
+        for (customer_id, month), delta in deltas.items():
+            if any(delta):
+                add_to(CustomerMonthStats, {'Customer_id': customer_id, 'Month': month}, *delta)
+            lifetime[customer_id] = [a + b for a, b in zip(lifetime[customer_id], delta)]
+        for customer_id, delta in lifetime.items():
+            add_to(CustomerStats, {'Customer_id': customer_id}, *delta,
+                   LastOrderDate=last_order_date(customer_id))
+    return set(lifetime)
+
+
+def rebuild(chunk_size=1000):
+    """Recompute every customer's stats from the dispatches; returns the number of dispatches read."""
+    with transaction.atomic():
+        DispatchStats.objects.all().delete()
+        CustomerMonthStats.objects.all().delete()
+        CustomerStats.objects.all().delete()
+        # With no DispatchStats left, refreshing every dispatch adds each one from scratch
+        dispatch_ids = list(Dispatch.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(dispatch_ids), chunk_size):
+            refresh(dispatch_ids[start:start + chunk_size])
+    return len(dispatch_ids)
+
+
+def for_customer(customer_id, today):
+    """(lifetime CustomerStats or None, trailing-window totals): two indexed lookups."""
+    lifetime = CustomerStats.objects.filter(Customer_id=customer_id).first()
+    trailing = CustomerMonthStats.objects.filter(
+        Customer_id=customer_id, Month__gte=trailing_start(today),
+    ).aggregate(orders=Sum('Orders'), qty=Sum('Qty'), pallets=Sum('Pallets'))
+    return lifetime, trailing
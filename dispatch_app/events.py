@@ -0,0 +1,156 @@
+# dispatch_app/events.py
+"""Live updates for the home page over server-sent events (/events/home/).
+
+The watermark is ChangeLog.id, the auto-increment primary key that every
+dispatch and line change writes (see models.ChangeLog). Each process reads
+the newest id at most once per HOME_EVENTS_POLL_SECONDS, however many
+pages are open; streams that are already up to date run no query at all.
+A stream behind the watermark reads its ChangeLog rows (a primary-key
+range), the changed dispatches and the status counts: three queries for
+any number of changes.
+
+Events are small JSON objects:
+
+    event: dispatch   {"id": 12, "status": "shipped", "lines": 4, "urgency": ""}
+    event: dispatch   {"id": 13, "deleted": true}
+    event: counts     {"total": 120, "draft": 8, "confirmed": 30, ...}
+
+The counts event carries the cursor as its SSE id, so a reconnecting
+EventSource resumes from Last-Event-ID without missing anything. A stream
+ends after HOME_EVENTS_MAX_SECONDS and the browser reconnects by itself.
+
+Under WSGI a stream would be collected whole before anything is sent, so
+the view answers with pending_events() instead: whatever changed, then the
+response ends. EventSource reconnects after RETRY_MS, which turns it into
+short polling on the same cursor without holding a worker thread.
+"""
+import asyncio
+import json
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .models import ChangeLog, Dispatch
+
+BATCH = 500  # ChangeLog rows read per poll
+RETRY_MS = 5000  # how long the browser waits before reconnecting
+
+
+def status_count_aggregates():
+    """aggregate() arguments for the home counters: total plus one per status."""
+    return {
+        'total': Count('pk'),
+        **{key: Count('pk', filter=Q(Status=key)) for key, _ in Dispatch.STATUS_CHOICES},
+    }
+
+
+def urgency(status, loading_date, today):
+    """'past'/'soon' for drafts whose loading date has passed/is close (as highlighted on home)."""
+    if status != 'draft' or not loading_date:
+        return ''
+    if loading_date < today:
+        return 'past'
+    if loading_date <= today + timedelta(days=3):
+        return 'soon'
+    return ''
+
+
+def sse(data, event=None, id=None):
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    if id is not None:
+        lines.append(f'id: {id}')
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def latest_cursor():
+    return await ChangeLog.objects.order_by('-id').values_list('id', flat=True).afirst() or 0
+
+
+class Watermark:
+    """The newest ChangeLog id, shared by every stream in this process."""
+    def __init__(self):
+        self.value = 0
+        self.read_at = None
+
+    async def get(self, max_age):
+        now = time.monotonic()
+        if self.read_at is None or now - self.read_at >= max_age:
+            # Set first: streams polling meanwhile reuse the old value instead of querying too
+            self.read_at = now
+            self.value = await latest_cursor()
+        return self.value
+
+
+watermark = Watermark()
+
+
+async def changes_since(cursor):
+    """(new cursor, SSE messages) for the changes after cursor."""
+    rows = [
+        row async for row in
+        ChangeLog.objects.filter(id__gt=cursor).order_by('id').values_list('id', 'dispatch_id')[:BATCH]
+    ]
+    if not rows:
+        return cursor, []
+    cursor = rows[-1][0]
+    changed = list(dict.fromkeys(dispatch_id for _, dispatch_id in rows))  # in order, once each
+
+    found = {
+        row['DispatchID']: row async for row in
+        Dispatch.objects.filter(pk__in=changed).annotate(line_count=Count('details'))
+        .values('DispatchID', 'Status', 'LoadingDate', 'line_count')
+    }
+    today = date.today()
+    messages = []
+    for dispatch_id in changed:
+        row = found.get(dispatch_id)
+        if row is None:
+            messages.append(sse({'id': dispatch_id, 'deleted': True}, event='dispatch'))
+        else:
+            messages.append(sse({
+                'id': dispatch_id,
+                'status': row['Status'],
+                'lines': row['line_count'],
+                'urgency': urgency(row['Status'], row['LoadingDate'], today),
+            }, event='dispatch'))
+    counts = await Dispatch.objects.aaggregate(**status_count_aggregates())
+    messages.append(sse(counts, event='counts', id=cursor))
+    return cursor, messages
+
+
+async def home_stream(cursor):
+    """The event stream for one open home page, starting after cursor."""
+    poll = getattr(settings, 'HOME_EVENTS_POLL_SECONDS', 2)
+    heartbeat = getattr(settings, 'HOME_EVENTS_HEARTBEAT_SECONDS', 15)
+    max_seconds = getattr(settings, 'HOME_EVENTS_MAX_SECONDS', 300)
+
+    started = quiet_since = time.monotonic()
+    yield f'retry: {RETRY_MS}\n\n'
+    while True:
+        if await watermark.get(poll) > cursor:
+            cursor, messages = await changes_since(cursor)
+            for message in messages:
+                yield message
+            quiet_since = time.monotonic()
+        elif time.monotonic() - quiet_since >= heartbeat:
+            # A comment line: keeps proxies from closing an idle connection
+            yield ': keepalive\n\n'
+            quiet_since = time.monotonic()
+        if time.monotonic() - started >= max_seconds:
+            return
+        await asyncio.sleep(poll)
+
+
+async def pending_events(cursor):
+    """One short poll (for WSGI): the retry delay and the changes after cursor, if any."""
+    poll = getattr(settings, 'HOME_EVENTS_POLL_SECONDS', 2)
+    messages = [f'retry: {RETRY_MS}\n\n']
+    if await watermark.get(poll) > cursor:
+        _, changes = await changes_since(cursor)
+        messages.extend(changes)
+    return ''.join(messages)
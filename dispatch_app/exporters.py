@@ -0,0 +1,99 @@
+# dispatch_app/exporters.py
+"""Shared plumbing for the export_* management commands.
+
+Each exporter writes one table in the exact layout its import_* counterpart
+reads (same sheet name, same headers), so a file can be moved to another
+site and imported there. Rows are streamed from the database with
+.iterator() into a write-only workbook or a CSV writer, so memory use does
+not grow with the size of the table.
+"""
+import csv
+import gzip
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+import openpyxl
+
+from .importers import is_csv
+
+
+def csv_cell(value):
+    """Format a value the way the CSV importers parse it back."""
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class ExportCommand(BaseCommand):
+    """Base class for the exporters.
+
+    Subclasses set sheet_name and columns ([(header, queryset field), ...])
+    and implement get_queryset().
+    """
+    sheet_name = None
+    columns = []
+    default_chunk_size = 2000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=f"{self.sheet_name}.xlsx",
+                            help='Output .xlsx, .csv or .csv.gz file (default: %(default)s)')
+        parser.add_argument('--chunk-size', type=int, default=self.default_chunk_size,
+                            help='Rows fetched from the database per round trip (default: %(default)s)')
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def get_columns(self, options):
+        return self.columns
+
+    def handle(self, *args, **options):
+        path = options['path']
+        columns = self.get_columns(options)
+        headers = [header for header, _ in columns]
+        rows = (
+            self.get_queryset()
+            .values_list(*[field for _, field in columns])
+            .iterator(chunk_size=max(1, options['chunk_size']))
+        )
+
+        start = time.perf_counter()
+        if is_csv(path):
+            count = self.write_csv(path, headers, rows)
+        else:
+            count = self.write_xlsx(path, headers, rows)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Exported {count} rows to {path} in {elapsed:.1f}s "
+                f"({count / elapsed if elapsed else 0:.0f} rows/s)"
+            )
+        )
+
+    def write_csv(self, path, headers, rows):
+        opener = gzip.open if path.lower().endswith('.gz') else open
+        count = 0
+        with opener(path, 'wt', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            for row in rows:
+                writer.writerow([csv_cell(v) for v in row])
+                count += 1
+        return count
+
+    def write_xlsx(self, path, headers, rows):
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet(self.sheet_name)
+        sheet.append(headers)
+        count = 0
+        for row in rows:
+            sheet.append(row)
+            count += 1
+        workbook.save(path)
+        return count
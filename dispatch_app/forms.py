@@ -1,6 +1,76 @@
 from django import forms
-from .models import Dispatch, DispatchDetails, Customer, Products
+from django.db.models import F
+from .models import Dispatch, DispatchDetails, Customer, Products, ImportJob
 from django.forms import inlineformset_factory, BaseInlineFormSet
+from django.forms.models import ModelChoiceIterator
+from . import master_cache
+
+
+class CachedChoiceIterator(ModelChoiceIterator):
+    """Build the <option>s from the master-data cache instead of the queryset."""
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in self.field.cached_rows():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.cached_rows()) + (1 if self.field.empty_label is not None else 0)
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField that renders and validates from a master_cache cache.
+
+    The stock field runs its queryset once to render and once more to
+    validate, for every form in a formset.
+    """
+    iterator = CachedChoiceIterator
+    cache = None
+    sort_key = None
+
+    def __init__(self, queryset, **kwargs):
+        self.include_keys = set()  # e.g. an inactive customer still on the instance
+        super().__init__(queryset, **kwargs)
+
+    def cached_rows(self):
+        rows = self.cache.all(key=self.sort_key)
+        listed = {obj.pk for obj in rows}
+        extra = [self.cache.get(k) for k in self.include_keys if k not in listed]
+        return rows + [obj for obj in extra if obj is not None]
+
+    def offers(self, obj):
+        """Whether obj is one of the choices (get() also finds rows outside the cached set)."""
+        return True
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            key = self.queryset.model._meta.pk.to_python(value)
+        except forms.ValidationError:
+            key = None
+        obj = self.cache.get(key) if key is not None else None
+        if obj is None or not self.offers(obj):
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return obj
+
+
+class ProductChoiceField(CachedModelChoiceField):
+    cache = master_cache.products
+    sort_key = staticmethod(lambda p: p.Code)
+
+
+class CustomerChoiceField(CachedModelChoiceField):
+    # Active customers only, plus whoever is already on the dispatch
+    cache = master_cache.customers
+    sort_key = staticmethod(lambda c: c.pk)
+
+    def offers(self, obj):
+        return obj.Status or obj.pk in self.include_keys
 
 
 class CustomDispatchDetailsFormSet(BaseInlineFormSet):
@@ -30,6 +100,9 @@ class CustomDispatchDetailsFormSet(BaseInlineFormSet):
                     pass  # Can't clear these easily, but empty rows won't have them
 
 class DispatchForm(forms.ModelForm):
+    # Dispatch.version when the page was opened; a mismatch means someone else saved since
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
     class Meta:
         model = Dispatch
         fields = [
@@ -45,13 +118,46 @@ class DispatchForm(forms.ModelForm):
             'Address': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
             'Customer': forms.Select(attrs={'class': 'form-control'}),
         }
+        field_classes = {'Customer': CustomerChoiceField}
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        if self.instance.Customer_id:
+            self.fields['Customer'].include_keys = {self.instance.Customer_id}
+        if self.instance.pk:
+            self.fields['version'].initial = self.instance.version
         for field_name, field in self.fields.items():
-            if field_name not in ['Address'] and 'class' not in field.widget.attrs:
+            if field_name not in ['Address', 'version'] and 'class' not in field.widget.attrs:
                 field.widget.attrs['class'] = 'form-control'
 
+    STALE_MESSAGE = ('This dispatch was changed by someone else after you opened it. '
+                     'Reload the page to see their changes, then edit again.')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        version = cleaned_data.get('version')
+        if self.instance.pk and version is not None and version != self.instance.version:
+            raise forms.ValidationError(self.STALE_MESSAGE, code='stale')
+        return cleaned_data
+
+    def claim_version(self):
+        """Bump Dispatch.version if it is still the one the page was opened with (as api.claim_version).
+
+        clean() only compares; two submits can both pass it. Run this in the
+        saving transaction, before save(): the conditional UPDATE lets one
+        of them through and reports the other as stale (adding the error).
+        """
+        expected = self.cleaned_data.get('version')
+        if expected is None:
+            expected = self.instance.version
+        claimed = Dispatch.objects.filter(pk=self.instance.pk, version=expected).update(version=F('version') + 1)
+        if not claimed:
+            self.add_error(None, forms.ValidationError(self.STALE_MESSAGE, code='stale'))
+            return False
+        # save() bumps the loaded version again: it writes expected + 1, the value just claimed
+        self.instance.version = expected
+        return True
+
 # forms.py
 class DispatchDetailsForm(forms.ModelForm):
     class Meta:
@@ -99,11 +205,11 @@ class DispatchDetailsForm(forms.ModelForm):
                 'type': 'date'
             }),  # ✅ editable
         }
+        field_classes = {'Code': ProductChoiceField}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if 'Code' in self.fields:
-            self.fields['Code'].queryset = Products.objects.all()
             self.fields['Code'].empty_label = "Select a product"
         
         # Make non-editable fields not required (since they're auto-filled)
@@ -191,6 +297,22 @@ class CustomerForm(forms.ModelForm):
             if field_name != 'Address' and field_name != 'Status' and 'class' not in field.widget.attrs:
                 field.widget.attrs['class'] = 'form-control'
 
+class ImportJobForm(forms.ModelForm):
+    class Meta:
+        model = ImportJob
+        fields = ['kind', 'file', 'sheet']
+        widgets = {
+            'kind': forms.Select(attrs={'class': 'form-control'}),
+            'file': forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.xlsx,.csv,.gz'}),
+            'sheet': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Default sheet'}),
+        }
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.xlsx', '.csv', '.csv.gz')):
+            raise forms.ValidationError('Upload an .xlsx, .csv or .csv.gz file.')
+        return upload
+
 
 # Create inline formset for DispatchDetails
 DispatchDetailsFormSet = inlineformset_factory(
@@ -0,0 +1,88 @@
+# dispatch_app/fragments.py
+"""Cached HTML for the home rows and the printable documents.
+
+Nothing is ever deleted from this cache. A fragment's key contains
+everything its HTML depends on:
+
+* the dispatch: DispatchID, version and updated_at (every save bumps them);
+* its lines: the newest ChangeLog id for the dispatch (every line save and
+  delete writes one, including imports and the API), or the line count
+  for a home row;
+* the master data: the Customer/Products TableVersion that master_cache
+  has loaded;
+* whatever else the fragment shows (today's date, is_superuser).
+
+So any change produces a new key on the next request, and the old entry
+ages out of the "fragments" cache (settings.CACHES). Pointing that alias
+at Redis or memcached shares the fragments between worker processes.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from . import master_cache
+from .models import ChangeLog
+
+CACHE_ALIAS = 'fragments'
+
+
+def fragment_cache():
+    return caches[CACHE_ALIAS if CACHE_ALIAS in settings.CACHES else 'default']
+
+
+def dispatch_version(dispatch):
+    return f"{dispatch.pk}.{dispatch.version}.{dispatch.updated_at.timestamp() if dispatch.updated_at else 0}"
+
+
+def lines_version(dispatch):
+    """Latest ChangeLog id for the dispatch: changes whenever one of its lines does."""
+    return ChangeLog.objects.filter(dispatch_id=dispatch.pk).aggregate(v=Max('id'))['v'] or 0
+
+
+def cached_document(name, request, dispatch, render):
+    """The rendered page for a printable document, rendering it with render() on a miss."""
+    key = ':'.join(str(part) for part in (
+        name,
+        dispatch_version(dispatch),
+        lines_version(dispatch),
+        master_cache.customers.version(),
+        master_cache.products.version(),
+        int(request.user.is_superuser),
+    ))
+    cache = fragment_cache()
+    html = cache.get(key)
+    if html is None:
+        html = render()
+        cache.set(key, html)
+    return html
+
+
+def home_rows(request, dispatches, today, soon_date):
+    """Set dispatch.row_html on every dispatch: one get_many, and only the misses are rendered."""
+    common = (master_cache.customers.version(), today.isoformat(), int(request.user.is_superuser))
+    keys = {
+        d.pk: ':'.join(str(part) for part in ('home_row', dispatch_version(d), d.line_count, *common))
+        for d in dispatches
+    }
+    cache = fragment_cache()
+    found = cache.get_many(keys.values())
+
+    missing = [d for d in dispatches if keys[d.pk] not in found]
+    if missing:
+        customers = master_cache.customers.get_many(d.Customer_id for d in missing)
+        template = get_template('home_row.html')
+        rendered = {}
+        for d in missing:
+            if d.Customer_id in customers:
+                d.Customer = customers[d.Customer_id]
+            rendered[keys[d.pk]] = template.render({
+                'dispatch': d, 'user': request.user, 'today': today, 'soon_date': soon_date,
+            })
+        cache.set_many(rendered)
+        found.update(rendered)
+
+    for d in dispatches:
+        d.row_html = mark_safe(found[keys[d.pk]])
+    return dispatches
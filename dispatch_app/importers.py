@@ -0,0 +1,429 @@
+# dispatch_app/importers.py
+"""Shared plumbing for the import_* management commands.
+
+Each command subclasses ImportCommand and only describes its own sheet:
+which columns are required, how a raw row is resolved into model data and
+how a resolved batch is written. Reading, batching, timing, dry-run and the
+error report live here so all four importers behave the same way.
+"""
+import csv
+import gzip
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+import openpyxl
+
+from .models import TableVersion
+
+
+# Skipping the rows of a resumed job writes no batch; report progress this often meanwhile
+SKIP_HEARTBEAT_ROWS = 5000
+
+
+class ImportFileError(Exception):
+    """The input file cannot be imported at all (missing sheet, columns...)."""
+
+
+# 🗓️ Helpers shared by every importer
+
+def parse_date(val, formats=("%Y-%m-%d", "%d/%m/%Y")):
+    if val is None or val == '':
+        return None
+    if isinstance(val, datetime):
+        return val.date()
+    if isinstance(val, date):
+        return val
+    if isinstance(val, str):
+        for fmt in formats:
+            try:
+                return datetime.strptime(val.strip(), fmt).date()
+            except ValueError:
+                continue
+    return None
+
+
+def to_decimal(val):
+    if val is None or val == '':
+        return None
+    try:
+        return Decimal(str(val).strip())
+    except (InvalidOperation, ValueError, TypeError):
+        return None
+
+
+def to_bool(val, default=True):
+    if val is None or val == '':
+        return default
+    if isinstance(val, str):
+        return val.strip().lower() not in ('0', 'false', 'no', 'n', 'inactive')
+    return bool(val)
+
+
+def text(val):
+    """Cell value as a stripped string (Excel hands back ints for numeric codes)."""
+    if val is None:
+        return ''
+    if isinstance(val, float) and val.is_integer():
+        val = int(val)
+    return str(val).strip()
+
+
+# 📄 Reading
+
+def is_csv(path):
+    return path.lower().endswith(('.csv', '.csv.gz'))
+
+
+def read_rows(path, sheet=None):
+    """Return (headers, iterator of (row_number, row_dict)) for the input file.
+
+    .csv and .csv.gz files are streamed with the csv module; anything else is
+    opened as a workbook in openpyxl's read-only mode.
+    """
+    if is_csv(path):
+        return read_csv_rows(path)
+    return read_excel_rows(path, sheet)
+
+
+def read_csv_rows(path):
+    if path.lower().endswith('.gz'):
+        handle = gzip.open(path, 'rt', encoding='utf-8-sig', newline='')
+    else:
+        handle = open(path, encoding='utf-8-sig', newline='')
+
+    reader = csv.reader(handle)
+    try:
+        headers = [h.strip() for h in next(reader)]
+    except StopIteration:
+        handle.close()
+        raise ImportFileError("The file is empty (no header row).")
+
+    def iterator():
+        # Row numbers match what a spreadsheet shows (header is row 1)
+        try:
+            for idx, row in enumerate(reader, start=2):
+                if not any(row):
+                    continue
+                # Empty cells become None, same as openpyxl hands back
+                yield idx, {h: (v if v != '' else None) for h, v in zip(headers, row)}
+        finally:
+            handle.close()
+
+    return headers, iterator()
+
+
+def read_excel_rows(path, sheet=None):
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    if sheet:
+        if sheet not in workbook.sheetnames:
+            workbook.close()
+            raise ImportFileError(f'Sheet "{sheet}" not found. Available sheets: {workbook.sheetnames}')
+        worksheet = workbook[sheet]
+    else:
+        worksheet = workbook.active
+
+    rows = worksheet.iter_rows(values_only=True)
+    try:
+        headers = [h.strip() if isinstance(h, str) else h for h in next(rows)]
+    except StopIteration:
+        workbook.close()
+        raise ImportFileError("The sheet is empty (no header row).")
+
+    def iterator():
+        try:
+            for idx, row in enumerate(rows, start=2):
+                if row is None or all(v is None for v in row):
+                    continue
+                yield idx, dict(zip(headers, row))
+        finally:
+            workbook.close()
+
+    return headers, iterator()
+
+
+def default_error_report_path(path):
+    base = os.path.basename(path)
+    for ext in ('.csv.gz', '.xlsx', '.csv'):
+        if base.lower().endswith(ext):
+            base = base[:-len(ext)]
+            break
+    return os.path.join(os.path.dirname(os.path.abspath(path)), f"{base}_errors.xlsx")
+
+
+class ErrorReport:
+    """Collects row-level import errors into an .xlsx or .csv file.
+
+    The file is only created when the first error arrives, and rows are
+    streamed out as they come so a badly broken input doesn't pile up in memory.
+    With append=True an existing CSV report is continued (resumed import jobs).
+    """
+
+    def __init__(self, path, headers, append=False):
+        self.path = path
+        self.headers = [h for h in headers if h is not None]
+        self.append = append
+        self.count = 0
+        self._workbook = None
+        self._sheet = None
+        self._file = None
+        self._writer = None
+
+    def _open(self):
+        columns = ['Row', 'Error'] + [str(h) for h in self.headers]
+        if self.path.lower().endswith('.csv'):
+            continuing = self.append and os.path.exists(self.path) and os.path.getsize(self.path) > 0
+            self._file = open(self.path, 'a' if continuing else 'w', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._file)
+            if not continuing:
+                self._writer.writerow(columns)
+        else:
+            self._workbook = openpyxl.Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet("Errors")
+            self._sheet.append(columns)
+
+    def add(self, row_number, message, row_data=None):
+        if self.count == 0:
+            self._open()
+        self.count += 1
+        row_data = row_data or {}
+        values = [row_number, message] + [row_data.get(h) for h in self.headers]
+        if self._writer:
+            self._writer.writerow(values)
+        else:
+            self._sheet.append(values)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+        if self._workbook:
+            self._workbook.save(self.path)
+
+
+class PhaseTimer:
+    """Accumulates wall-clock time per import phase (read, resolve, write)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+# 🔄 Base command
+
+class ImportCommand(BaseCommand):
+    """Base class for the Excel/CSV importers.
+
+    Subclasses set default_path / default_sheet / required_columns and
+    implement resolve_batch() and write_batch(). Importers of master data set
+    versioned_model; bulk writes don't send signals, so its TableVersion is
+    bumped here for every batch that changed something.
+    """
+    default_path = None
+    default_sheet = None
+    required_columns = set()
+    versioned_model = None
+    default_batch_size = 500
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=self.default_path,
+                            help='Input .xlsx, .csv or .csv.gz file (default: %(default)s)')
+        parser.add_argument('--sheet', default=self.default_sheet,
+                            help='Worksheet name, ignored for CSV '
+                                 '(default: %(default)s, active sheet if empty)')
+        parser.add_argument('--batch-size', type=int, default=self.default_batch_size,
+                            help='Rows resolved and written per batch (default: %(default)s)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Run the whole import but roll back every write')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Only import the first N data rows')
+        parser.add_argument('--error-report', default=None,
+                            help='Where to write rejected rows (.xlsx or .csv, '
+                                 'default: <input>_errors.xlsx next to the input)')
+
+    # -- hooks ---------------------------------------------------------------
+
+    def missing_columns(self, headers):
+        return set(self.required_columns) - set(headers)
+
+    def prepare(self):
+        """Called once before the first batch (e.g. to preload lookups)."""
+
+    def resolve_batch(self, batch):
+        """Turn [(row_number, row_data), ...] into [(row_number, row_data, payload), ...].
+
+        Rows that can't be imported are passed to self.reject() and dropped.
+        """
+        raise NotImplementedError
+
+    def write_batch(self, resolved):
+        """Persist resolved rows, return (created, updated)."""
+        raise NotImplementedError
+
+    # -- helpers for subclasses ------------------------------------------------
+
+    def reject(self, row_number, message, row_data=None):
+        # Held back until the batch is committed, so a batch that is redone
+        # after a crash doesn't report its errors twice
+        self._pending_errors.append((row_number, message, row_data))
+
+    # -- driver --------------------------------------------------------------
+
+    def handle(self, *args, **options):
+        # CommandError: a failed import exits non-zero, so scripts and cron notice
+        path = options['path']
+        if not path or not os.path.exists(path):
+            raise CommandError(f"File not found: {path}")
+
+        try:
+            self.run(
+                path,
+                sheet=options['sheet'],
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+                limit=options['limit'],
+                error_report_path=options['error_report'],
+            )
+        except ImportFileError as e:
+            raise CommandError(str(e))
+        except Exception as e:
+            raise CommandError(f"❌ Fatal error: {e}") from e
+
+        self.report(self.totals, self.timer, options['dry_run'])
+
+    def run(self, path, sheet=None, batch_size=None, dry_run=False, limit=None,
+            error_report_path=None, resume_after=0, on_batch=None, on_skip=None):
+        """Import the file batch by batch, return the totals.
+
+        Each batch is committed in its own transaction (unless dry_run). Rows
+        numbered up to resume_after are skipped, and on_batch(last_row, totals)
+        is called inside each batch's transaction, so progress saved there is
+        committed together with the rows it describes. While skipping,
+        on_skip(row_number) is called every SKIP_HEARTBEAT_ROWS rows.
+        """
+        batch_size = max(1, batch_size or self.default_batch_size)
+        headers, rows = read_rows(path, sheet)
+
+        self.stdout.write(f"Headers found: {headers}")
+        missing = self.missing_columns(headers)
+        if missing:
+            raise ImportFileError(f"Missing required columns: {missing}")
+
+        self.headers = headers
+        self.error_report = ErrorReport(
+            error_report_path or default_error_report_path(path), headers, append=resume_after > 0
+        )
+        self._pending_errors = []
+        # Kept on the instance so callers (e.g. benchmark_imports) can read them back
+        self.timer = timer = PhaseTimer()
+        self.totals = totals = {'rows': 0, 'created': 0, 'updated': 0}
+        skipped = 0
+
+        try:
+            with transaction.atomic() if dry_run else nullcontext():
+                self.prepare()
+                while limit is None or totals['rows'] < limit:
+                    take = batch_size if limit is None else min(batch_size, limit - totals['rows'])
+                    with timer.phase('read'):
+                        batch = []
+                        for item in rows:
+                            if item[0] <= resume_after:
+                                skipped += 1
+                                if on_skip and skipped % SKIP_HEARTBEAT_ROWS == 0:
+                                    on_skip(item[0])
+                                continue
+                            batch.append(item)
+                            if len(batch) >= take:
+                                break
+                    if not batch:
+                        break
+
+                    with timer.phase('resolve'):
+                        resolved = self.resolve_batch(batch)
+                    with timer.phase('write'):
+                        with transaction.atomic():
+                            created, updated = self._write(resolved)
+                            totals['rows'] += len(batch)
+                            totals['created'] += created
+                            totals['updated'] += updated
+                            if self.versioned_model and (created or updated):
+                                TableVersion.bump(self.versioned_model)
+                            if on_batch:
+                                on_batch(batch[-1][0], totals)
+                        self._flush_errors()
+
+                    elapsed = timer.elapsed
+                    self.stdout.write(
+                        f"  {totals['rows']} rows  "
+                        f"{totals['rows'] / elapsed if elapsed else 0:.0f} rows/s  "
+                        f"{elapsed:.1f}s elapsed"
+                    )
+
+                if dry_run:
+                    transaction.set_rollback(True)
+        finally:
+            self.error_report.close()
+
+        return totals
+
+    @property
+    def error_count(self):
+        return self.error_report.count + len(self._pending_errors)
+
+    def _flush_errors(self):
+        for error in self._pending_errors:
+            self.error_report.add(*error)
+        self._pending_errors = []
+
+    def _write(self, resolved):
+        """Write a batch atomically; if it fails, retry row by row to find the culprits."""
+        if not resolved:
+            return 0, 0
+        try:
+            with transaction.atomic():
+                return self.write_batch(resolved)
+        except Exception:
+            created = updated = 0
+            for item in resolved:
+                try:
+                    with transaction.atomic():
+                        c, u = self.write_batch([item])
+                except Exception as e:
+                    self.reject(item[0], f"Failed to save - {e}", item[1])
+                    continue
+                created += c
+                updated += u
+            return created, updated
+
+    def report(self, totals, timer, dry_run):
+        for name in ('read', 'resolve', 'write'):
+            seconds = timer.totals.get(name, 0.0)
+            rate = totals['rows'] / seconds if seconds else 0
+            self.stdout.write(f"  {name:<8} {seconds:8.2f}s  {rate:10.0f} rows/s")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Import finished{' (dry run, nothing saved)' if dry_run else ''}!\n"
+                f"Rows: {totals['rows']} in {timer.elapsed:.1f}s\n"
+                f"Created: {totals['created']}\n"
+                f"Updated: {totals['updated']}\n"
+                f"Errors: {self.error_report.count}"
+            )
+        )
+        if self.error_report.count:
+            self.stdout.write(self.style.WARNING(f"Rejected rows written to {self.error_report.path}"))
@@ -0,0 +1,113 @@
+# dispatch_app/management/commands/benchmark_imports.py
+import csv
+import gzip
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+import openpyxl
+
+from dispatch_app.models import Customer, Dispatch, Products
+from dispatch_app.management.commands.import_dispatch_details import Command as ImportDetailsCommand
+
+HEADERS = ["DispatchID", "Code", "LocalCode", "Description", "UOM", "PackInCarton",
+           "Qty", "ParPallet", "ProductionDate", "ExpairyDate"]
+
+
+class Command(BaseCommand):
+    help = 'Compare xlsx vs csv vs csv.gz import speed of the same DispatchDetails dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500000,
+                            help='Number of DispatchDetails lines to generate (default: %(default)s)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', default=None,
+                            help='Write the generated files to this folder and keep them')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        rng = random.Random(options['seed'])
+        workdir = options['keep'] or tempfile.mkdtemp(prefix='import_bench_')
+        os.makedirs(workdir, exist_ok=True)
+
+        # Everything (fixtures + imports) is rolled back at the end
+        with transaction.atomic():
+            customer = Customer.objects.create(Customer='Benchmark Customer')
+            products = Products.objects.bulk_create(
+                Products(Code=f'BENCH-{i:04d}', Description=f'Benchmark product {i}',
+                         UOM='CTN', ParPallet=60, PacInCtn=12)
+                for i in range(200)
+            )
+            dispatches = Dispatch.objects.bulk_create(
+                Dispatch(OrderNo=f'BENCH-{i:06d}', Customer=customer, OrderDate=date(2025, 1, 1))
+                for i in range(max(1, rows // 50))
+            )
+            dispatch_ids = [d.DispatchID for d in dispatches]
+            codes = [p.Code for p in products]
+
+            self.stdout.write(f"Generating {rows} lines in {workdir} ...")
+            start = time.perf_counter()
+            files = self.generate(workdir, rows, rng, dispatch_ids, codes)
+            self.stdout.write(f"  generated in {time.perf_counter() - start:.1f}s")
+
+            results = []
+            for label, path in files:
+                command = ImportDetailsCommand()
+                start = time.perf_counter()
+                call_command(command, path=path, batch_size=options['batch_size'],
+                             dry_run=True, stdout=StringIO())
+                total = time.perf_counter() - start
+                results.append((label, os.path.getsize(path), total, command.timer.totals))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"\n{'format':<8} {'size MB':>8} {'read s':>8} {'resolve s':>10} "
+                          f"{'write s':>8} {'total s':>8} {'rows/s':>9}")
+        for label, size, total, phases in results:
+            self.stdout.write(
+                f"{label:<8} {size / 1e6:8.1f} {phases.get('read', 0):8.2f} "
+                f"{phases.get('resolve', 0):10.2f} {phases.get('write', 0):8.2f} "
+                f"{total:8.2f} {rows / total if total else 0:9.0f}"
+            )
+
+        if not options['keep']:
+            for _, path in files:
+                os.remove(path)
+            os.rmdir(workdir)
+
+    def generate(self, workdir, rows, rng, dispatch_ids, codes):
+        """Write the same random dataset as .xlsx, .csv and .csv.gz."""
+        xlsx_path = os.path.join(workdir, 'DispatchDetails.xlsx')
+        csv_path = os.path.join(workdir, 'DispatchDetails.csv')
+        gz_path = os.path.join(workdir, 'DispatchDetails.csv.gz')
+
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('DispatchDetails')
+        sheet.append(HEADERS)
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f, \
+                gzip.open(gz_path, 'wt', newline='', encoding='utf-8') as gz:
+            plain, packed = csv.writer(f), csv.writer(gz)
+            plain.writerow(HEADERS)
+            packed.writerow(HEADERS)
+            for i in range(rows):
+                produced = date(2025, 1, 1) + timedelta(days=rng.randrange(365))
+                # 50 distinct products per dispatch, so every line is a new row
+                code = codes[i % 50 + 50 * (i // 50 % 4)]
+                row = [
+                    dispatch_ids[i // 50 % len(dispatch_ids)], code, '', f'Line {i}', 'CTN', '12',
+                    str(rng.randrange(1, 2000)), '60',
+                    produced.isoformat(), (produced + timedelta(days=270)).isoformat(),
+                ]
+                plain.writerow(row)
+                packed.writerow(row)
+                sheet.append([row[0], code, None, row[3], 'CTN', 12, int(row[6]), 60,
+                              produced, produced + timedelta(days=270)])
+        workbook.save(xlsx_path)
+        return [('xlsx', xlsx_path), ('csv', csv_path), ('csv.gz', gz_path)]
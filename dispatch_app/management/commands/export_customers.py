@@ -0,0 +1,21 @@
+# dispatch_app/management/commands/export_customers.py
+from dispatch_app.exporters import ExportCommand
+from dispatch_app.models import Customer
+
+
+class Command(ExportCommand):
+    help = 'Export customers in the layout import_customers reads'
+
+    sheet_name = "Customers"
+    columns = [
+        ("Customer", "Customer"),
+        ("DispatchTo", "DispatchTo"),
+        ("Address", "Address"),
+        ("Country", "Country"),
+        ("ContactNo", "ContactNo"),
+        ("ContactPerson", "ContactPerson"),
+        ("Status", "Status"),
+    ]
+
+    def get_queryset(self):
+        return Customer.objects.order_by('CustomerID')
@@ -0,0 +1,42 @@
+# dispatch_app/management/commands/export_dispatch_details.py
+from dispatch_app.exporters import ExportCommand
+from dispatch_app.models import DispatchDetails
+
+
+class Command(ExportCommand):
+    help = 'Export DispatchDetails in the layout import_dispatch_details reads'
+
+    sheet_name = "DispatchDetails"
+    columns = [
+        ("ID", "ID"),
+        ("DispatchID", "DispatchID"),
+        ("OrderNo", "DispatchID__OrderNo"),  # stable across sites, DispatchID is not
+        ("Code", "Code"),
+        ("LocalCode", "LocalCode"),
+        ("Description", "Description"),
+        ("UOM", "UOM"),
+        ("PackInCarton", "PackInCarton"),
+        ("Qty", "Qty"),
+        ("ParPallet", "ParPallet"),
+        ("ProductionDate", "ProductionDate"),
+        ("ExpairyDate", "ExpairyDate"),
+    ]
+
+    # Database IDs only mean something in the database they came from: importing
+    # them at another site would overwrite whatever lines have those IDs there
+    site_local_columns = {"ID", "DispatchID"}
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--with-ids', action='store_true',
+                            help='Also write the ID and DispatchID columns, so lines are matched on '
+                                 'their IDs when imported back into this same database '
+                                 '(by default they are matched on OrderNo and Code)')
+
+    def get_columns(self, options):
+        if options['with_ids']:
+            return self.columns
+        return [c for c in self.columns if c[0] not in self.site_local_columns]
+
+    def get_queryset(self):
+        return DispatchDetails.objects.order_by('ID')
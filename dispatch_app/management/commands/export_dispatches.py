@@ -0,0 +1,29 @@
+# dispatch_app/management/commands/export_dispatches.py
+from dispatch_app.exporters import ExportCommand
+from dispatch_app.models import Dispatch
+
+
+class Command(ExportCommand):
+    help = 'Export dispatches in the layout import_dispatches reads'
+
+    sheet_name = "Dispatch"
+    columns = [
+        ("OrderNo", "OrderNo"),
+        ("InvoiceNo", "InvoiceNo"),
+        ("Customer", "Customer__Customer"),  # matched back by name on import
+        ("Address", "Address"),
+        ("Country", "Country"),
+        ("ContactNo", "ContactNo"),
+        ("ContactPerson", "ContactPerson"),
+        ("OrderDate", "OrderDate"),
+        ("LoadingDate", "LoadingDate"),
+        ("DeliveryDate", "DeliveryDate"),
+        ("TransportNo", "TransportNo"),
+        ("DriverName", "DriverName"),
+        ("DriverMobile", "DriverMobile"),
+        ("Seal", "Seal"),
+        ("Status", "Status"),
+    ]
+
+    def get_queryset(self):
+        return Dispatch.objects.order_by('DispatchID')
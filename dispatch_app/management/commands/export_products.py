@@ -0,0 +1,20 @@
+# dispatch_app/management/commands/export_products.py
+from dispatch_app.exporters import ExportCommand
+from dispatch_app.models import Products
+
+
+class Command(ExportCommand):
+    help = 'Export products in the layout import_products reads'
+
+    sheet_name = "Products"
+    columns = [
+        ("Code", "Code"),
+        ("LocalCode", "LocalCode"),
+        ("Description", "Description"),
+        ("ParPallet", "ParPallet"),
+        ("UOM", "UOM"),
+        ("PacInCtn", "PacInCtn"),
+    ]
+
+    def get_queryset(self):
+        return Products.objects.order_by('Code')
@@ -1,132 +1,116 @@
-# your_app/management/commands/import_dispatch_details.py
-import os
-from datetime import datetime
-from django.core.management.base import BaseCommand
-from django.core.exceptions import ObjectDoesNotExist
-from dispatch_app.models import DispatchDetails, Dispatch, Products
-import openpyxl
-
-class Command(BaseCommand):
-    help = 'Import DispatchDetails from Excel file'
-
-    def handle(self, *args, **options):
-        excel_file = r"C:\Users\samad\OneDrive - Atyab Food Industries\Documents\DispatchDetails.xlsx"
-        
-        if not os.path.exists(excel_file):
-            self.stdout.write(self.style.ERROR(f"File not found: {excel_file}"))
-            return
-
-        try:
-            workbook = openpyxl.load_workbook(excel_file)
-            sheet = workbook.active  # or use workbook["SheetName"] if needed
-
-            headers = [cell.value for cell in sheet[1]]
-            self.stdout.write(f"Headers: {headers}")
-
-            # Expected columns (adjust if your Excel uses different names)
-            required_cols = {"DispatchID", "Code", "Qty"}
-            missing = required_cols - set(headers)
-            if missing:
-                self.stdout.write(self.style.ERROR(f"Missing columns: {missing}"))
-                return
-
-            created = 0
-            updated = 0
-            errors = 0
-
-            for idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-                row_data = dict(zip(headers, row))
-                
-                # Get required fields
-                dispatch_id = row_data.get("DispatchID")
-                product_code = row_data.get("Code")
-                qty = row_data.get("Qty")
-
-                if not dispatch_id or not product_code or qty is None:
-                    self.stdout.write(self.style.WARNING(f"Row {idx}: Missing required data. Skipped."))
-                    errors += 1
-                    continue
-
-                # 🔍 Resolve Foreign Keys
-                try:
-                    dispatch = Dispatch.objects.get(DispatchID=dispatch_id)
-                    product = Products.objects.get(Code=product_code)
-                except Dispatch.DoesNotExist:
-                    self.stdout.write(self.style.ERROR(f"Row {idx}: DispatchID {dispatch_id} not found."))
-                    errors += 1
-                    continue
-                except Products.DoesNotExist:
-                    self.stdout.write(self.style.ERROR(f"Row {idx}: Product Code '{product_code}' not found."))
-                    errors += 1
-                    continue
-
-                # 🗓️ Parse dates
-                def parse_date(val):
-                    if val is None:
-                        return None
-                    if isinstance(val, datetime):
-                        return val.date()
-                    if isinstance(val, str):
-                        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y"):
-                            try:
-                                return datetime.strptime(val, fmt).date()
-                            except ValueError:
-                                continue
-                    return None
-
-                # Prepare data
-                detail_data = {
-                    "DispatchID": dispatch,
-                    "Code": product,
-                    "LocalCode": row_data.get("LocalCode") or "",
-                    "Description": row_data.get("Description") or "",
-                    "UOM": row_data.get("UOM") or "",
-                    "PackInCarton": self.to_decimal(row_data.get("PackInCarton")),
-                    "Qty": self.to_decimal(qty, max_digits=15, decimal_places=4),
-                    "ParPallet": self.to_decimal(row_data.get("ParPallet")),
-                    "ProductionDate": parse_date(row_data.get("ProductionDate")),
-                    "ExpairyDate": parse_date(row_data.get("ExpairyDate")),
-                }
-
-                # 🔄 Create or Update
-                # Option A: If Excel has "ID" column → use it
-                # Option B: Use natural key (DispatchID + Code) → safer if no ID
-
-                if "ID" in headers and row_data.get("ID"):
-                    # Update by ID
-                    obj, created_flag = DispatchDetails.objects.update_or_create(
-                        ID=row_data["ID"],
-                        defaults=detail_data
-                    )
+# dispatch_app/management/commands/import_dispatch_details.py
+from dispatch_app.importers import ImportCommand, parse_date, text, to_decimal
+from dispatch_app.models import ChangeLog, DispatchDetails, Dispatch, Products
+
+
+def to_int(val):
+    try:
+        return int(float(val))
+    except (ValueError, TypeError):
+        return None
+
+
+class Command(ImportCommand):
+    help = 'Import DispatchDetails from Excel or CSV file'
+
+    default_path = r"C:\Users\samad\OneDrive - Atyab Food Industries\Documents\DispatchDetails.xlsx"
+    default_sheet = None  # active sheet
+    # Expected columns (adjust if your Excel uses different names).
+    # An OrderNo column (as written by export_dispatch_details) can stand in
+    # for DispatchID, which differs from one site to the next.
+    required_columns = {"DispatchID", "Code", "Qty"}
+    date_formats = ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y")
+    fields = [
+        "DispatchID", "Code", "LocalCode", "Description", "UOM", "PackInCarton",
+        "Qty", "ParPallet", "ProductionDate", "ExpairyDate",
+    ]
+
+    def missing_columns(self, headers):
+        if "OrderNo" in headers:
+            return {"Code", "Qty"} - set(headers)
+        return super().missing_columns(headers)
+
+    def dispatch_key(self, row_data):
+        if self.by_order_no:
+            return text(row_data.get("OrderNo")) or None
+        return to_int(row_data.get("DispatchID"))
+
+    def prepare(self):
+        self.by_order_no = "OrderNo" in self.headers
+
+    def resolve_batch(self, batch):
+        # 🔍 Resolve Foreign Keys for the whole batch in two queries
+        dispatch_keys = {self.dispatch_key(r) for _, r in batch} - {None}
+        product_codes = {text(r.get("Code")) for _, r in batch} - {''}
+        dispatches = Dispatch.objects.only('DispatchID', 'OrderNo').in_bulk(
+            dispatch_keys, field_name='OrderNo' if self.by_order_no else 'pk'
+        )
+        products = Products.objects.only('Code').in_bulk(product_codes)
+
+        resolved = []
+        for idx, row_data in batch:
+            dispatch_key = self.dispatch_key(row_data)
+            product_code = text(row_data.get("Code"))
+            qty = to_decimal(row_data.get("Qty"))
+
+            if not dispatch_key or not product_code or qty is None:
+                self.reject(idx, "Missing required data", row_data)
+                continue
+            if dispatch_key not in dispatches:
+                label = "OrderNo" if self.by_order_no else "DispatchID"
+                self.reject(idx, f"{label} {dispatch_key} not found", row_data)
+                continue
+            if product_code not in products:
+                self.reject(idx, f"Product Code '{product_code}' not found", row_data)
+                continue
+
+            resolved.append((idx, row_data, {
+                "ID": to_int(row_data.get("ID")) if "ID" in self.headers else None,
+                "DispatchID": dispatches[dispatch_key],
+                "Code": products[product_code],
+                "LocalCode": text(row_data.get("LocalCode")),
+                "Description": text(row_data.get("Description")),
+                "UOM": text(row_data.get("UOM")),
+                "PackInCarton": to_decimal(row_data.get("PackInCarton")),
+                "Qty": qty,
+                "ParPallet": to_decimal(row_data.get("ParPallet")),
+                "ProductionDate": parse_date(row_data.get("ProductionDate"), self.date_formats),
+                "ExpairyDate": parse_date(row_data.get("ExpairyDate"), self.date_formats),
+            }))
+        return resolved
+
+    def write_batch(self, resolved):
+        # 🔄 Create or Update
+        # Option A: If the sheet has an "ID" column → match on it
+        # Option B: Use natural key (DispatchID + Code) → prevents duplicates
+        by_id = {p["ID"]: p for _, _, p in resolved if p["ID"]}
+        by_key = {(p["DispatchID"].pk, p["Code"].pk): p for _, _, p in resolved if not p["ID"]}
+
+        existing_by_id = DispatchDetails.objects.in_bulk(list(by_id))
+        existing_by_key = {}
+        if by_key:
+            qs = DispatchDetails.objects.filter(
+                DispatchID__in={k[0] for k in by_key},
+                Code__in={k[1] for k in by_key},
+            ).order_by('ID')
+            for detail in qs:
+                existing_by_key.setdefault((detail.DispatchID_id, detail.Code_id), detail)
+
+        to_create, to_update = [], []
+        for lookup, existing in ((by_id, existing_by_id), (by_key, existing_by_key)):
+            for key, payload in lookup.items():
+                detail = existing.get(key)
+                if detail is None:
+                    payload = dict(payload)
+                    if not payload["ID"]:
+                        payload.pop("ID")
+                    to_create.append(DispatchDetails(**payload))
                 else:
-                    # Update by (DispatchID, Code) — prevents duplicates
-                    obj, created_flag = DispatchDetails.objects.update_or_create(
-                        DispatchID=dispatch,
-                        Code=product,
-                        defaults=detail_data
-                    )
-
-                if created_flag:
-                    created += 1
-                else:
-                    updated += 1
-
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"✅ Import finished!\n"
-                    f"Created: {created}\n"
-                    f"Updated: {updated}\n"
-                    f"Errors: {errors}"
-                )
-            )
-
-        except Exception as e:
-            self.stderr.write(self.style.ERROR(f"❌ Error: {e}"))
-
-    def to_decimal(self, val, max_digits=10, decimal_places=2):
-        if val is None:
-            return None
-        try:
-            return float(val)
-        except (ValueError, TypeError):
-            return None
\ No newline at end of file
+                    for field in self.fields:
+                        setattr(detail, field, payload[field])
+                    to_update.append(detail)
+
+        DispatchDetails.objects.bulk_create(to_create)
+        DispatchDetails.objects.bulk_update(to_update, self.fields)
+        ChangeLog.record_many(to_create + to_update, 'save')  # bulk writes send no signals
+        return len(to_create), len(to_update)
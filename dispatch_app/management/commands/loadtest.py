@@ -0,0 +1,395 @@
+# dispatch_app/management/commands/loadtest.py
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from html.parser import HTMLParser
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from dispatch_app.models import Dispatch
+
+DEFAULT_MIX = 'home=30,dispatch_note=20,loading_sheet=15,reports=15,create=10,edit=10'
+SCENARIOS = ('home', 'dispatch_note', 'loading_sheet', 'pallet_labels', 'reports', 'create', 'edit')
+# Scenarios that need existing dispatches to open
+NEEDS_DISPATCHES = {'dispatch_note', 'loading_sheet', 'pallet_labels', 'edit'}
+
+
+class NoRedirect(HTTPRedirectHandler):
+    """Hand 3xx responses back as they are: a 302 after a form POST is the success signal."""
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class FormParser(HTMLParser):
+    """Collect what a browser would submit from the first POST form of a page.
+
+    values: field name -> submitted value (selected option, checked box, ...)
+    options: select name -> every non-empty option value
+    """
+    def __init__(self):
+        super().__init__()
+        self.values = {}
+        self.options = {}
+        self.in_form = self.done = False
+        self.select = self.textarea = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form' and not self.done and attrs.get('method', '').lower() == 'post':
+            self.in_form = True
+        if not self.in_form:
+            return
+        name = attrs.get('name')
+        if tag == 'input' and name:
+            kind = attrs.get('type', 'text').lower()
+            if kind in ('checkbox', 'radio'):
+                if 'checked' in attrs:
+                    self.values[name] = attrs.get('value', 'on')
+            elif kind not in ('submit', 'button', 'file', 'reset'):
+                self.values[name] = attrs.get('value') or ''
+        elif tag == 'textarea' and name:
+            self.textarea = name
+            self.values[name] = ''
+        elif tag == 'select' and name:
+            self.select = name
+            self.options[name] = []
+        elif tag == 'option' and self.select:
+            value = attrs.get('value', '')
+            if value:
+                self.options[self.select].append(value)
+            if 'selected' in attrs or self.select not in self.values:
+                self.values[self.select] = value
+
+    def handle_endtag(self, tag):
+        if tag == 'form' and self.in_form:
+            self.in_form, self.done = False, True
+        elif tag == 'select':
+            self.select = None
+        elif tag == 'textarea':
+            self.textarea = None
+
+    def handle_data(self, data):
+        if self.textarea:
+            self.values[self.textarea] += data
+
+
+def parse_form(html):
+    parser = FormParser()
+    parser.feed(html)
+    return parser
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class VirtualUser:
+    """One browser: its own cookie jar (session + CSRF cookie), requests timed one by one."""
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), NoRedirect)
+        self.samples = []  # (scenario, step, ms, ok, detail)
+
+    def request(self, path, data=None):
+        """Return (status, body) without following redirects; network errors give status 0."""
+        url = urljoin(self.base_url, path)
+        headers = {'User-Agent': 'dispatch-loadtest'}
+        if data is not None:
+            data = urlencode(data).encode()
+            headers['Referer'] = url  # CSRF checks the Referer over HTTPS
+        try:
+            with self.opener.open(Request(url, data=data, headers=headers), timeout=self.timeout) as response:
+                return response.status, response.read().decode('utf-8', 'replace')
+        except HTTPError as e:
+            return e.code, e.read().decode('utf-8', 'replace')
+        except (URLError, OSError) as e:
+            return 0, str(e)
+
+    def timed(self, scenario, step, path, data=None, expect=(200,)):
+        start = time.perf_counter()
+        status, body = self.request(path, data)
+        ms = (time.perf_counter() - start) * 1000
+        ok = status in expect
+        if ok:
+            detail = None
+        elif status == 200 and data is not None:
+            # The form came back instead of redirecting
+            detail = 'stale version' if 'changed by someone else' in body else 'form errors'
+        else:
+            detail = f'HTTP {status}' if status else body[:80]
+        self.samples.append((scenario, step, ms, ok, detail))
+        return ok, body
+
+    def login(self, username, password):
+        status, body = self.request(settings.LOGIN_URL)
+        form = parse_form(body)
+        if status != 200 or 'csrfmiddlewaretoken' not in form.values:
+            raise CommandError(f"Could not open the login page ({status})")
+        status, _ = self.request(settings.LOGIN_URL, {**form.values, 'username': username, 'password': password})
+        if status != 302:
+            raise CommandError(f"Login as '{username}' failed ({status})")
+
+
+class Command(BaseCommand):
+    help = ('Drive the app with concurrent simulated users and report throughput, latency '
+            'percentiles and error rates per scenario. Run it against a copy of the data: '
+            'the create/edit scenarios save through the real forms.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None,
+                            help='Base URL of a running server; by default a local runserver is started')
+        parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users (default: %(default)s)')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run (default: %(default)s)')
+        parser.add_argument('--ramp-up', type=float, default=5,
+                            help='Seconds over which the users start (default: %(default)s)')
+        parser.add_argument('--think-time', type=float, default=0.5,
+                            help='Mean pause between scenarios per user, in seconds (default: %(default)s)')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Scenario weights, from {", ".join(SCENARIOS)} (default: %(default)s)')
+        parser.add_argument('--username', default=None, help='Login for the virtual users')
+        parser.add_argument('--password', default=None)
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--keep-data', action='store_true',
+                            help='Keep the dispatches the create scenario added (local runs only)')
+        parser.add_argument('--output', default=None, help='Also write the results as JSON here')
+
+    def handle(self, *args, **options):
+        self.mix = self.parse_mix(options['mix'])
+        self.think_time = options['think_time']
+        self.timeout = options['timeout']
+        self.rng = random.Random(options['seed'])
+        self.run_id = secrets.token_hex(3)
+        self.created = 0
+        self.counter_lock = threading.Lock()
+
+        server = temp_user = None
+        username, password = options['username'], options['password']
+        try:
+            if options['url']:
+                if not (username and password):
+                    raise CommandError("--username and --password are required with --url")
+                base_url = options['url'].rstrip('/') + '/'
+            else:
+                if not username:
+                    # A throwaway superuser, removed again at the end
+                    username, password = f'loadtest-{self.run_id}', secrets.token_urlsafe(12)
+                    temp_user = User.objects.create_superuser(username, password=password)
+                server, base_url = self.start_server()
+
+            self.base_url = base_url
+            self.credentials = (username, password)
+            self.dispatch_ids = self.discover_dispatches()
+            if not self.dispatch_ids and NEEDS_DISPATCHES & set(self.mix):
+                raise CommandError("No dispatches to open; seed some first (see seed_benchmark_data)")
+
+            self.stderr.write(
+                f"🚦 {options['users']} users for {options['duration']:g}s against {base_url} "
+                f"(mix: {', '.join(f'{k}={v}' for k, v in self.mix.items())})"
+            )
+            started = time.perf_counter()
+            deadline = started + options['duration']
+            ramp = options['ramp_up'] / options['users'] if options['users'] else 0
+            with ThreadPoolExecutor(max_workers=options['users']) as pool:
+                futures = [pool.submit(self.run_user, i * ramp, deadline) for i in range(options['users'])]
+                samples = [sample for f in futures for sample in f.result()]
+            elapsed = time.perf_counter() - started
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+                if not options['keep_data']:
+                    Dispatch.objects.filter(OrderNo__startswith=f'LT-{self.run_id}-').delete()
+            if temp_user is not None:
+                temp_user.delete()
+
+        report = self.summarize(samples, elapsed)
+        report['meta'] = {
+            'url': base_url, 'users': options['users'], 'duration': options['duration'],
+            'think_time': self.think_time, 'mix': self.mix,
+            'created_dispatches': self.created, 'order_no_prefix': f'LT-{self.run_id}-',
+        }
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
+            self.stderr.write(self.style.SUCCESS(f"✅ Results written to {options['output']}"))
+
+    def parse_mix(self, value):
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            name = name.strip()
+            if name not in SCENARIOS:
+                raise CommandError(f"Unknown scenario '{name}'; choose from {', '.join(SCENARIOS)}")
+            try:
+                mix[name] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f"Bad weight in '{part}'")
+        if not any(w > 0 for w in mix.values()):
+            raise CommandError("--mix needs at least one positive weight")
+        return mix
+
+    # -- setup ---------------------------------------------------------------
+
+    def start_server(self):
+        """runserver on a free local port, using this process's settings and database."""
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        manage_py = os.path.join(settings.BASE_DIR, 'manage.py')
+        server = subprocess.Popen(
+            [sys.executable, manage_py, 'runserver', f'127.0.0.1:{port}', '--noreload'],
+            cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("runserver exited while starting")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server, f'http://127.0.0.1:{port}/'
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("runserver did not start within 30s")
+
+    def discover_dispatches(self):
+        """Dispatch IDs to open, fetched through the API like any other client would."""
+        user = VirtualUser(self.base_url, self.timeout)
+        user.login(*self.credentials)
+        status, body = user.request('api/dispatches/?' + urlencode({'fields': 'DispatchID', 'limit': 1000}))
+        if status != 200:
+            raise CommandError(f"Could not list dispatches ({status})")
+        return [row['DispatchID'] for row in json.loads(body)['results']]
+
+    # -- running -------------------------------------------------------------
+
+    def run_user(self, delay, deadline):
+        time.sleep(delay)
+        user = VirtualUser(self.base_url, self.timeout)
+        user.login(*self.credentials)
+        with self.counter_lock:
+            rng = random.Random(self.rng.random())
+        names, weights = zip(*self.mix.items())
+        while time.perf_counter() < deadline:
+            scenario = rng.choices(names, weights=weights)[0]
+            getattr(self, f'scenario_{scenario}')(user, rng)
+            if self.think_time:
+                time.sleep(rng.expovariate(1 / self.think_time))
+        return user.samples
+
+    def scenario_home(self, user, rng):
+        user.timed('home', 'GET', '')
+
+    def scenario_dispatch_note(self, user, rng):
+        user.timed('dispatch_note', 'GET', f'dispatch/{rng.choice(self.dispatch_ids)}/')
+
+    def scenario_loading_sheet(self, user, rng):
+        user.timed('loading_sheet', 'GET', f'dispatch/{rng.choice(self.dispatch_ids)}/loading-sheet/')
+
+    def scenario_pallet_labels(self, user, rng):
+        user.timed('pallet_labels', 'GET', f'dispatch/{rng.choice(self.dispatch_ids)}/pallet-labels/')
+
+    def scenario_reports(self, user, rng):
+        today = date.today()
+        params = {
+            'report_type': rng.choice(['customer', 'product', 'monthly']),
+            'start_date': today - timedelta(days=rng.choice([30, 90, 365])),
+            'end_date': today,
+        }
+        user.timed('reports', 'GET', 'reports/?' + urlencode(params))
+
+    def scenario_create(self, user, rng):
+        ok, body = user.timed('create', 'GET form', 'dispatch/create/')
+        if not ok:
+            return
+        form = parse_form(body)
+        customers = form.options.get('Customer', [])
+        codes = next((v for k, v in form.options.items() if k.endswith('-0-Code')), [])
+        if not customers or not codes:
+            user.samples.append(('create', 'POST', 0, False, 'no customers/products to choose'))
+            return
+        with self.counter_lock:
+            self.created += 1
+            order_no = f'LT-{self.run_id}-{self.created:05d}'
+        today = date.today()
+        data = {**form.values, 'OrderNo': order_no, 'Customer': rng.choice(customers),
+                'OrderDate': today, 'LoadingDate': today + timedelta(days=1), 'Status': 'draft'}
+        line = next(k for k in form.options if k.endswith('-0-Code'))[:-len('Code')]
+        data.update({f'{line}Code': rng.choice(codes), f'{line}Qty': rng.randint(1, 200),
+                     f'{line}ProductionDate': today, f'{line}ExpairyDate': today + timedelta(days=365)})
+        user.timed('create', 'POST', 'dispatch/create/', data, expect=(302,))
+
+    def scenario_edit(self, user, rng):
+        # Open the edit form and save it unchanged, the way a user confirms a dispatch
+        path = f'dispatch/{rng.choice(self.dispatch_ids)}/edit/'
+        ok, body = user.timed('edit', 'GET form', path)
+        if ok:
+            user.timed('edit', 'POST', path, parse_form(body).values, expect=(302,))
+
+    # -- reporting -----------------------------------------------------------
+
+    def summarize(self, samples, elapsed):
+        groups = {}
+        for scenario, step, ms, ok, detail in samples:
+            groups.setdefault(f'{scenario} {step}', []).append((ms, ok, detail))
+        groups['TOTAL'] = [(ms, ok, detail) for _, _, ms, ok, detail in samples]
+
+        rows = []
+        for name, group in groups.items():
+            if not group:
+                continue
+            timings = sorted(ms for ms, _, _ in group)
+            errors = [detail for _, ok, detail in group if not ok]
+            by_kind = {}
+            for detail in errors:
+                by_kind[detail] = by_kind.get(detail, 0) + 1
+            rows.append({
+                'name': name,
+                'requests': len(group),
+                'rps': round(len(group) / elapsed, 2) if elapsed else None,
+                'p50_ms': round(percentile(timings, 50), 1),
+                'p95_ms': round(percentile(timings, 95), 1),
+                'p99_ms': round(percentile(timings, 99), 1),
+                'max_ms': round(timings[-1], 1),
+                'errors': len(errors),
+                'error_rate': round(len(errors) / len(group), 4),
+                'error_kinds': by_kind,
+            })
+        return {'elapsed_s': round(elapsed, 2), 'results': rows}
+
+    def print_report(self, report):
+        header = f"{'scenario':<24}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in report['results']:
+            line = (f"{row['name']:<24}{row['requests']:>9}{row['rps']:>9.1f}{row['p50_ms']:>9.1f}"
+                    f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}"
+                    f"{row['error_rate']:>8.1%} ")
+            self.stdout.write(self.style.ERROR(line) if row['errors'] else line)
+            for kind, count in row['error_kinds'].items():
+                self.stdout.write(f"    {count} × {kind}")
+        self.stdout.write(f"\nRan for {report['elapsed_s']}s; created {report['meta']['created_dispatches']} "
+                          f"dispatches (OrderNo {report['meta']['order_no_prefix']}*)")
@@ -0,0 +1,21 @@
+# dispatch_app/management/commands/rebuild_customer_stats.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from dispatch_app import customer_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute CustomerStats/CustomerMonthStats from the dispatches (once after migrating, or after raw SQL writes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Dispatches refreshed per query (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = customer_stats.rebuild(chunk_size=max(1, options['chunk_size']))
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Rebuilt customer stats from {count} dispatches in {time.perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,232 @@
+# dispatch_app/management/commands/run_benchmarks.py
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command, load_command_class
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from dispatch_app import master_cache
+from dispatch_app.middleware import RequestMetrics
+from dispatch_app.forms import DispatchDetailsEditFormSet, DispatchForm
+from dispatch_app.models import Dispatch
+from dispatch_app.management.commands.seed_benchmark_data import Command as SeedCommand
+
+IMPORTS = [
+    ('customers', 'export_customers', 'import_customers'),
+    ('products', 'export_products', 'import_products'),
+    ('dispatches', 'export_dispatches', 'import_dispatches'),
+    ('dispatch_details', 'export_dispatch_details', 'import_dispatch_details'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Time the main pages, reports, forms and imports at several data sizes and print JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='100,1000,10000',
+                            help='Comma-separated dispatch counts to seed (default: %(default)s)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs per benchmark, after one warm-up (default: %(default)s)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--only', default='',
+                            help='Comma-separated benchmark name prefixes to run (e.g. "home,reports")')
+        parser.add_argument('--skip-imports', action='store_true')
+        parser.add_argument('--output', default=None, help='Write the JSON here instead of stdout')
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        self.only = [p for p in options['only'].split(',') if p]
+        scales = [int(s) for s in options['scales'].split(',') if s]
+
+        results = []
+        for scale in scales:
+            self.stderr.write(f"⏱️ Scale {scale} dispatches ...")
+            # Each scale seeds its own data and rolls it back afterwards
+            with transaction.atomic():
+                counts = self.seed(scale, options['seed'])
+                master_cache.customers.invalidate()
+                master_cache.products.invalidate()
+                for result in self.run_scale(scale, options['skip_imports']):
+                    result.update(scale=scale, lines=counts['lines'])
+                    results.append(result)
+                    self.stderr.write(
+                        f"  {result['benchmark']:<32} median {result['median_ms']:9.1f} ms "
+                        f"{result['queries']:6} queries"
+                    )
+                transaction.set_rollback(True)
+            master_cache.customers.invalidate()
+            master_cache.products.invalidate()
+
+        output = json.dumps({'meta': self.meta(options, scales), 'results': results}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"✅ Results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def meta(self, options, scales):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'started_at': timezone.now().isoformat(),
+            'git_commit': commit,
+            'python': sys.version.split()[0],
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'platform': platform.platform(),
+            'scales': scales,
+            'repeat': options['repeat'],
+            'seed': options['seed'],
+        }
+
+    def seed(self, scale, seed):
+        return SeedCommand().seed(
+            customers=max(10, scale // 20),
+            products=max(50, min(2000, scale // 5)),
+            dispatches=scale,
+            min_lines=1, max_lines=60, mode_lines=8,
+            seed=seed, prefix='RB',
+        )
+
+    def wanted(self, name):
+        return not self.only or any(name.startswith(prefix) for prefix in self.only)
+
+    # -- measuring -----------------------------------------------------------
+
+    def measure(self, name, func):
+        """Run func once to warm up, then `repeat` times; func returns a status code or None."""
+        counter = RequestMetrics()  # counts every query, unlike the capped queries_log
+        with connection.execute_wrapper(counter):
+            status = func()
+        timings = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {
+            'benchmark': name,
+            'runs': len(timings),
+            'min_ms': round(timings[0], 2),
+            'median_ms': round(statistics.median(timings), 2),
+            'max_ms': round(timings[-1], 2),
+            'queries': counter.queries,
+            'status': status,
+        }
+
+    def run_scale(self, scale, skip_imports):
+        user = User.objects.create_superuser('rb-benchmark', password=None)
+        # Outside the test runner "testserver" is not in ALLOWED_HOSTS
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if '*' not in h), 'localhost')
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+
+        dates = Dispatch.objects.aggregate(start=Min('OrderDate'), end=Max('OrderDate'))
+        period = urlencode({'start_date': dates['start'], 'end_date': dates['end']})
+        # The dispatch with the most lines: the worst case for the printable documents
+        biggest = (Dispatch.objects.annotate(n=Count('details')).order_by('-n')
+                   .values_list('DispatchID', flat=True).first())
+        top_customer = (Dispatch.objects.values_list('Customer__Customer', flat=True)
+                        .annotate(n=Count('pk')).order_by('-n').first())
+
+        pages = [
+            ('home', reverse('home')),
+            ('home?status=delivered', f"{reverse('home')}?status=delivered"),
+            ('dispatch_note', reverse('dispatch_note', args=[biggest])),
+            ('loading_sheet', reverse('loading_sheet', args=[biggest])),
+            ('pallet_labels', reverse('pallet_labels', args=[biggest])),
+            ('dispatch_create GET', reverse('dispatch_create')),
+            ('dispatch_edit GET', reverse('dispatch_edit', args=[biggest])),
+            ('get_customer_details', reverse('get_customer_details',
+                                             args=[Dispatch.objects.values_list('Customer', flat=True)[0]])),
+            ('api_dispatches', f"{reverse('api_dispatches')}?limit=100"),
+        ]
+        for report_type in ('customer', 'product', 'monthly'):
+            url = f"{reverse('reports')}?report_type={report_type}&{period}"
+            pages.append((f'reports {report_type}', url))
+            pages.append((f'reports {report_type} excel', f"{url}&format=excel"))
+        url = f"{reverse('reports')}?{urlencode({'customer': top_customer})}&{period}"
+        pages.append(('reports customer detail', url))
+        pages.append(('reports customer detail excel', f"{url}&format=excel"))
+
+        results = []
+        for name, url in pages:
+            if self.wanted(name):
+                results.append(self.measure(name, lambda url=url: client.get(url).status_code))
+
+        if self.wanted('dispatch_edit POST'):
+            edit_url = reverse('dispatch_edit', args=[biggest])
+
+            def post_edit():
+                # Every save bumps Dispatch.version, so each run submits the form as it is now;
+                # anything but the redirect means we timed the error page
+                data = self.edit_post_data(Dispatch.objects.get(pk=biggest))
+                status = client.post(edit_url, data).status_code
+                if status != 302:
+                    raise CommandError(f"dispatch_edit POST returned {status}, expected a 302 after saving")
+                return status
+
+            results.append(self.measure('dispatch_edit POST', post_edit))
+
+        if not skip_imports and self.wanted('import'):
+            results.extend(self.run_imports())
+        return results
+
+    def edit_post_data(self, dispatch):
+        """The edit form submitted unchanged, as a browser would send it."""
+        form = DispatchForm(instance=dispatch)
+        formset = DispatchDetailsEditFormSet(instance=dispatch)
+        data = {}
+        for f in [form, *formset.forms]:
+            for name in f.fields:
+                value = f[name].value()
+                if value not in (None, False):
+                    data[f.add_prefix(name)] = value
+        for key, value in formset.management_form.initial.items():
+            data[formset.management_form.add_prefix(key)] = value
+        return data
+
+    def run_imports(self):
+        """Export each table, then time re-importing it (dry run, so nothing changes)."""
+        workdir = tempfile.mkdtemp(prefix='run_benchmarks_')
+        results = []
+        try:
+            for kind, export_name, import_name in IMPORTS:
+                path = os.path.join(workdir, f'{kind}.csv')
+                call_command(export_name, path=path, stdout=StringIO())
+
+                def run(path=path, import_name=import_name):
+                    command = load_command_class('dispatch_app', import_name)
+                    call_command(command, path=path, dry_run=True, stdout=StringIO())
+                    return command.totals['rows']
+
+                result = self.measure(f'import {kind}', run)
+                result['rows'] = result.pop('status')
+                result['rows_per_sec'] = round(result['rows'] / (result['median_ms'] / 1000)) if result['median_ms'] else None
+                results.append(result)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return results
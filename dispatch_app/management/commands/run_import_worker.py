@@ -0,0 +1,123 @@
+# dispatch_app/management/commands/run_import_worker.py
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import load_command_class
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from dispatch_app.importers import ImportFileError
+from dispatch_app.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = 'Process uploaded import jobs in chunks (resumes interrupted jobs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process whatever is queued, then exit')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between queue polls (default: %(default)s)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows committed per chunk (default: %(default)s)')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Take over a running job whose worker has been silent '
+                                 'this many seconds (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS("Import worker started"))
+        while True:
+            job = self.claim_next(options['stale_after'])
+            if job:
+                self.process(job, options['batch_size'])
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def claim_next(self, stale_after):
+        """Take the oldest queued job, or a running one whose worker went away."""
+        stale = timezone.now() - timedelta(seconds=stale_after)
+        claimable = Q(status='queued') | Q(status='running', heartbeat_at__lt=stale)
+        for job in ImportJob.objects.filter(claimable).order_by('created_at')[:5]:
+            # Conditional update so two workers never pick the same job
+            claimed = ImportJob.objects.filter(claimable, pk=job.pk).update(
+                status='running',
+                heartbeat_at=timezone.now(),
+                started_at=job.started_at or timezone.now(),
+            )
+            if claimed:
+                job.refresh_from_db()
+                return job
+        return None
+
+    def process(self, job, batch_size):
+        resuming = job.last_row > 1
+        self.stdout.write(
+            f"{'Resuming' if resuming else 'Starting'} job {job.pk} "
+            f"({job.get_kind_display()}, {job.file.name}) after row {job.last_row}"
+        )
+
+        command = load_command_class('dispatch_app', f'import_{job.kind}')
+        command.stdout = self.stdout
+        command.stderr = self.stderr
+
+        report_name = f"imports/errors/job_{job.pk}_errors.csv"
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'imports', 'errors'), exist_ok=True)
+        base = {
+            'rows_done': job.rows_done,
+            'created_count': job.created_count,
+            'updated_count': job.updated_count,
+            'error_count': job.error_count,
+            'elapsed': job.elapsed,
+        }
+
+        def on_batch(last_row, totals):
+            ImportJob.objects.filter(pk=job.pk).update(
+                last_row=last_row,
+                rows_done=base['rows_done'] + totals['rows'],
+                created_count=base['created_count'] + totals['created'],
+                updated_count=base['updated_count'] + totals['updated'],
+                error_count=base['error_count'] + command.error_count,
+                elapsed=base['elapsed'] + command.timer.elapsed,
+                error_report=report_name,
+                heartbeat_at=timezone.now(),
+            )
+
+        def on_skip(row_number):
+            # Rows done before the restart are read again (xlsx can't seek): stay visibly
+            # alive, or another worker would take the job over as stale mid-skip
+            ImportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now())
+
+        try:
+            command.run(
+                job.file.path,
+                sheet=job.sheet or command.default_sheet,
+                batch_size=batch_size,
+                error_report_path=os.path.join(settings.MEDIA_ROOT, report_name),
+                resume_after=job.last_row,
+                on_batch=on_batch,
+                on_skip=on_skip,
+            )
+        except ImportFileError as e:
+            self.finish(job, 'failed', str(e))
+            return
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"❌ Job {job.pk} failed: {e}"))
+            self.finish(job, 'failed', f"Fatal error: {e}")
+            return
+
+        self.finish(job, 'done', '')
+
+    def finish(self, job, status, message):
+        ImportJob.objects.filter(pk=job.pk).update(
+            status=status, message=message, finished_at=timezone.now(), heartbeat_at=timezone.now()
+        )
+        job.refresh_from_db()
+        self.stdout.write(
+            f"Job {job.pk} {status}: {job.rows_done} rows, {job.rows_per_sec:.0f} rows/s, "
+            f"{job.error_count} errors"
+        )
@@ -0,0 +1,172 @@
+# dispatch_app/management/commands/seed_benchmark_data.py
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from dispatch_app import customer_stats, master_cache
+from dispatch_app.models import Customer, Dispatch, DispatchDetails, Products, TableVersion
+
+COMPANY_WORDS = ["Al", "Gulf", "Star", "Crescent", "Oasis", "Pearl", "Falcon", "Desert", "Royal",
+                 "Green", "Golden", "Blue", "Nile", "Atlas", "Delta", "Summit", "Harbor", "Cedar"]
+COMPANY_SUFFIXES = ["Trading", "Foods", "Distribution", "Supermarket", "Hypermarket", "Wholesale",
+                    "General Trading", "Catering", "Retail"]
+COUNTRIES = ["UAE", "Saudi Arabia", "Oman", "Qatar", "Kuwait", "Bahrain", "Jordan", "Egypt", "Iraq"]
+PRODUCT_ADJECTIVES = ["Classic", "Spicy", "Mild", "Family", "Premium", "Lite", "Mini", "Jumbo", "Organic"]
+PRODUCT_NOUNS = ["Potato Chips", "Corn Puffs", "Wafers", "Biscuits", "Popcorn", "Nachos", "Crackers",
+                 "Cake Bars", "Juice", "Noodles"]
+PACK_SIZES = ["15g", "25g", "40g", "75g", "150g", "200ml", "250ml", "1L"]
+UOMS = ["CTN", "CTN", "CTN", "BAG", "PCS", "KG"]
+# Roughly what a mature database looks like: most orders are delivered
+STATUS_WEIGHTS = [("draft", 8), ("confirmed", 12), ("shipped", 15), ("delivered", 60), ("cancelled", 5)]
+
+
+class Command(BaseCommand):
+    help = 'Generate a reproducible synthetic dataset (customers, products, dispatches, lines) with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--dispatches', type=int, default=10000)
+        parser.add_argument('--min-lines', type=int, default=1, help='Fewest lines per dispatch')
+        parser.add_argument('--max-lines', type=int, default=60, help='Most lines per dispatch')
+        parser.add_argument('--mode-lines', type=int, default=8,
+                            help='Most common number of lines (triangular distribution)')
+        parser.add_argument('--days', type=int, default=730,
+                            help='Spread order dates over this many days up to today')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='BM',
+                            help='Prefix for generated OrderNo / product codes / customer names')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete previously generated rows with this prefix first')
+
+    def handle(self, *args, **options):
+        if not options['min_lines'] <= options['mode_lines'] <= options['max_lines']:
+            raise CommandError("Expected --min-lines <= --mode-lines <= --max-lines")
+        if options['clear']:
+            self.clear(options['prefix'])
+        start = time.perf_counter()
+        counts = self.seed(**{k: options[k] for k in (
+            'customers', 'products', 'dispatches', 'min_lines', 'max_lines', 'mode_lines',
+            'days', 'seed', 'prefix', 'batch_size')})
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Seeded {counts['customers']} customers, {counts['products']} products, "
+            f"{counts['dispatches']} dispatches and {counts['lines']} lines in {elapsed:.1f}s"
+        ))
+        # Bulk inserts skip the ChangeLog, which is what keeps the customer stats current
+        start = time.perf_counter()
+        customer_stats.rebuild()
+        self.stdout.write(f"📈 Rebuilt customer stats in {time.perf_counter() - start:.1f}s")
+
+    def clear(self, prefix):
+        dispatches = Dispatch.objects.filter(OrderNo__startswith=f'{prefix}-')
+        DispatchDetails.objects.filter(DispatchID__in=dispatches).delete()
+        dispatches.delete()
+        Products.objects.filter(Code__startswith=f'{prefix}-').delete()
+        Customer.objects.filter(Customer__startswith=f'{prefix} ').delete()
+        self.stdout.write(f"🗑️ Removed earlier '{prefix}' rows")
+
+    def seed(self, customers, products, dispatches, min_lines=1, max_lines=60, mode_lines=8,
+             days=730, seed=42, prefix='BM', batch_size=2000):
+        """Insert the dataset; the same arguments always produce the same rows."""
+        rng = random.Random(seed)
+
+        with transaction.atomic():
+            customer_rows = Customer.objects.bulk_create([
+                Customer(
+                    Customer=f"{prefix} {rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)} {i:05d}",
+                    DispatchTo=f"Warehouse {rng.randint(1, 9)}",
+                    Address=f"{rng.randint(1, 999)} Industrial Area {rng.randint(1, 40)}",
+                    Country=rng.choice(COUNTRIES),
+                    ContactNo=f"+971 5{rng.randint(0, 9)} {rng.randint(1000000, 9999999)}",
+                    ContactPerson=f"Contact {i}",
+                    Status=rng.random() > 0.05,
+                )
+                for i in range(customers)
+            ], batch_size=batch_size)
+
+            product_rows = Products.objects.bulk_create([
+                Products(
+                    Code=f"{prefix}-P{i:05d}",
+                    LocalCode=f"L{i:05d}",
+                    Description=(f"{rng.choice(PRODUCT_ADJECTIVES)} {rng.choice(PRODUCT_NOUNS)} "
+                                 f"{rng.choice(PACK_SIZES)}"),
+                    ParPallet=Decimal(rng.choice([40, 48, 60, 72, 80, 100])),
+                    UOM=rng.choice(UOMS),
+                    PacInCtn=Decimal(rng.choice([6, 12, 24, 48])),
+                )
+                for i in range(products)
+            ], batch_size=batch_size)
+
+            # A few big customers place most of the orders
+            active = [c for c in customer_rows if c.Status] or customer_rows
+            customer_weights = [1 / (rank + 1) for rank in range(len(active))]
+            statuses, status_weights = zip(*STATUS_WEIGHTS)
+            today = timezone.now().date()
+
+            line_count = 0
+            for offset in range(0, dispatches, batch_size):
+                size = min(batch_size, dispatches - offset)
+                batch = []
+                for i in range(offset, offset + size):
+                    order_date = today - timedelta(days=rng.randrange(days))
+                    loading_date = order_date + timedelta(days=rng.randint(0, 3))
+                    customer = rng.choices(active, weights=customer_weights)[0]
+                    batch.append(Dispatch(
+                        OrderNo=f"{prefix}-{i:07d}",
+                        InvoiceNo=f"INV-{prefix}-{i:07d}",
+                        Customer=customer,
+                        Address=customer.Address,
+                        Country=customer.Country,
+                        ContactNo=customer.ContactNo,
+                        ContactPerson=customer.ContactPerson,
+                        OrderDate=order_date,
+                        LoadingDate=loading_date,
+                        DeliveryDate=loading_date + timedelta(days=rng.randint(1, 10)),
+                        TransportNo=f"TR-{rng.randint(1000, 9999)}",
+                        DriverName=f"Driver {rng.randint(1, 300)}",
+                        DriverMobile=f"+971 50 {rng.randint(1000000, 9999999)}",
+                        Seal=f"S{rng.randint(100000, 999999)}",
+                        Status=rng.choices(statuses, weights=status_weights)[0],
+                    ))
+                batch = Dispatch.objects.bulk_create(batch)
+
+                lines = []
+                for dispatch in batch:
+                    count = round(rng.triangular(min_lines, max_lines, mode_lines))
+                    for product in rng.sample(product_rows, min(count, len(product_rows))):
+                        produced = dispatch.OrderDate - timedelta(days=rng.randint(1, 90))
+                        lines.append(DispatchDetails(
+                            DispatchID=dispatch,
+                            Code=product,
+                            LocalCode=product.LocalCode,
+                            Description=product.Description,
+                            UOM=product.UOM,
+                            PackInCarton=product.PacInCtn,
+                            ParPallet=product.ParPallet,
+                            Qty=Decimal(rng.randint(1, 400) * rng.choice([1, 1, 1, 5, 10])),
+                            ProductionDate=produced,
+                            ExpairyDate=produced + timedelta(days=rng.choice([180, 270, 365, 540])),
+                        ))
+                DispatchDetails.objects.bulk_create(lines, batch_size=batch_size)
+                line_count += len(lines)
+
+            # Bulk inserts send no signals: let caches and ETags know the master data changed.
+            # Seeded rows are not written to the ChangeLog/CatalogChange sync logs.
+            TableVersion.bump(Customer)
+            TableVersion.bump(Products)
+            transaction.on_commit(master_cache.customers.invalidate)
+            transaction.on_commit(master_cache.products.invalidate)
+
+        return {
+            'customers': len(customer_rows),
+            'products': len(product_rows),
+            'dispatches': dispatches,
+            'lines': line_count,
+        }
@@ -0,0 +1,59 @@
+# dispatch_app/management/commands/vendor_assets.py
+import hashlib
+import os
+import re
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dispatch_app.assets import VENDOR_ASSETS, VENDOR_DEPENDENCIES
+
+# The .map files are not vendored; ManifestStaticFilesStorage would fail on the dangling references
+SOURCE_MAP = re.compile(rb'\n?/[*/]# sourceMappingURL=\S+(?: \*/)?\s*$')
+
+
+class Command(BaseCommand):
+    help = 'Download the pinned third-party CSS/JS/fonts into static/vendor/ (commit the result)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Download files that are already there again')
+
+    def handle(self, *args, **options):
+        root = os.path.join(settings.BASE_DIR, 'static')
+        # Fonts before the stylesheet that uses them: a stylesheet without its fonts breaks collectstatic
+        files = []
+        for name, asset in VENDOR_ASSETS.items():
+            files.extend(VENDOR_DEPENDENCIES.get(name, []))
+            files.append(asset)
+
+        failed = []
+        for path, url in files:
+            target = os.path.join(root, path)
+            if os.path.exists(target) and not options['force']:
+                self.stdout.write(f"✔️ {path} (already vendored)")
+                continue
+            try:
+                with urlopen(Request(url, headers={'User-Agent': 'dispatch-vendor-assets'}), timeout=30) as response:
+                    data = response.read()
+            except (URLError, OSError) as e:
+                self.stderr.write(f"❌ {url}: {e}")
+                failed.append(path)
+                continue
+            if any(dep in failed for dep, _ in VENDOR_DEPENDENCIES.get(self.name_of(path), [])):
+                failed.append(path)
+                continue
+            if path.endswith(('.css', '.js')):
+                data = SOURCE_MAP.sub(b'\n', data)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            self.stdout.write(f"⬇️ {path} ({len(data):,} bytes, sha256 {hashlib.sha256(data).hexdigest()[:16]}…)")
+
+        if failed:
+            raise CommandError(f"{len(failed)} file(s) not vendored; templates keep using the CDN for them")
+        self.stdout.write(self.style.SUCCESS("✅ Vendored assets are in static/vendor/; commit them"))
+
+    def name_of(self, path):
+        return next((name for name, (asset_path, _) in VENDOR_ASSETS.items() if asset_path == path), None)
@@ -0,0 +1,219 @@
+# dispatch_app/master_cache.py
+"""Process-local cache of the master data (Products and active Customers)
+and of logged-in users (see auth.py).
+
+The catalogue is small and read-mostly, but every printed document and
+every formset row used to look products/customers up one query at a time.
+Each MasterDataCache keeps the rows in an LRU dict and records the
+TableVersion it was loaded at (its generation):
+
+* saves/deletes in this process clear it as soon as the transaction commits
+  (see signals.py);
+* other processes (gunicorn workers, import commands, run_import_worker)
+  bump TableVersion, which every process checks at most once per
+  MASTER_CACHE_CHECK_SECONDS before trusting its copy.
+
+Async views use aget(), which shares the same rows and only awaits the
+database on a miss or a version check.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .models import Customer, Products, TableVersion
+
+
+class MasterDataCache:
+    def __init__(self, model, get_queryset, max_size=None, check_interval=None):
+        self.model = model
+        self.get_queryset = get_queryset
+        self.max_size = max_size or getattr(settings, 'MASTER_CACHE_MAX_SIZE', 10000)
+        self.check_interval = (
+            check_interval if check_interval is not None
+            else getattr(settings, 'MASTER_CACHE_CHECK_SECONDS', 5)
+        )
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._listed = set()  # keys that came from get_queryset()
+        self._complete = False  # ...and none of them has been evicted since
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"<MasterDataCache {self.model.__name__} gen={self.generation} size={len(self._items)}>"
+
+    # -- freshness -----------------------------------------------------------
+
+    def invalidate(self):
+        with self._lock:
+            self._items.clear()
+            self._listed = set()
+            self._complete = False
+            self.generation = None
+            self._checked_at = 0.0
+
+    def _due(self, now):
+        return self.generation is None or now - self._checked_at >= self.check_interval
+
+    def _sync(self):
+        """Reload if another process changed the table since we loaded it."""
+        now = time.monotonic()
+        if not self._due(now):
+            return
+        version = TableVersion.current(self.model)[0]
+        with self._lock:
+            self._checked_at = now
+            if version != self.generation:
+                self._load(version, list(self.get_queryset()[:self.max_size + 1]))
+
+    async def _async_sync(self, version=None):
+        """_sync() for async callers. The rows are fetched without holding the lock.
+
+        A caller that has just read the TableVersion passes it: the copy is
+        reloaded at once if it is older, without waiting for the next check.
+        """
+        now = time.monotonic()
+        if version is None:
+            if not self._due(now):
+                return
+            version = (await TableVersion.acurrent(self.model))[0]
+        rows = None
+        if version != self.generation:
+            rows = [obj async for obj in self.get_queryset()[:self.max_size + 1]]
+        with self._lock:
+            self._checked_at = now
+            if rows is not None and version != self.generation:
+                self._load(version, rows)
+
+    def version(self):
+        """The TableVersion the cached rows come from, checked like any lookup (for cache keys)."""
+        self._sync()
+        return self.generation
+
+    def _load(self, version, rows):
+        # Caller holds the lock; rows is get_queryset()[:max_size + 1]
+        self._items.clear()
+        self._complete = len(rows) <= self.max_size
+        for obj in rows[:self.max_size]:
+            self._items[obj.pk] = obj
+        self._listed = set(self._items)
+        self.generation = version
+
+    def _add(self, obj):
+        # Caller holds the lock
+        self._items[obj.pk] = obj
+        while len(self._items) > self.max_size:
+            evicted, _ = self._items.popitem(last=False)
+            if evicted in self._listed:
+                self._complete = False
+
+    # -- lookups -------------------------------------------------------------
+
+    def get(self, key):
+        """The row with this primary key, or None. Misses fall back to the DB."""
+        if key is None or key == '':
+            return None
+        self._sync()
+        obj = self._lookup(key)
+        if obj is None:
+            # Not cached: evicted, outside the cached set (e.g. an inactive customer)
+            # or simply not there.
+            obj = self._store(self.model._default_manager.filter(pk=key).first())
+        return obj
+
+    async def aget(self, key, version=None):
+        """get() for async views: hits never leave the event loop, misses use the async ORM.
+
+        version: the TableVersion the caller already built an ETag from, so
+        the row returned is never older than that ETag.
+        """
+        if key is None or key == '':
+            return None
+        await self._async_sync(version)
+        obj = self._lookup(key)
+        if obj is None:
+            obj = self._store(await self.model._default_manager.filter(pk=key).afirst())
+        return obj
+
+    def _lookup(self, key):
+        with self._lock:
+            obj = self._items.get(key)
+            if obj is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+            return obj
+
+    def _store(self, obj):
+        if obj is not None:
+            with self._lock:
+                self._add(obj)
+        return obj
+
+    def get_many(self, keys):
+        """{pk: row} for the given keys, with one query for all the misses."""
+        self._sync()
+        found, missing = {}, []
+        with self._lock:
+            for key in set(keys) - {None, ''}:
+                obj = self._items.get(key)
+                if obj is None:
+                    missing.append(key)
+                else:
+                    self._items.move_to_end(key)
+                    found[key] = obj
+            self.hits += len(found)
+            self.misses += len(missing)
+        if missing:
+            rows = list(self.model._default_manager.filter(pk__in=missing))
+            with self._lock:
+                for obj in rows:
+                    found[obj.pk] = obj
+                    self._add(obj)
+        return found
+
+    def all(self, key=None):
+        """Every row of the cached set, sorted by key (used for form choices)."""
+        self._sync()
+        with self._lock:
+            if self._complete:
+                rows = [obj for pk, obj in self._items.items() if pk in self._listed]
+            else:
+                rows = None
+        if rows is None:
+            rows = list(self.get_queryset())
+        if key:
+            rows.sort(key=key)
+        return rows
+
+
+products = MasterDataCache(Products, lambda: Products.objects.all())
+customers = MasterDataCache(Customer, lambda: Customer.objects.filter(Status=True))
+# Filled one user at a time as they make requests; never preloaded
+users = MasterDataCache(get_user_model(), lambda: get_user_model().objects.none())
+
+CACHES_BY_MODEL = {Products: products, Customer: customers, get_user_model(): users}
+
+
+def attach_master_data(dispatch, details=()):
+    """Point dispatch.Customer and each line's .Code at the cached rows.
+
+    Templates can then follow item.Code.* / dispatch.Customer.* without a
+    query per line.
+    """
+    customer = customers.get(dispatch.Customer_id)
+    if customer is not None:
+        dispatch.Customer = customer
+    details = list(details)
+    found = products.get_many(item.Code_id for item in details)
+    for item in details:
+        product = found.get(item.Code_id)
+        if product is not None:
+            item.Code = product
+    return details
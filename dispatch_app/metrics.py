@@ -0,0 +1,209 @@
+# dispatch_app/metrics.py
+"""Prometheus-style metrics without a Prometheus client or any extra service.
+
+Each process counts into plain dicts under a lock (RequestMetricsMiddleware
+calls observe_request() once per request). At most every
+METRICS_FLUSH_SECONDS, and on every scrape, the process adds its deltas
+to a small SQLite file shared by all workers (settings.METRICS_DB). So
+/metrics shows the total for every gunicorn worker, whichever one serves it.
+
+Business numbers (dispatches by status, import throughput) are read
+straight from the main database at scrape time.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+
+logger = logging.getLogger(__name__)
+
+# Request latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'dispatch_http_request_duration_seconds': ('histogram', 'Request latency by URL name'),
+    'dispatch_http_requests_total': ('counter', 'Requests by URL name and status class'),
+    'dispatch_http_db_queries_total': ('counter', 'Database queries run by requests, by URL name'),
+    'dispatch_http_db_seconds_total': ('counter', 'Database time spent by requests, by URL name'),
+    'dispatch_master_cache_hits_total': ('counter', 'master_cache lookups served from memory'),
+    'dispatch_master_cache_misses_total': ('counter', 'master_cache lookups that went to the database'),
+    'dispatch_master_cache_hit_ratio': ('gauge', 'Hits / lookups since the metrics store was created'),
+    'dispatch_dispatches': ('gauge', 'Dispatches by status'),
+    'dispatch_import_jobs': ('gauge', 'Import jobs by kind and status'),
+    'dispatch_import_rows_total': ('counter', 'Rows processed by background import jobs, by kind'),
+    'dispatch_import_seconds_total': ('counter', 'Seconds spent by background import jobs, by kind'),
+    'dispatch_import_rows_per_second': ('gauge', 'Average import throughput, by kind'),
+}
+
+
+def label_string(**labels):
+    """Canonical 'a="1",b="2"' form, also used as the store key."""
+    return ','.join(
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in sorted(labels.items())
+    )
+
+
+class MetricsStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(float)  # (name, labels) -> delta not yet in the shared file
+        self._flushed_at = time.monotonic()
+        self._cache_seen = {}  # cache name -> (hits, misses) already counted
+
+    def observe_request(self, metrics, status_code):
+        url_name = metrics.url_name or 'unresolved'
+        labels = label_string(url_name=url_name)
+        seconds = metrics.total_time
+        with self._lock:
+            pending = self._pending
+            for bound in BUCKETS:
+                # += 0 still creates the bucket: every series needs all of them
+                pending[('dispatch_http_request_duration_seconds_bucket', f'le="{bound}",{labels}')] += seconds <= bound
+            pending[('dispatch_http_request_duration_seconds_bucket', f'le="+Inf",{labels}')] += 1
+            pending[('dispatch_http_request_duration_seconds_sum', labels)] += seconds
+            pending[('dispatch_http_request_duration_seconds_count', labels)] += 1
+            pending[('dispatch_http_requests_total',
+                     label_string(url_name=url_name, status=f'{status_code // 100}xx'))] += 1
+            pending[('dispatch_http_db_queries_total', labels)] += metrics.queries
+            pending[('dispatch_http_db_seconds_total', labels)] += metrics.db_time
+            due = time.monotonic() - self._flushed_at >= getattr(settings, 'METRICS_FLUSH_SECONDS', 5)
+        if due:
+            self.flush()
+
+    # -- shared store --------------------------------------------------------
+
+    def connect(self):
+        conn = sqlite3.connect(str(settings.METRICS_DB), timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS metric ('
+            'name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, '
+            'PRIMARY KEY (name, labels))'
+        )
+        return conn
+
+    def collect_cache_counts(self):
+        from .master_cache import CACHES_BY_MODEL
+
+        for model, cache in CACHES_BY_MODEL.items():
+            name = model._meta.db_table
+            hits, misses = cache.hits, cache.misses
+            seen_hits, seen_misses = self._cache_seen.get(name, (0, 0))
+            self._cache_seen[name] = (hits, misses)
+            if hits > seen_hits:
+                self._pending[('dispatch_master_cache_hits_total', label_string(cache=name))] += hits - seen_hits
+            if misses > seen_misses:
+                self._pending[('dispatch_master_cache_misses_total', label_string(cache=name))] += misses - seen_misses
+
+    def flush(self):
+        """Add this process's deltas to the shared file. Never raises: metrics must not break requests."""
+        with self._lock:
+            self.collect_cache_counts()
+            pending, self._pending = self._pending, defaultdict(float)
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            conn = self.connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO metric (name, labels, value) VALUES (?, ?, ?) '
+                        'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value',
+                        [(name, labels, value) for (name, labels), value in pending.items()],
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            logger.exception('Could not write metrics to %s', settings.METRICS_DB)
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] += value
+
+    def read(self):
+        self.flush()
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT name, labels, value FROM metric').fetchall()
+        finally:
+            conn.close()
+
+
+store = MetricsStore()
+
+
+def database_samples():
+    """Gauges read from the main database at scrape time (a fixed number of queries)."""
+    from .models import Dispatch, ImportJob
+
+    samples = []
+    counts = Dispatch.objects.aggregate(
+        **{key: Count('pk', filter=Q(Status=key)) for key, _ in Dispatch.STATUS_CHOICES}
+    )
+    for status, count in counts.items():
+        samples.append(('dispatch_dispatches', label_string(status=status), count))
+
+    for row in ImportJob.objects.values('kind', 'status').annotate(n=Count('pk')).order_by():
+        samples.append(('dispatch_import_jobs', label_string(kind=row['kind'], status=row['status']), row['n']))
+    for row in ImportJob.objects.values('kind').annotate(rows=Sum('rows_done'), seconds=Sum('elapsed')).order_by():
+        labels = label_string(kind=row['kind'])
+        rows, seconds = row['rows'] or 0, row['seconds'] or 0
+        samples.append(('dispatch_import_rows_total', labels, rows))
+        samples.append(('dispatch_import_seconds_total', labels, seconds))
+        samples.append(('dispatch_import_rows_per_second', labels, rows / seconds if seconds else 0))
+    return samples
+
+
+def family_of(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in HELP:
+            return name[:-len(suffix)]
+    return name
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    samples = list(store.read())
+
+    hits = defaultdict(float)
+    lookups = defaultdict(float)
+    for name, labels, value in samples:
+        if name in ('dispatch_master_cache_hits_total', 'dispatch_master_cache_misses_total'):
+            lookups[labels] += value
+            if name == 'dispatch_master_cache_hits_total':
+                hits[labels] += value
+    for labels, total in lookups.items():
+        samples.append(('dispatch_master_cache_hit_ratio', labels, hits[labels] / total if total else 0))
+
+    samples.extend(database_samples())
+
+    families = defaultdict(list)
+    for name, labels, value in samples:
+        families[family_of(name)].append((name, labels, value))
+
+    lines = []
+    for family in sorted(families):
+        kind, help_text = HELP.get(family, ('untyped', ''))
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        for name, labels, value in sorted(families[family], key=sample_order):
+            lines.append(f'{name}{{{labels}}} {format_value(value)}' if labels else f'{name} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def sample_order(sample):
+    # Buckets of one series together and in increasing "le" order
+    name, labels, _ = sample
+    parts = dict(part.split('=', 1) for part in labels.split(',') if part)
+    le = parts.pop('le', None)
+    bound = float('inf') if le in (None, '"+Inf"') else float(le.strip('"'))
+    return (sorted(parts.items()), name, bound)
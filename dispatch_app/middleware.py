@@ -0,0 +1,578 @@
+# dispatch_app/middleware.py
+"""Per-request query count, DB time, template time and total time.
+
+Every database connection gets the instrument() execute_wrapper when it
+is opened (signals.py). It passes each query to the wrappers registered
+for the current request with recording(): RequestMetrics (two
+perf_counter calls per query) and, when asked for, the profiler's
+SQLRecorder. They live in a ContextVar, so queries an async view runs
+through sync_to_async in another thread are counted too.
+TimedDjangoTemplates adds the time spent rendering templates. Requests over their budget are written as one JSON
+object per line to the "dispatch_app.slow_requests" logger.
+
+Budgets come from settings.REQUEST_BUDGETS, keyed by URL name, with
+"default" for everything else:
+
+    REQUEST_BUDGETS = {
+        'default': {'queries': 50, 'ms': 1000},
+        'home': {'queries': 10, 'ms': 300},
+    }
+
+Every request is also counted in metrics.store for /metrics.
+ProfilingMiddleware (below) profiles single requests on demand,
+StaticFilesMiddleware serves collectstatic output and CompressionMiddleware
+gzip/brotli-compresses responses. All of them run natively under both WSGI
+and ASGI (see HybridMiddleware).
+"""
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import logging
+import mimetypes
+import os
+import pstats
+import re
+import secrets
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.template.backends.django import DjangoTemplates, Template
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.utils.text import compress_sequence, compress_string
+from django.views.static import was_modified_since
+
+from .metrics import store as metrics_store
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+logger = logging.getLogger('dispatch_app.slow_requests')
+
+DEFAULT_BUDGET = {'queries': 50, 'ms': 1000}
+
+# The RequestMetrics of the request being handled in this thread/task, if any
+current_metrics = contextvars.ContextVar('current_metrics', default=None)
+# execute_wrappers of the request being handled (RequestMetrics, SQLRecorder)
+current_wrappers = contextvars.ContextVar('current_wrappers', default=())
+
+
+def instrument(execute, sql, params, many, context):
+    """The execute_wrapper on every connection: hands the query to the request's wrappers."""
+    wrappers = current_wrappers.get()
+    if not wrappers:
+        return execute(sql, params, many, context)
+    for wrapper in reversed(wrappers):
+        execute = functools.partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def recording(wrapper):
+    """Pass every query run in this context (and threads it starts via sync_to_async) to wrapper."""
+    token = current_wrappers.set(current_wrappers.get() + (wrapper,))
+    try:
+        yield wrapper
+    finally:
+        current_wrappers.reset(token)
+
+
+class HybridMiddleware:
+    """Base for the middleware below: sync under WSGI, a coroutine under ASGI.
+
+    An async middleware chain lets async views run on the event loop without
+    Django switching to a thread around each sync middleware. Subclasses
+    implement __call__ and __acall__ (or only one, if the other is inherited).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class RequestMetrics:
+    """Counters for one request; also the execute_wrapper callable."""
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+        self.url_name = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def as_dict(self):
+        return {
+            'url_name': self.url_name,
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 1),
+            'template_ms': round(self.template_time * 1000, 1),
+            'total_ms': round(self.total_time * 1000, 1),
+        }
+
+
+def url_name_of(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None and match.view_name else 'unresolved'
+
+
+def budget_for(url_name):
+    budgets = getattr(settings, 'REQUEST_BUDGETS', {})
+    return {**DEFAULT_BUDGET, **budgets.get('default', {}), **budgets.get(url_name, {})}
+
+
+@contextmanager
+def measuring(metrics):
+    token = current_metrics.set(metrics)
+    start = time.perf_counter()
+    try:
+        with recording(metrics):
+            yield metrics
+    finally:
+        metrics.total_time = time.perf_counter() - start
+        current_metrics.reset(token)
+
+
+class RequestMetricsMiddleware(HybridMiddleware):
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.server_timing = getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', settings.DEBUG)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with measuring(RequestMetrics()) as metrics:
+            response = self.get_response(request)
+        over = self.finish(request, response, metrics)
+        if over:
+            user = getattr(request, 'user', None)
+            self.log_slow(request, response, metrics, over, user.get_username() if user else '')
+        return response
+
+    async def __acall__(self, request):
+        with measuring(RequestMetrics()) as metrics:
+            response = await self.get_response(request)
+        over = self.finish(request, response, metrics)
+        if over:
+            # request.user would query synchronously
+            user = await request.auser() if hasattr(request, 'auser') else None
+            self.log_slow(request, response, metrics, over, user.get_username() if user else '')
+        return response
+
+    def finish(self, request, response, metrics):
+        """Record the request; returns the budget limits it went over."""
+        metrics.url_name = url_name_of(request)
+        request.metrics = metrics
+        if self.server_timing:
+            response['Server-Timing'] = (
+                f"db;dur={metrics.db_time * 1000:.1f};desc=\"{metrics.queries} queries\", "
+                f"tpl;dur={metrics.template_time * 1000:.1f}, total;dur={metrics.total_time * 1000:.1f}"
+            )
+        metrics_store.observe_request(metrics, response.status_code)
+        budget = budget_for(metrics.url_name)
+        over = []
+        if metrics.queries > budget['queries']:
+            over.append('queries')
+        if metrics.total_time * 1000 > budget['ms']:
+            over.append('ms')
+        return over
+
+    def log_slow(self, request, response, metrics, over, username):
+        logger.warning(json.dumps({
+            'at': timezone.now().isoformat(),
+            **metrics.as_dict(),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user': username,
+            'budget': budget_for(metrics.url_name),
+            'over': over,
+        }))
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The stock Django template backend, timing each top-level render.
+
+    The time includes any queries the template triggers (lazy querysets).
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+# 🔬 On-demand profiling
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_ON = ('1', 'true')  # ?_profile=0 leaves profiling off
+
+
+def profile_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'profiles')
+
+
+class SQLRecorder:
+    """execute_wrapper that keeps every statement with its duration."""
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append({
+                'sql': sql,
+                'params': repr(params)[:500],
+                'ms': (time.perf_counter() - start) * 1000,
+            })
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """Profile one request with cProfile when a staff user asks for it.
+
+    Add ?_profile=1 to the URL or send an "X-Profile: 1" header. The .prof
+    file and an HTML summary (top functions by cumulative time, every SQL
+    statement with its time) are saved under MEDIA_ROOT/profiles/ and linked
+    from the X-Profile-Report header and, on HTML pages, a link at the
+    bottom. Requests without the switch only pay for the two lookups.
+    Must come after AuthenticationMiddleware.
+
+    Under ASGI the profiler sees the event loop thread only: code an async
+    view runs through sync_to_async is missing from the call stats (its SQL
+    is still listed), and other requests running meanwhile are included.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.top = getattr(settings, 'PROFILE_TOP_FUNCTIONS', 40)
+
+    @staticmethod
+    def wanted(request):
+        # Plain substring/dict checks: no query-string parsing unless asked for
+        if PROFILE_PARAM not in request.META.get('QUERY_STRING', '') and PROFILE_HEADER not in request.META:
+            return False
+        switch = request.META.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM, '')
+        return switch.lower() in PROFILE_ON
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.wanted(request) or not request.user.is_staff:
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with recording(SQLRecorder()) as recorder:
+            response = profiler.runcall(self.get_response, request)
+        return self.report(request, response, profiler, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not self.wanted(request) or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with recording(SQLRecorder()) as recorder:
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+        return await sync_to_async(self.report)(request, response, profiler, recorder, time.perf_counter() - start)
+
+    def report(self, request, response, profiler, recorder, elapsed):
+        name = f"{timezone.now():%Y%m%d-%H%M%S}-{url_name_of(request).replace(':', '-')}-{uuid.uuid4().hex[:6]}"
+        os.makedirs(profile_dir(), exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir(), f'{name}.prof'))
+
+        stats_text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stats_text)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        html = render_to_string('profile_report.html', {
+            'name': name,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'elapsed_ms': elapsed * 1000,
+            'total_calls': stats.total_calls,
+            'stats': stats_text.getvalue(),
+            'statements': recorder.statements,
+            'sql_ms': sum(s['ms'] for s in recorder.statements),
+            'prof_url': reverse('profile_report', args=[f'{name}.prof']),
+        })
+        with open(os.path.join(profile_dir(), f'{name}.html'), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+        report_url = reverse('profile_report', args=[f'{name}.html'])
+        response['X-Profile-Report'] = report_url
+        if (not response.streaming and response.get('Content-Type', '').startswith('text/html')
+                and b'</body>' in response.content):
+            link = (f'<a href="{report_url}" target="_blank" style="position:fixed;bottom:8px;right:8px;'
+                    f'z-index:9999" class="btn btn-dark btn-sm">🔬 Profile report</a></body>').encode()
+            response.content = response.content.replace(b'</body>', link, 1)
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+        return response
+
+
+# 📦 Static files
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+class StaticFilesMiddleware(HybridMiddleware):
+    """Serve STATIC_ROOT (collectstatic output) when no web server in front does.
+
+    Content-hashed names from the manifest never change, so they are cached
+    for a year as immutable; other files get a short max-age. The .br/.gz
+    copy written by CompressedManifestStaticFilesStorage is sent when the
+    browser accepts it. Off under DEBUG (runserver serves static files
+    itself) unless SERVE_STATIC is set. Goes first in MIDDLEWARE.
+    """
+    ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SERVE_STATIC', not settings.DEBUG) or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else f'/{settings.STATIC_URL}'
+        self.root = str(settings.STATIC_ROOT)
+        self.immutable = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        path = self.path_for(request)
+        if path is None:
+            return self.get_response(request)
+        return self.serve(request, path)
+
+    async def __acall__(self, request):
+        # FileResponse reads the file in a thread under ASGI
+        path = self.path_for(request)
+        if path is None:
+            return await self.get_response(request)
+        return self.serve(request, path)
+
+    def path_for(self, request):
+        """The file under STATIC_ROOT for this request, or None."""
+        if not request.path.startswith(self.prefix) or request.method not in ('GET', 'HEAD'):
+            return None
+        try:
+            path = safe_join(self.root, request.path[len(self.prefix):])
+        except SuspiciousFileOperation:
+            return None
+        return path if os.path.isfile(path) else None
+
+    def serve(self, request, path):
+        name = request.path[len(self.prefix):]
+        mtime = os.stat(path).st_mtime
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime):
+            return HttpResponseNotModified()
+
+        content_type, _ = mimetypes.guess_type(name)
+        accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        encoding = None
+        for coding, suffix in self.ENCODINGS:
+            if coding in accepted and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, coding
+                break
+
+        response = FileResponse(open(path, 'rb'), content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Vary'] = 'Accept-Encoding'
+        response['Last-Modified'] = http_date(mtime)
+        response['Cache-Control'] = (
+            f'public, max-age={ONE_YEAR}, immutable' if name in self.immutable else 'public, max-age=60'
+        )
+        response['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+
+# 🗜️ Compression
+
+ACCEPTS = {'br': re.compile(r'\bbr\b'), 'gzip': re.compile(r'\bgzip\b')}
+# Only text-like types: .xlsx, zip, images and fonts are compressed already
+DEFAULT_COMPRESS_TYPES = (
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/xml', 'text/javascript',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+)
+
+
+def brotli_padding(max_random_bytes):
+    """A brotli metadata meta-block of 1 to max_random_bytes random bytes (RFC 7932, section 9.2).
+
+    Decoders skip it. It does for brotli what the random gzip filename does
+    in django.utils.text.compress_string: the response length no longer
+    tells a BREACH attacker whether a guess compressed better. It must
+    follow a flush(), which leaves the stream byte-aligned.
+    """
+    size = secrets.randbelow(max_random_bytes) + 1
+    # ISLAST=0, MNIBBLES=0 (metadata), reserved=0, MSKIPBYTES=1, MSKIPLEN-1 over the next 8 bits
+    header = bytes([0b010110 | ((size - 1) & 0b11) << 6, (size - 1) >> 2])
+    return header + secrets.token_bytes(size)
+
+
+class PaddedBrotliCompressor:
+    """brotli.Compressor flushed after each chunk, with brotli_padding() after the first output."""
+    def __init__(self, quality, max_random_bytes):
+        self.c = brotli.Compressor(quality=quality)
+        self.max_random_bytes = max_random_bytes
+        self.padded = False
+
+    def process(self, data):
+        data = self.c.process(data) + self.c.flush()
+        if data and not self.padded:
+            data += brotli_padding(self.max_random_bytes)
+            self.padded = True
+        return data
+
+    def finish(self):
+        return self.c.finish()
+
+
+class CompressionMiddleware(HybridMiddleware):
+    """Compress responses with brotli (if the "brotli" package is installed) or gzip.
+
+    Skipped for responses that are small (COMPRESS_MIN_SIZE), already encoded
+    (the catalog snapshot, pre-compressed static files), not a text type
+    (COMPRESS_CONTENT_TYPES: .xlsx downloads are zip files) or event
+    streams. gzip comes from django.utils.text, as in GZipMiddleware, so
+    async streams are one gzip member per chunk. Brotli streams are flushed
+    after each chunk, so they still arrive progressively. Both get random
+    padding of up to max_random_bytes against BREACH (see brotli_padding).
+    Goes where Django documents GZipMiddleware: right after
+    SecurityMiddleware, before anything that reads or changes the body.
+    """
+    max_random_bytes = 100
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.min_size = getattr(settings, 'COMPRESS_MIN_SIZE', 500)
+        self.content_types = tuple(getattr(settings, 'COMPRESS_CONTENT_TYPES', DEFAULT_COMPRESS_TYPES))
+        self.brotli_quality = getattr(settings, 'COMPRESS_BROTLI_QUALITY', 5)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        encoding = self.encoding_for(request, response)
+        if encoding is None:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.compress_async(encoding, response.streaming_content)
+            else:
+                response.streaming_content = self.compress_stream(encoding, response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed = self.compress_bytes(encoding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The body is no longer byte-for-byte what a strong ETag promised
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    def encoding_for(self, request, response):
+        if response.status_code < 200 or response.status_code in (204, 304) or response.has_header('Content-Encoding'):
+            return None
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if not content_type.startswith(self.content_types):
+            return None
+        if not response.streaming and len(response.content) < self.min_size:
+            return None
+        accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and ACCEPTS['br'].search(accepted):
+            return 'br'
+        if ACCEPTS['gzip'].search(accepted):
+            return 'gzip'
+        return None
+
+    def compress_bytes(self, encoding, data):
+        if encoding == 'gzip':
+            return compress_string(data, max_random_bytes=self.max_random_bytes)
+        compressor = PaddedBrotliCompressor(self.brotli_quality, self.max_random_bytes)
+        return compressor.process(data) + compressor.finish()
+
+    def compress_stream(self, encoding, chunks):
+        if encoding == 'gzip':
+            yield from compress_sequence(chunks, max_random_bytes=self.max_random_bytes)
+            return
+        compressor = PaddedBrotliCompressor(self.brotli_quality, self.max_random_bytes)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+    async def compress_async(self, encoding, chunks):
+        if encoding == 'gzip':
+            # As GZipMiddleware does: one gzip member per chunk
+            async for chunk in chunks:
+                yield compress_string(chunk, max_random_bytes=self.max_random_bytes)
+            return
+        compressor = PaddedBrotliCompressor(self.brotli_quality, self.max_random_bytes)
+        async for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0003_dispatch_created_at_dispatch_created_by_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('customers', 'Customers'), ('products', 'Products'), ('dispatches', 'Dispatches'), ('dispatch_details', 'Dispatch Details')], max_length=20)),
+                ('file', models.FileField(upload_to='imports/')),
+                ('sheet', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('last_row', models.IntegerField(default=1)),
+                ('rows_done', models.IntegerField(default=0)),
+                ('created_count', models.IntegerField(default=0)),
+                ('updated_count', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('elapsed', models.FloatField(default=0)),
+                ('error_report', models.CharField(blank=True, max_length=255)),
+                ('message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'ImportJob',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
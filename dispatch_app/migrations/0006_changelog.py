@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:51
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0005_tableversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=50)),
+                ('object_id', models.BigIntegerField()),
+                ('dispatch_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('save', 'Save'), ('delete', 'Delete')], max_length=10)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'ChangeLog',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dispatch',
+            index=models.Index(fields=['updated_at'], name='dispatch_updated_at_idx'),
+        ),
+    ]
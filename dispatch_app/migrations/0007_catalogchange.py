@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0006_changelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=50)),
+                ('key', models.CharField(max_length=100)),
+                ('action', models.CharField(choices=[('save', 'Save'), ('delete', 'Delete')], max_length=10)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'CatalogChange',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0007_catalogchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispatch',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0008_dispatch_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['dispatch_id', 'id'], name='changelog_dispatch_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0009_changelog_dispatch_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dispatch',
+            index=models.Index(fields=['LoadingDate', 'Status'], name='dispatch_loading_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dispatchdetails',
+            index=models.Index(fields=['DispatchID', 'ExpairyDate'], name='details_dispatch_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0010_loading_and_expiry_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dispatchdetails',
+            index=models.Index(fields=['Code', 'ProductionDate', 'DispatchID', 'Qty', 'ExpairyDate'], name='details_trace_idx'),
+        ),
+    ]
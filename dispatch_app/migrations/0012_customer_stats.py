@@ -0,0 +1,66 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0011_trace_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerMonthStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('Month', models.DateField()),
+                ('Orders', models.IntegerField(default=0)),
+                ('Qty', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('Pallets', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+            ],
+            options={
+                'db_table': 'CustomerMonthStats',
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('Customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='dispatch_app.customer')),
+                ('Orders', models.IntegerField(default=0)),
+                ('Qty', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('Pallets', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('LastOrderDate', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'CustomerStats',
+            },
+        ),
+        migrations.CreateModel(
+            name='DispatchStats',
+            fields=[
+                ('dispatch_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('customer_id', models.BigIntegerField()),
+                ('Month', models.DateField()),
+                ('Qty', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('Pallets', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+            ],
+            options={
+                'db_table': 'DispatchStats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dispatch',
+            index=models.Index(fields=['Customer', 'OrderDate'], name='dispatch_customer_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='customermonthstats',
+            name='Customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='month_stats', to='dispatch_app.customer'),
+        ),
+        migrations.AddConstraint(
+            model_name='customermonthstats',
+            constraint=models.UniqueConstraint(fields=('Customer', 'Month'), name='customer_month_stats_unique'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:46
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, Q, Sum, When
+
+BATCH = 1000
+
+
+def backfill_customer_stats(apps, schema_editor):
+    """Fill the stats tables from the existing dispatches, as customer_stats.rebuild() does.
+
+    Without it every customer starts at zero, and the first change to an old
+    dispatch would add only that one.
+    """
+    Dispatch = apps.get_model('dispatch_app', 'Dispatch')
+    DispatchStats = apps.get_model('dispatch_app', 'DispatchStats')
+    CustomerMonthStats = apps.get_model('dispatch_app', 'CustomerMonthStats')
+    CustomerStats = apps.get_model('dispatch_app', 'CustomerStats')
+    zero = Decimal('0')
+
+    DispatchStats.objects.all().delete()
+    CustomerMonthStats.objects.all().delete()
+    CustomerStats.objects.all().delete()
+
+    rows = (
+        Dispatch.objects.exclude(Status='cancelled').order_by()
+        .values('DispatchID', 'Customer_id', 'OrderDate')
+        .annotate(
+            qty=Sum('details__Qty'),
+            pallets=Sum(
+                Case(
+                    When(Q(details__ParPallet__gt=0), then=F('details__Qty') / F('details__ParPallet')),
+                    When(Q(details__Code__ParPallet__gt=0), then=F('details__Qty') / F('details__Code__ParPallet')),
+                ),
+                output_field=DecimalField(max_digits=20, decimal_places=4),
+            ),
+        )
+    )
+    months = defaultdict(lambda: [0, zero, zero])  # (customer, month) -> orders, qty, pallets
+    last_order = {}
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH):
+        month = row['OrderDate'].replace(day=1)
+        qty, pallets = row['qty'] or zero, row['pallets'] or zero
+        batch.append(DispatchStats(
+            dispatch_id=row['DispatchID'], customer_id=row['Customer_id'], Month=month,
+            OrderDate=row['OrderDate'], Qty=qty, Pallets=pallets,
+        ))
+        totals = months[(row['Customer_id'], month)]
+        totals[0] += 1
+        totals[1] += qty
+        totals[2] += pallets
+        customer_id = row['Customer_id']
+        last_order[customer_id] = max(last_order.get(customer_id, row['OrderDate']), row['OrderDate'])
+        if len(batch) >= BATCH:
+            DispatchStats.objects.bulk_create(batch)
+            batch = []
+    DispatchStats.objects.bulk_create(batch)
+
+    lifetime = defaultdict(lambda: [0, zero, zero])
+    for (customer_id, month), (orders, qty, pallets) in months.items():
+        lifetime[customer_id] = [a + b for a, b in zip(lifetime[customer_id], (orders, qty, pallets))]
+    CustomerMonthStats.objects.bulk_create([
+        CustomerMonthStats(Customer_id=customer_id, Month=month, Orders=orders, Qty=qty, Pallets=pallets)
+        for (customer_id, month), (orders, qty, pallets) in months.items()
+    ], batch_size=BATCH)
+    CustomerStats.objects.bulk_create([
+        CustomerStats(Customer_id=customer_id, Orders=orders, Qty=qty, Pallets=pallets,
+                      LastOrderDate=last_order[customer_id])
+        for customer_id, (orders, qty, pallets) in lifetime.items()
+    ], batch_size=BATCH)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch_app', '0012_customer_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispatchstats',
+            name='OrderDate',
+            field=models.DateField(blank=True, null=True),
+        ),
+        # Here rather than in 0012: DispatchStats is complete only once it has OrderDate
+        migrations.RunPython(backfill_customer_stats, migrations.RunPython.noop),
+    ]
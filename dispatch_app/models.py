@@ -1,4 +1,7 @@
-from django.db import models
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -74,12 +77,86 @@ class Dispatch(models.Model):
         related_name='dispatches_updated'  # ✅ Unique reverse name
     )
     updated_at = models.DateTimeField(auto_now=True)
+    # Optimistic concurrency: bumped on every save and every line edit
+    version = models.PositiveIntegerField(default=1)
 
     def __str__(self):
         return f"Dispatch {self.DispatchID} - {self.OrderNo}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+        # Atomic so the ChangeLog row (post_save) commits with the dispatch
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
     
     class Meta:
         db_table = 'Dispatch'
+        indexes = [
+            models.Index(fields=['updated_at'], name='dispatch_updated_at_idx'),
+            # Upcoming loadings (DispatchDetails.objects.upcoming())
+            models.Index(fields=['LoadingDate', 'Status'], name='dispatch_loading_idx'),
+            # A customer's latest dispatches (customer detail page, CustomerStats.LastOrderDate)
+            models.Index(fields=['Customer', 'OrderDate'], name='dispatch_customer_date_idx'),
+        ]
+
+# Batch recall: name -> lookup for DispatchDetails.objects.trace().values_list(*TRACE_FIELDS.values()).
+# The line, its dispatch (transport and seal) and its customer, in one joined query.
+TRACE_FIELDS = {
+    'LineID': 'ID',
+    'Code': 'Code',
+    'ProductionDate': 'ProductionDate',
+    'ExpairyDate': 'ExpairyDate',
+    'Qty': 'Qty',
+    'DispatchID': 'DispatchID',
+    'OrderNo': 'DispatchID__OrderNo',
+    'InvoiceNo': 'DispatchID__InvoiceNo',
+    'Status': 'DispatchID__Status',
+    'LoadingDate': 'DispatchID__LoadingDate',
+    'DeliveryDate': 'DispatchID__DeliveryDate',
+    'CustomerID': 'DispatchID__Customer',
+    'Customer': 'DispatchID__Customer__Customer',
+    'Country': 'DispatchID__Country',
+    'ContactPerson': 'DispatchID__ContactPerson',
+    'ContactNo': 'DispatchID__ContactNo',
+    'TransportNo': 'DispatchID__TransportNo',
+    'DriverName': 'DispatchID__DriverName',
+    'DriverMobile': 'DispatchID__DriverMobile',
+    'Seal': 'DispatchID__Seal',
+}
+
+
+class DispatchDetailsQuerySet(models.QuerySet):
+    """Expiry and recall queries; chain them, e.g. upcoming(start, end).near_expiry(30).fefo()."""
+    OPEN_STATUSES = ('draft', 'confirmed')  # not loaded yet
+
+    def upcoming(self, start, end):
+        """Lines of open dispatches loading between start and end (dispatch_loading_idx)."""
+        return self.filter(
+            DispatchID__LoadingDate__range=(start, end),
+            DispatchID__Status__in=self.OPEN_STATUSES,
+        )
+
+    def near_expiry(self, days):
+        """Lines that expire at most `days` days after their dispatch's loading date (or before it)."""
+        return self.filter(
+            ExpairyDate__isnull=False,
+            ExpairyDate__lte=F('DispatchID__LoadingDate') + timedelta(days=days),
+        )
+
+    def fefo(self):
+        """First expired, first out: the batch to load first comes first."""
+        return self.order_by('ExpairyDate', 'ProductionDate', 'ID')
+
+    def trace(self, code, start=None, end=None):
+        """Lines of product `code` produced between start and end (details_trace_idx), by batch."""
+        lines = self.filter(Code=code)
+        if start:
+            lines = lines.filter(ProductionDate__gte=start)
+        if end:
+            lines = lines.filter(ProductionDate__lte=end)
+        return lines.order_by('ProductionDate', 'DispatchID', 'ID')
+
 
 class DispatchDetails(models.Model):
     ID = models.AutoField(primary_key=True)
@@ -94,6 +171,7 @@ class DispatchDetails(models.Model):
     ProductionDate = models.DateField(blank=True, null=True)
     ExpairyDate = models.DateField(blank=True, null=True)
 
+    objects = DispatchDetailsQuerySet.as_manager()
     
     def __str__(self):
         return f"Detail {self.ID} for Dispatch {self.DispatchID.DispatchID}"
@@ -119,8 +197,262 @@ class DispatchDetails(models.Model):
         if par_pallet and par_pallet > 0:
             return self.Qty / par_pallet
         return None
+
+    def save(self, *args, **kwargs):
+        # Atomic so the ChangeLog row (post_save) commits with the line
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
     
     class Meta:
         db_table = 'DispatchDetails'
+        indexes = [
+            # near_expiry() on the lines of the dispatches found by LoadingDate
+            models.Index(fields=['DispatchID', 'ExpairyDate'], name='details_dispatch_expiry_idx'),
+            # trace(): seeks on Code and the ProductionDate range, and covers every line
+            # column it reads, so only the matching dispatches/customers are fetched by pk
+            models.Index(fields=['Code', 'ProductionDate', 'DispatchID', 'Qty', 'ExpairyDate'],
+                         name='details_trace_idx'),
+        ]
 
 
+
+
+class ImportJob(models.Model):
+    """An uploaded file waiting for (or being processed by) run_import_worker."""
+    KIND_CHOICES = [
+        ('customers', 'Customers'),
+        ('products', 'Products'),
+        ('dispatches', 'Dispatches'),
+        ('dispatch_details', 'Dispatch Details'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    file = models.FileField(upload_to='imports/')
+    sheet = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+
+    # Progress, saved in the same transaction as each committed chunk
+    last_row = models.IntegerField(default=1)  # sheet row number; 1 is the header
+    rows_done = models.IntegerField(default=0)
+    created_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    elapsed = models.FloatField(default=0)  # seconds spent importing, across restarts
+    error_report = models.CharField(max_length=255, blank=True)
+    message = models.TextField(blank=True)
+
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='import_jobs'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Import {self.pk} - {self.get_kind_display()} ({self.status})"
+
+    @property
+    def rows_per_sec(self):
+        return self.rows_done / self.elapsed if self.elapsed else 0
+
+    class Meta:
+        db_table = 'ImportJob'
+        ordering = ['-created_at']
+
+
+class TableVersion(models.Model):
+    """Change counter for a master-data table (Customer, Products).
+
+    Bumped on every save/delete (see signals.py) and by the import commands,
+    so clients can revalidate cached lookups with a single tiny query.
+    """
+    table = models.CharField(primary_key=True, max_length=50)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+    @classmethod
+    def bump(cls, model):
+        table = model._meta.db_table
+        now = timezone.now()
+        if not cls.objects.filter(table=table).update(version=F('version') + 1, updated_at=now):
+            cls.objects.get_or_create(table=table, defaults={'version': 1, 'updated_at': now})
+
+    @classmethod
+    def current(cls, model):
+        """(version, updated_at) for the model's table; (0, None) if never changed."""
+        row = cls.objects.filter(table=model._meta.db_table).values_list('version', 'updated_at').first()
+        return row or (0, None)
+
+    @classmethod
+    async def acurrent(cls, model):
+        """current() for async views."""
+        row = await cls.objects.filter(table=model._meta.db_table).values_list('version', 'updated_at').afirst()
+        return row or (0, None)
+
+    class Meta:
+        db_table = 'TableVersion'
+
+
+class ChangeLog(models.Model):
+    """Append-only log of dispatch and line changes, for /api/changes/.
+
+    The auto-increment id is the sync cursor. Rows are written by the
+    post_save/post_delete signals (signals.py) inside the saving
+    transaction, and by ChangeLog.record_many() wherever bulk writes skip
+    the signals (API bulk create, import commands).
+    """
+    ACTION_CHOICES = [
+        ('save', 'Save'),
+        ('delete', 'Delete'),
+    ]
+
+    table = models.CharField(max_length=50)  # db_table of the changed model
+    object_id = models.BigIntegerField()
+    dispatch_id = models.BigIntegerField()  # the dispatch to refetch; not a FK, it may be gone
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"#{self.pk} {self.action} {self.table} {self.object_id}"
+
+    @staticmethod
+    def dispatch_id_of(obj):
+        return obj.pk if isinstance(obj, Dispatch) else obj.DispatchID_id
+
+    @classmethod
+    def record(cls, obj, action):
+        cls.record_many([obj], action)
+
+    @classmethod
+    def record_many(cls, objs, action):
+        from .customer_stats import dispatches_changed
+
+        now = timezone.now()
+        rows = cls.objects.bulk_create([
+            cls(
+                table=obj._meta.db_table,
+                object_id=obj.pk,
+                dispatch_id=cls.dispatch_id_of(obj),
+                action=action,
+                changed_at=now,
+            )
+            for obj in objs
+        ])
+        dispatches_changed({row.dispatch_id for row in rows})
+
+    class Meta:
+        db_table = 'ChangeLog'
+        ordering = ['id']
+        indexes = [
+            # Latest change per dispatch: the "lines version" in fragment cache keys
+            models.Index(fields=['dispatch_id', 'id'], name='changelog_dispatch_idx'),
+        ]
+
+
+class CatalogChange(models.Model):
+    """Row-level log of Customer/Products changes; its id is the catalog version.
+
+    /api/catalog/snapshot returns the latest id with the full catalogue, and
+    ?since_version= returns only the rows logged after it.
+    """
+    ACTION_CHOICES = ChangeLog.ACTION_CHOICES
+
+    table = models.CharField(max_length=50)
+    key = models.CharField(max_length=100)  # primary key of the changed row, as text
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"v{self.pk} {self.action} {self.table} {self.key}"
+
+    @classmethod
+    def record_many(cls, model, keys, action):
+        now = timezone.now()
+        cls.objects.bulk_create([
+            cls(table=model._meta.db_table, key=str(key), action=action, changed_at=now)
+            for key in keys
+        ])
+
+    @classmethod
+    def latest_version(cls):
+        return cls.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    class Meta:
+        db_table = 'CatalogChange'
+        ordering = ['id']
+
+
+class CustomerStats(models.Model):
+    """Lifetime order totals per customer, for the customer detail page.
+
+    Kept up to date incrementally by customer_stats.py from the dispatches
+    ChangeLog records, together with CustomerMonthStats (trailing 12 months)
+    and DispatchStats (what each dispatch currently adds). Cancelled
+    dispatches are not counted.
+    """
+    Customer = models.OneToOneField(Customer, primary_key=True, on_delete=models.CASCADE, related_name='stats')
+    Orders = models.IntegerField(default=0)
+    Qty = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    Pallets = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    LastOrderDate = models.DateField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Stats for customer {self.Customer_id}"
+
+    class Meta:
+        db_table = 'CustomerStats'
+
+
+class CustomerMonthStats(models.Model):
+    """Order totals per customer and month (by OrderDate); 12 rows make the trailing year."""
+    Customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='month_stats')
+    Month = models.DateField()  # first day of the month
+    Orders = models.IntegerField(default=0)
+    Qty = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    Pallets = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+
+    def __str__(self):
+        return f"Stats for customer {self.Customer_id} in {self.Month:%Y-%m}"
+
+    class Meta:
+        db_table = 'CustomerMonthStats'
+        constraints = [
+            models.UniqueConstraint(fields=['Customer', 'Month'], name='customer_month_stats_unique'),
+        ]
+
+
+class DispatchStats(models.Model):
+    """What one dispatch currently adds to its customer's stats.
+
+    customer_stats.refresh() compares it with the dispatch as it is now and
+    applies the difference. Not a FK: the row outlives a deleted dispatch
+    until its refresh takes the dispatch's totals back out.
+    """
+    dispatch_id = models.BigIntegerField(primary_key=True)
+    customer_id = models.BigIntegerField()
+    Month = models.DateField()
+    # A new date in the same month still changes the customer's LastOrderDate.
+    # Null on rows written before this column: they compare as changed and are refreshed.
+    OrderDate = models.DateField(blank=True, null=True)
+    Qty = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    Pallets = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+
+    def __str__(self):
+        return f"Stats of dispatch {self.dispatch_id}"
+
+    class Meta:
+        db_table = 'DispatchStats'
@@ -0,0 +1,53 @@
+# dispatch_app/signals.py
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import CatalogChange, ChangeLog, Customer, Dispatch, DispatchDetails, Products, TableVersion
+
+
+@receiver([post_save, post_delete], sender=Customer)
+@receiver([post_save, post_delete], sender=Products)
+def master_data_changed(sender, instance, signal, **kwargs):
+    """Invalidate cached lookups (browser ETags, master_cache, catalog snapshot) for the changed row."""
+    from .master_cache import CACHES_BY_MODEL
+
+    TableVersion.bump(sender)
+    CatalogChange.record_many(sender, [instance.pk], 'delete' if signal is post_delete else 'save')
+    transaction.on_commit(CACHES_BY_MODEL[sender].invalidate)
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, signal, update_fields=None, **kwargs):
+    """Invalidate the users cached for CachedModelBackend (auth.py)."""
+    from .master_cache import users
+
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return  # every login does this; a stale last_login is harmless
+    TableVersion.bump(sender)
+    transaction.on_commit(users.invalidate)
+
+
+@receiver(post_save, sender=Dispatch)
+@receiver(post_save, sender=DispatchDetails)
+def dispatch_saved(sender, instance, **kwargs):
+    ChangeLog.record(instance, 'save')
+
+
+@receiver(post_delete, sender=Dispatch)
+@receiver(post_delete, sender=DispatchDetails)
+def dispatch_deleted(sender, instance, **kwargs):
+    # Runs inside the deletion's transaction, also for cascaded lines
+    ChangeLog.record(instance, 'delete')
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Route every query through middleware.instrument (request metrics, profiler SQL)."""
+    from .middleware import instrument
+
+    if instrument not in connection.execute_wrappers:
+        # First, so a connection.execute_wrapper() block open across a reconnect still pops its own wrapper
+        connection.execute_wrappers.insert(0, instrument)
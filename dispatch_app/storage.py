@@ -0,0 +1,42 @@
+# dispatch_app/storage.py
+"""Static files storage: content-hashed names plus pre-compressed copies.
+
+collectstatic writes every file as name.<hash>.ext (ManifestStaticFilesStorage),
+then a .gz copy of each text file, and a .br copy too when the optional
+"brotli" package is installed. StaticFilesMiddleware (or nginx with
+gzip_static/brotli_static) sends the smallest one the browser accepts.
+"""
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.map', '.ttf', '.eot', '.html', '.xml')
+MIN_COMPRESS_SIZE = 256  # bytes; smaller files gain nothing
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data, quality=11)))
+        for suffix, compressed in variants:
+            if len(compressed) < len(data):
+                with open(self.path(name + suffix), 'wb') as f:
+                    f.write(compressed)
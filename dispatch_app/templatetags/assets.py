@@ -0,0 +1,11 @@
+from django import template
+
+from .. import assets
+
+register = template.Library()
+
+
+@register.simple_tag
+def asset_url(name):
+    """URL of a vendored library (see dispatch_app/assets.py), e.g. {% asset_url 'bootstrap.css' %}"""
+    return assets.asset_url(name)
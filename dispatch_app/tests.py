@@ -0,0 +1,1311 @@
+"""Query-count regression tests.
+
+Every named route is requested with a small and a larger dataset, and
+the number of queries must be the same. A template that starts following
+a relation per row (an N+1) makes the larger request run more queries
+and fails here.
+"""
+import csv
+import gzip
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command, load_command_class
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Max, Sum
+from django.templatetags.static import static
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from . import api, customer_stats, importers, master_cache, urls
+from .middleware import (
+    CompressionMiddleware, ProfilingMiddleware, RequestMetricsMiddleware, brotli, brotli_padding,
+)
+from .forms import DispatchForm
+from .management.commands import loadtest
+from .metrics import store as metrics_store
+from .models import (
+    TRACE_FIELDS, ChangeLog, Customer, CustomerMonthStats, CustomerStats, Dispatch, DispatchDetails, DispatchStats,
+    ImportJob, Products,
+)
+
+SMALL = 2
+LARGE = 12
+
+
+LOCMEM = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+# Render every fragment: a cache hit would hide an N+1 in the templates
+NO_FRAGMENT_CACHE = {'default': LOCMEM, 'fragments': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+# No collectstatic manifest in tests
+PLAIN_STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(CACHES=NO_FRAGMENT_CACHE, STORAGES=PLAIN_STATIC_STORAGES)
+class QueryCountTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # A metrics file of its own, so parallel runs and earlier classes don't show up in /metrics
+        cls._metrics_dir = tempfile.mkdtemp(prefix='dispatch_app_metrics_')
+        cls._metrics_db = override_settings(METRICS_DB=os.path.join(cls._metrics_dir, 'metrics.sqlite3'))
+        cls._metrics_db.enable()
+        super().setUpClass()
+        # Don't let a TableVersion re-check land between the two measurements
+        cls._check_intervals = {c: c.check_interval for c in master_cache.CACHES_BY_MODEL.values()}
+        for cache in cls._check_intervals:
+            cache.check_interval = 3600
+
+    @classmethod
+    def tearDownClass(cls):
+        for cache, interval in cls._check_intervals.items():
+            cache.check_interval = interval
+            cache.invalidate()
+        super().tearDownClass()
+        metrics_store.flush()  # this class's requests go to its own file
+        cls._metrics_db.disable()
+        shutil.rmtree(cls._metrics_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('qc-admin', 'qc@example.com', 'pw')
+        self.client.force_login(self.user)
+        self.products = [
+            Products.objects.create(Code=f'QC{i:03d}', Description=f'Product {i}', UOM='CTN',
+                                    ParPallet=Decimal('50'), PacInCtn=Decimal('12'))
+            for i in range(LARGE)
+        ]
+        self.customer = Customer.objects.create(Customer='QC Customer', Country='UAE')
+        self.dispatch = self.add_dispatch(lines=SMALL)
+        for cache in master_cache.CACHES_BY_MODEL.values():
+            cache.invalidate()
+
+    def add_dispatch(self, lines, customer=None, status='confirmed'):
+        dispatch = Dispatch.objects.create(
+            OrderNo=f'QC-{Dispatch.objects.count() + 1}',
+            Customer=customer or self.customer,
+            OrderDate=date.today() - timedelta(days=Dispatch.objects.count()),
+            LoadingDate=date.today(),
+            Status=status,
+            created_by=self.user,
+        )
+        self.add_lines(dispatch, lines)
+        return dispatch
+
+    def add_lines(self, dispatch, count):
+        start = dispatch.details.count()
+        for product in self.products[start:start + count]:
+            DispatchDetails.objects.create(
+                DispatchID=dispatch, Code=product, Qty=Decimal('100'), ParPallet=product.ParPallet,
+                ProductionDate=date.today(), ExpairyDate=date.today() + timedelta(days=365),
+            )
+
+    def edit_form_data(self, dispatch):
+        """The edit page's form and formset submitted unchanged, as the browser would."""
+        page = self.client.get(reverse('dispatch_edit', args=[dispatch.pk]))
+        data = {}
+        for form in (page.context['form'], page.context['formset'].management_form, *page.context['formset']):
+            for field in form:
+                if field.value() is not None:
+                    data[field.html_name] = field.value()
+        return data
+
+    def grow(self):
+        """Turn the small dataset into the large one: more dispatches, lines, customers."""
+        self.add_lines(self.dispatch, LARGE - SMALL)
+        for i in range(LARGE - 1):
+            customer = self.customer if i % 2 else Customer.objects.create(Customer=f'QC Customer {i}')
+            self.add_dispatch(lines=i % 4, customer=customer, status=['draft', 'shipped'][i % 2])
+        for i in range(LARGE):
+            ImportJob.objects.create(kind='products', file=f'imports/qc{i}.xlsx', created_by=self.user)
+        for cache in master_cache.CACHES_BY_MODEL.values():
+            cache.invalidate()
+
+    def count_queries(self, url, method='get'):
+        getattr(self.client, method)(url)  # warm the master-data cache
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 400, f"{url} returned {response.status_code}")
+        return len(queries)
+
+    def assertConstantQueries(self, url_func):
+        """url_func() builds the URL; it is called again after the data grows."""
+        small = self.count_queries(url_func())
+        self.grow()
+        large = self.count_queries(url_func())
+        self.assertEqual(
+            small, large,
+            f"{url_func()} ran {small} queries with {SMALL} rows but {large} with {LARGE}: "
+            f"a query is running per row",
+        )
+
+
+class RouteQueryCountTests(QueryCountTestCase):
+    def period(self, **params):
+        start = date.today() - timedelta(days=60)
+        return urlencode({'start_date': start, 'end_date': date.today(), **params})
+
+    def test_home(self):
+        self.assertConstantQueries(lambda: reverse('home'))
+
+    def test_home_filtered_and_sorted(self):
+        self.assertConstantQueries(lambda: reverse('home') + '?status=draft')
+        self.assertConstantQueries(lambda: reverse('home') + '?sort_by=delivery')
+
+    def test_dispatch_note(self):
+        self.assertConstantQueries(lambda: reverse('dispatch_note', args=[self.dispatch.pk]))
+
+    def test_loading_sheet(self):
+        self.assertConstantQueries(lambda: reverse('loading_sheet', args=[self.dispatch.pk]))
+
+    def test_pallet_labels(self):
+        self.assertConstantQueries(lambda: reverse('pallet_labels', args=[self.dispatch.pk]))
+
+    def test_dispatch_forms(self):
+        self.assertConstantQueries(lambda: reverse('dispatch_create'))
+        self.assertConstantQueries(lambda: reverse('dispatch_edit', args=[self.dispatch.pk]))
+        self.assertConstantQueries(lambda: reverse('dispatch_delete', args=[self.dispatch.pk]))
+
+    def test_reports(self):
+        for report_type in ('customer', 'product', 'monthly'):
+            for fmt in ('', 'excel'):
+                with self.subTest(report_type=report_type, format=fmt):
+                    self.assertConstantQueries(
+                        lambda: reverse('reports') + '?' + self.period(report_type=report_type, format=fmt)
+                    )
+
+    def test_reports_customer_detail(self):
+        for fmt in ('', 'excel'):
+            with self.subTest(format=fmt):
+                self.assertConstantQueries(
+                    lambda: reverse('reports') + '?' + self.period(customer='QC Customer', format=fmt)
+                )
+
+    def test_product_pages(self):
+        code = self.products[0].Code
+        self.assertConstantQueries(lambda: reverse('product_list'))
+        self.assertConstantQueries(lambda: reverse('product_create'))
+        self.assertConstantQueries(lambda: reverse('product_detail', args=[code]))
+        self.assertConstantQueries(lambda: reverse('product_edit', args=[code]))
+        self.assertConstantQueries(lambda: reverse('product_delete', args=[code]))
+
+    def test_customer_pages(self):
+        pk = self.customer.pk
+        self.assertConstantQueries(lambda: reverse('customer_list'))
+        self.assertConstantQueries(lambda: reverse('customer_create'))
+        self.assertConstantQueries(lambda: reverse('customer_detail', args=[pk]))
+        self.assertConstantQueries(lambda: reverse('customer_edit', args=[pk]))
+        self.assertConstantQueries(lambda: reverse('customer_delete', args=[pk]))
+
+    def test_ajax_endpoints(self):
+        self.assertConstantQueries(lambda: reverse('get_customer_details', args=[self.customer.pk]))
+        self.assertConstantQueries(lambda: reverse('get_product_details', args=[self.products[0].Code]))
+
+    def test_import_pages(self):
+        job = ImportJob.objects.create(kind='customers', file='imports/qc.xlsx', created_by=self.user)
+        self.assertConstantQueries(lambda: reverse('import_jobs'))
+        self.assertConstantQueries(lambda: reverse('import_job_progress', args=[job.pk]))
+
+    def test_metrics(self):
+        self.assertConstantQueries(lambda: reverse('metrics'))
+
+    def test_api(self):
+        self.assertConstantQueries(lambda: reverse('api_dispatches'))
+        self.assertConstantQueries(lambda: reverse('api_dispatches') + '?fields=OrderNo,CustomerName,lines')
+        self.assertConstantQueries(lambda: reverse('api_changes'))
+        self.assertConstantQueries(lambda: reverse('api_catalog_snapshot'))
+        self.assertConstantQueries(lambda: reverse('api_catalog_snapshot') + '?since_version=0')
+
+
+@override_settings(CACHES={'default': LOCMEM, 'fragments': {**LOCMEM, 'LOCATION': 'test-fragments'}})
+class FragmentCacheTests(QueryCountTestCase):
+    def get(self, name, *args):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name, args=args))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(queries)
+
+    def test_documents_are_served_from_the_cache(self):
+        for name in ('dispatch_note', 'loading_sheet', 'pallet_labels'):
+            with self.subTest(name):
+                _, first = self.get(name, self.dispatch.pk)
+                _, second = self.get(name, self.dispatch.pk)
+                self.assertLess(second, first)
+
+    def test_document_changes_with_the_dispatch_and_its_lines(self):
+        self.get('dispatch_note', self.dispatch.pk)
+        self.dispatch.DriverName = 'Fresh Driver'
+        self.dispatch.save()
+        html, _ = self.get('dispatch_note', self.dispatch.pk)
+        self.assertIn('Fresh Driver', html)
+
+        line = self.dispatch.details.first()
+        line.Qty = Decimal('4321')
+        line.save()
+        html, _ = self.get('dispatch_note', self.dispatch.pk)
+        self.assertIn('4321', html)
+
+        line.delete()
+        html, _ = self.get('loading_sheet', self.dispatch.pk)
+        self.assertNotIn(line.Code_id, html)
+
+    def test_home_rows_change_with_the_dispatch(self):
+        html, _ = self.get('home')
+        self.assertIn(self.dispatch.OrderNo, html)
+        self.dispatch.OrderNo = 'QC-RENAMED'
+        self.dispatch.save()
+        html, _ = self.get('home')
+        self.assertIn('QC-RENAMED', html)
+        self.add_lines(self.dispatch, 3)
+        html, _ = self.get('home')
+        self.assertIn(f'{SMALL + 3} items', html)
+
+    def test_home_rows_change_with_the_customer(self):
+        self.get('home')
+        self.customer.Customer = 'QC Renamed Customer'
+        with self.captureOnCommitCallbacks(execute=True):  # master_cache is cleared on commit
+            self.customer.save()
+        html, _ = self.get('home')
+        self.assertIn('QC Renamed Customer', html)
+
+
+class CompressionTests(QueryCountTestCase):
+    def test_pages_are_gzipped(self):
+        for url in (reverse('home'), reverse('dispatch_create'), reverse('dispatch_edit', args=[self.dispatch.pk])):
+            with self.subTest(url):
+                plain = self.client.get(url)
+                compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+                self.assertEqual(compressed['Content-Encoding'], 'gzip')
+                self.assertIn('Accept-Encoding', compressed['Vary'])
+                self.assertLess(len(compressed.content), len(plain.content) / 2)
+                # Same page apart from the per-request CSRF token
+                self.assertIn(b'</html>', gzip.decompress(compressed.content))
+
+    def test_excel_and_encoded_responses_are_left_alone(self):
+        excel = self.client.get(reverse('reports') + '?format=excel', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(excel.has_header('Content-Encoding'))
+        snapshot = self.client.get(reverse('api_catalog_snapshot'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(snapshot['Content-Encoding'], 'gzip')
+        self.assertIn(b'"products"', gzip.decompress(snapshot.content))
+
+    def test_streaming_responses_are_compressed(self):
+        chunks = [b'line %d\n' % i * 50 for i in range(5)]
+        middleware = CompressionMiddleware(lambda request: StreamingHttpResponse(iter(chunks), content_type='text/csv'))
+        response = middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        parts = list(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(parts)), b''.join(chunks))
+
+    def test_gzip_length_is_randomised_against_breach(self):
+        body = b'<p>same page</p>' * 200
+        middleware = CompressionMiddleware(lambda request: HttpResponse(body))
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        responses = [middleware(request) for _ in range(20)]
+        for response in responses:
+            self.assertTrue(response.content[3] & gzip.FNAME)  # the random filename
+            self.assertEqual(gzip.decompress(response.content), body)
+        self.assertGreater(len({len(response.content) for response in responses}), 1)
+
+    def test_brotli_padding_is_a_metadata_block(self):
+        for _ in range(50):
+            block = brotli_padding(100)
+            # ISLAST=0, MNIBBLES=0 (metadata), reserved=0, MSKIPBYTES=1
+            self.assertEqual(block[0] & 0b111111, 0b010110)
+            skip = (block[0] >> 6 | block[1] << 2) + 1
+            self.assertEqual(len(block), 2 + skip)
+            self.assertLessEqual(skip, 100)
+
+    @skipUnless(brotli, 'needs the brotli package')
+    def test_brotli_is_padded_and_decodes(self):
+        body = b'<p>same page</p>' * 200
+        middleware = CompressionMiddleware(lambda request: HttpResponse(body))
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, br')
+        responses = [middleware(request) for _ in range(20)]
+        for response in responses:
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(brotli.decompress(response.content), body)
+        self.assertGreater(len({len(response.content) for response in responses}), 1)
+
+        chunks = [b'line %d\n' % i * 50 for i in range(5)]
+        middleware = CompressionMiddleware(lambda request: StreamingHttpResponse(iter(chunks), content_type='text/csv'))
+        response = middleware(request)
+        self.assertEqual(brotli.decompress(b''.join(response.streaming_content)), b''.join(chunks))
+
+    def test_placed_like_gzip_middleware(self):
+        """Right after SecurityMiddleware, so every middleware that reads or edits the body runs first."""
+        order = list(settings.MIDDLEWARE)
+        compression = order.index('dispatch_app.middleware.CompressionMiddleware')
+        self.assertEqual(order[compression - 1], 'django.middleware.security.SecurityMiddleware')
+        self.assertLess(compression, order.index('dispatch_app.middleware.ProfilingMiddleware'))
+
+
+@override_settings(REQUEST_METRICS_SERVER_TIMING=True)
+class AsyncViewTests(QueryCountTestCase):
+    """The async views through the ASGI request path (AsyncClient)."""
+    async def test_autofill_revalidates_until_the_table_changes(self):
+        url = reverse('get_customer_details', args=[self.customer.pk])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['Country'], 'UAE')
+        cached = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+        self.customer.Country = 'Oman'
+        await self.customer.asave()
+        changed = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_product_autofill_etag_changes_after_a_bulk_import(self):
+        """Imports write without signals; they must still bump the TableVersion behind the ETag."""
+        product = self.products[0]
+        url = reverse('get_product_details', args=[product.Code])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+        workdir = tempfile.mkdtemp(prefix='dispatch_app_etag_')
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        path = os.path.join(workdir, 'Products.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([['Code', 'Description'], [product.Code, 'Renamed by import']])
+        call_command('import_products', path=path, stdout=StringIO())
+
+        changed = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(changed.json()['Description'], 'Renamed by import')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': changed['ETag']}).status_code, 304)
+
+    async def test_queries_run_by_async_views_are_counted(self):
+        response = await self.async_client.get(reverse('reports') + '?report_type=product')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    async def test_excel_export(self):
+        response = await self.async_client.get(reverse('reports') + '?format=excel')
+        self.assertEqual(response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.assertTrue(response.content.startswith(b'PK'))
+
+    def test_middleware_stays_async(self):
+        async def view(request):
+            return HttpResponse()
+
+        for middleware in (RequestMetricsMiddleware, CompressionMiddleware, ProfilingMiddleware):
+            with self.subTest(middleware.__name__):
+                self.assertTrue(iscoroutinefunction(middleware(view)))
+
+
+class RequestMetricsTests(QueryCountTestCase):
+    def test_request_over_its_budget_is_logged(self):
+        budgets = {'default': {'queries': 1000, 'ms': 60000}, 'dispatch_note': {'queries': 1}}
+        url = reverse('dispatch_note', args=[self.dispatch.pk])
+        with override_settings(REQUEST_BUDGETS=budgets):
+            with self.assertLogs('dispatch_app.slow_requests', 'WARNING') as logs:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            with self.assertNoLogs('dispatch_app.slow_requests'):
+                self.client.get(reverse('product_list'))
+
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['url_name'], entry['path'], entry['status']), ('dispatch_note', url, 200))
+        self.assertEqual((entry['over'], entry['user']), (['queries'], self.user.username))
+        self.assertGreater(entry['queries'], 1)
+        self.assertGreater(entry['template_ms'], 0)
+
+    @override_settings(REQUEST_METRICS_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('dispatch_note', args=[self.dispatch.pk]))
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+
+
+class MetricsEndpointTests(QueryCountTestCase):
+    def test_histogram_and_counters(self):
+        self.client.get(reverse('product_list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+
+        self.assertIn('# TYPE dispatch_http_request_duration_seconds histogram\n', body)
+        self.assertIn('# TYPE dispatch_http_requests_total counter\n', body)
+        buckets = re.findall(r'^dispatch_http_request_duration_seconds_bucket\{le="([^"]+)",url_name="product_list"\} (\d+)$',
+                             body, re.MULTILINE)
+        self.assertEqual([le for le, _ in buckets][-2:], ['10', '+Inf'])
+        counts = [int(count) for _, count in buckets]
+        self.assertEqual(counts, sorted(counts))  # cumulative
+        self.assertGreaterEqual(counts[-1], 1)
+        self.assertIn(f'\ndispatch_http_request_duration_seconds_count{{url_name="product_list"}} {counts[-1]}\n', body)
+        self.assertRegex(body, r'(?m)^dispatch_http_requests_total\{status="2xx",url_name="product_list"\} [1-9]')
+        self.assertRegex(body, r'(?m)^dispatch_dispatches\{status="confirmed"\} 1$')
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_anonymous_scrapers_need_an_allowed_ip_or_the_token(self):
+        self.client.logout()
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9').status_code, 403)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9',
+                                         headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9',
+                                         headers={'Authorization': 'Bearer scrape-secret'}).status_code, 200)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 200)
+
+
+class ProfilingTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp(prefix='dispatch_app_profiles_')
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.profiles = os.path.join(media, 'profiles')
+
+    def saved(self):
+        return sorted(os.listdir(self.profiles)) if os.path.isdir(self.profiles) else []
+
+    def test_staff_request_is_profiled(self):
+        response = self.client.get(reverse('product_list') + '?_profile=1')
+        self.assertEqual(response.status_code, 200)
+        report_url = response['X-Profile-Report']
+        self.assertContains(response, f'href="{report_url}"')
+        self.assertEqual([name.rsplit('.', 1)[1] for name in self.saved()], ['html', 'prof'])
+
+        report = self.client.get(report_url)
+        self.assertEqual(report.status_code, 200)
+        self.assertIn(b'cumulative', b''.join(report.streaming_content))
+        name = self.saved()[1]
+        prof = self.client.get(reverse('profile_report', args=[name]))
+        self.assertIn('attachment', prof['Content-Disposition'])
+
+        by_header = self.client.get(reverse('product_list'), headers={'X-Profile': '1'})
+        self.assertTrue(by_header.has_header('X-Profile-Report'))
+
+    def test_switched_off_or_not_staff_is_not_profiled(self):
+        self.assertFalse(self.client.get(reverse('product_list') + '?_profile=0').has_header('X-Profile-Report'))
+        self.assertFalse(self.client.get(reverse('product_list'), headers={'X-Profile': '0'}).has_header('X-Profile-Report'))
+
+        clerk = User.objects.create_user('qc-clerk', password='pw')
+        self.client.force_login(clerk)
+        self.assertFalse(self.client.get(reverse('product_list') + '?_profile=1').has_header('X-Profile-Report'))
+        self.assertEqual(self.saved(), [])
+
+    def test_reports_are_staff_only(self):
+        self.client.get(reverse('product_list') + '?_profile=1')
+        name = self.saved()[0]
+        clerk = User.objects.create_user('qc-clerk', password='pw')
+        self.client.force_login(clerk)
+        response = self.client.get(reverse('profile_report', args=[name]))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(settings.LOGIN_URL))
+
+
+class SessionTests(QueryCountTestCase):
+    def get_products(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product_list'))
+        return response, [q['sql'] for q in queries]
+
+    def test_warm_requests_skip_the_session_and_user_queries(self):
+        self.get_products()
+        response, queries = self.get_products()
+        self.assertEqual(response.status_code, 200)
+        for table in ('django_session', 'auth_user'):
+            self.assertFalse([sql for sql in queries if f'FROM "{table}"' in sql], table)
+
+    def test_changed_user_is_reloaded(self):
+        self.get_products()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response, _ = self.get_products()
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(HOME_EVENTS_MAX_SECONDS=0, HOME_EVENTS_POLL_SECONDS=0)  # one poll, then the stream ends
+class HomeEventsTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(self.user)
+
+    def cursor(self):
+        return ChangeLog.objects.order_by('-id').values_list('id', flat=True).first()
+
+    def read_events(self, since):
+        """[(event, id, data)] from one pass of the stream, and the number of queries it ran."""
+        async def read():
+            response = await self.async_client.get(reverse('home_events') + f'?since={since}')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        with CaptureQueriesContext(connection) as queries:
+            body = async_to_sync(read)()
+        events = []
+        for message in body.split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in message.splitlines() if not line.startswith(':'))
+            if 'data' in fields:
+                events.append((fields.get('event'), fields.get('id'), json.loads(fields['data'])))
+        return events, len(queries)
+
+    def test_changes_are_pushed(self):
+        since = self.cursor()
+        gone = self.add_dispatch(lines=0).pk
+        self.dispatch.Status = 'shipped'
+        self.dispatch.save()
+        Dispatch.objects.get(pk=gone).delete()
+
+        events, _ = self.read_events(since)
+        changes = {data['id']: data for event, _, data in events if event == 'dispatch'}
+        self.assertEqual(changes, {
+            self.dispatch.pk: {'id': self.dispatch.pk, 'status': 'shipped', 'lines': SMALL, 'urgency': ''},
+            gone: {'id': gone, 'deleted': True},
+        })
+        event, cursor, counts = events[-1]
+        self.assertEqual((event, cursor), ('counts', str(self.cursor())))
+        self.assertEqual((counts['total'], counts['shipped']), (1, 1))
+
+    def test_queries_do_not_grow_with_the_changes(self):
+        since = self.cursor()
+        self.dispatch.save()
+        _, few = self.read_events(since)
+        self.grow()
+        _, many = self.read_events(since)
+        self.assertEqual(few, many)
+
+    def test_nothing_new(self):
+        events, _ = self.read_events(self.cursor())
+        self.assertEqual(events, [])
+
+    def test_wsgi_answers_at_once_and_resumes_from_the_last_event_id(self):
+        """Under WSGI a stream would only arrive when it ends: one short poll per reconnect instead."""
+        since = self.cursor()
+        url = reverse('home_events') + f'?since={since}'
+        idle = self.client.get(url)
+        self.assertFalse(idle.streaming)
+        self.assertEqual(idle['Content-Type'], 'text/event-stream')
+        self.assertEqual(idle.content, b'retry: 5000\n\n')
+
+        self.dispatch.Status = 'shipped'
+        self.dispatch.save()
+        body = self.client.get(url).content.decode()
+        self.assertIn('event: dispatch\n', body)
+        self.assertIn(f'event: counts\nid: {self.cursor()}\n', body)
+        # The browser reconnects with the counts event's id
+        self.assertEqual(self.client.get(url, headers={'Last-Event-ID': str(self.cursor())}).content,
+                         b'retry: 5000\n\n')
+
+
+class ExpiryTests(QueryCountTestCase):
+    def expire_lines(self, dispatch, days_after_loading):
+        dispatch.details.update(ExpairyDate=dispatch.LoadingDate + timedelta(days=days_after_loading))
+
+    def test_report_lists_near_expiry_lines_of_open_dispatches(self):
+        self.expire_lines(self.dispatch, 10)
+        later = self.add_dispatch(lines=1)
+        self.expire_lines(later, 90)
+        shipped = self.add_dispatch(lines=1, status='shipped')
+        self.expire_lines(shipped, 10)
+
+        response = self.client.get(reverse('expiry_report'))
+        groups = response.context['groups']
+        self.assertEqual([(g['Code_id'], g['lines']) for g in groups],
+                         [(line.Code_id, 1) for line in self.dispatch.details.fefo()])
+        wider = self.client.get(reverse('expiry_report') + '?within=100').context['groups']
+        self.assertEqual(sum(g['lines'] for g in wider), SMALL + 1)
+
+    def test_expired_lines_are_counted_per_dispatch(self):
+        """The earliest expiry is on the later loading: only that line is expired when it loads."""
+        customer = Customer.objects.create(Customer='Two Loadings')
+        soon = self.add_dispatch(lines=1, customer=customer)
+        later = self.add_dispatch(lines=1, customer=customer)
+        Dispatch.objects.filter(pk=later.pk).update(LoadingDate=date.today() + timedelta(days=10))
+        soon.details.update(ExpairyDate=date.today() + timedelta(days=20))
+        later.details.update(ExpairyDate=date.today() + timedelta(days=5))
+
+        response = self.client.get(reverse('expiry_report'))
+        group, = [g for g in response.context['groups'] if g['DispatchID__Customer__Customer'] == 'Two Loadings']
+        self.assertEqual((group['lines'], group['expired_lines']), (2, 1))
+        self.assertEqual((group['first_loading'], group['first_expiry']),
+                         (date.today(), date.today() + timedelta(days=5)))
+        self.assertContains(response, '1 expired at loading')
+
+    def test_report_queries(self):
+        self.expire_lines(self.dispatch, 10)
+        self.assertConstantQueries(lambda: reverse('expiry_report'))
+
+    def test_dispatch_form_warns_but_saves(self):
+        """Resubmit the edit form unchanged: the save goes through, with a warning."""
+        self.expire_lines(self.dispatch, 5)
+        url = reverse('dispatch_edit', args=[self.dispatch.pk])
+        response = self.client.post(url, self.edit_form_data(self.dispatch), follow=True)
+        self.assertRedirects(response, reverse('home'))
+        self.assertIn('expire within 30 days of loading', ' '.join(str(m) for m in response.context['messages']))
+
+
+class TraceTests(QueryCountTestCase):
+    def trace_url(self, url, **params):
+        params = {'code': self.products[0].Code, 'produced_from': date.today(), 'produced_to': date.today(), **params}
+        return f"{url}?{urlencode(params)}"
+
+    def test_page_lists_every_dispatch_of_the_batch(self):
+        self.grow()
+        other_batch = self.add_dispatch(lines=1)
+        other_batch.details.update(ProductionDate=date.today() - timedelta(days=1))
+
+        response = self.client.get(self.trace_url(reverse('trace_report')))
+        received = DispatchDetails.objects.filter(Code=self.products[0], ProductionDate=date.today())
+        self.assertEqual(sorted(row['LineID'] for row in response.context['rows']),
+                         sorted(received.values_list('ID', flat=True)))
+        self.assertEqual(response.context['totals']['customers'],
+                         received.values('DispatchID__Customer').distinct().count())
+        self.assertNotIn(other_batch.OrderNo, response.content.decode())
+
+    def test_page_queries(self):
+        self.assertConstantQueries(lambda: self.trace_url(reverse('trace_report')))
+
+    def test_lines_are_read_from_the_covering_index(self):
+        lines = DispatchDetails.objects.trace(self.products[0].Code, date.today(), date.today())
+        plan = lines.values_list(*TRACE_FIELDS.values()).explain()
+        self.assertIn('COVERING INDEX details_trace_idx', plan)
+
+    def test_excel_export_has_every_line(self):
+        from openpyxl import load_workbook
+
+        self.grow()
+        response = self.client.get(self.trace_url(reverse('trace_report'), format='excel'))
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)['Trace']
+        rows = list(sheet.values)
+        self.assertEqual(rows[0][:3], ('LineID', 'Code', 'ProductionDate'))
+        self.assertEqual(len(rows) - 1, DispatchDetails.objects.filter(Code=self.products[0]).count())
+
+    def test_api_pages_through_the_batch(self):
+        self.grow()
+        url = self.trace_url(reverse('api_trace'), limit=2)
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen += [row['OrderNo'] for row in data['results']]
+            url = data['next']
+        expected = DispatchDetails.objects.filter(Code=self.products[0]).order_by('ID')
+        self.assertEqual(seen, list(expected.values_list('DispatchID__OrderNo', flat=True)))
+        self.assertEqual(self.client.get(reverse('api_trace')).status_code, 400)
+
+    def test_api_queries(self):
+        self.assertConstantQueries(lambda: self.trace_url(reverse('api_trace')))
+
+
+class CustomerStatsTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        customer_stats.rebuild()  # setUp's writes never committed, so nothing was refreshed
+
+    def stats(self, customer=None):
+        customer = customer or self.customer
+        row = CustomerStats.objects.filter(Customer=customer).first()
+        return row and (row.Orders, row.Qty, row.LastOrderDate)
+
+    def recomputed(self, customer=None):
+        dispatches = Dispatch.objects.filter(Customer=customer or self.customer).exclude(Status='cancelled')
+        lines = DispatchDetails.objects.filter(DispatchID__in=dispatches)
+        return (dispatches.count(), lines.aggregate(q=Sum('Qty'))['q'] or 0,
+                dispatches.aggregate(d=Max('OrderDate'))['d'])
+
+    def test_stats_follow_every_kind_of_change(self):
+        other = Customer.objects.create(Customer='QC Other')
+        with self.captureOnCommitCallbacks(execute=True):
+            added = self.add_dispatch(lines=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            added.details.first().delete()
+        line = self.dispatch.details.first()
+        line.Qty = Decimal('250')
+        with self.captureOnCommitCallbacks(execute=True):
+            line.save()
+        self.assertEqual(self.stats(), self.recomputed())
+
+        added.Customer = other
+        with self.captureOnCommitCallbacks(execute=True):
+            added.save()
+        self.assertEqual(self.stats(), self.recomputed())
+        self.assertEqual(self.stats(other), self.recomputed(other))
+
+        self.dispatch.Status = 'cancelled'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dispatch.save()
+        self.assertEqual(self.stats(), (0, 0, None))
+        with self.captureOnCommitCallbacks(execute=True):
+            added.delete()
+        self.assertEqual(self.stats(other), (0, 0, None))
+
+    def test_last_order_date_follows_a_date_change_within_the_month(self):
+        first = date.today().replace(day=1)
+        self.dispatch.OrderDate = first
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dispatch.save()
+        self.assertEqual(CustomerStats.objects.get(Customer=self.customer).LastOrderDate, first)
+
+        self.dispatch.OrderDate = first + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dispatch.save()
+        stats = CustomerStats.objects.get(Customer=self.customer)
+        self.assertEqual(stats.LastOrderDate, first + timedelta(days=1))
+        self.assertEqual(stats.Orders, 1)
+        self.assertEqual(self.stats(), self.recomputed())
+
+    def test_migration_backfill_matches_rebuild(self):
+        """Upgrading a database with orders must not start every customer at zero."""
+        self.grow()
+        Dispatch.objects.filter(pk=self.dispatch.pk).update(OrderDate=date.today() - timedelta(days=400))
+        self.add_dispatch(lines=2, status='cancelled')
+        customer_stats.rebuild()
+
+        def snapshot():
+            return (
+                list(CustomerStats.objects.order_by('pk').values_list()),
+                list(CustomerMonthStats.objects.order_by('Customer', 'Month')
+                     .values_list('Customer', 'Month', 'Orders', 'Qty', 'Pallets')),
+                list(DispatchStats.objects.order_by('pk').values_list()),
+            )
+
+        rebuilt = snapshot()
+        CustomerStats.objects.all().delete()
+        migration = import_module('dispatch_app.migrations.0013_dispatchstats_orderdate')
+        migration.backfill_customer_stats(django_apps, None)
+        self.assertEqual(snapshot(), rebuilt)
+        self.assertEqual(self.stats(), self.recomputed())
+
+    def test_bulk_writes_are_counted(self):
+        dispatch = Dispatch(OrderNo='QC-BULK', Customer=self.customer, OrderDate=date.today(), Status='draft')
+        with self.captureOnCommitCallbacks(execute=True):
+            Dispatch.objects.bulk_create([dispatch])
+            lines = DispatchDetails.objects.bulk_create([
+                DispatchDetails(DispatchID=dispatch, Code=self.products[0], Qty=Decimal('40'))
+            ])
+            ChangeLog.record_many([dispatch] + lines, 'save')
+        self.assertEqual(self.stats(), self.recomputed())
+
+    def test_trailing_window_and_pallets(self):
+        old = self.add_dispatch(lines=1)
+        old.OrderDate = customer_stats.trailing_start(date.today()) - timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            old.save()
+        lifetime, trailing = customer_stats.for_customer(self.customer.pk, date.today())
+        self.assertEqual(lifetime.Orders, 2)
+        self.assertEqual(trailing['orders'], 1)
+        self.assertEqual(trailing['pallets'], Decimal('4'))  # 2 lines of 100 at 50 per pallet
+
+    def test_detail_page(self):
+        response = self.client.get(reverse('customer_detail', args=[self.customer.pk]))
+        self.assertEqual([d.pk for d in response.context['recent_dispatches']], [self.dispatch.pk])
+        self.assertContains(response, self.dispatch.OrderNo)
+        self.assertEqual(response.context['stats'].Orders, 1)
+
+    def test_recent_dispatches_use_the_index(self):
+        plan = self.customer.dispatch_set.order_by('-OrderDate', '-DispatchID')[:5].explain()
+        self.assertIn('dispatch_customer_date_idx', plan)
+
+    def test_customer_with_dispatches_is_not_deleted(self):
+        url = reverse('customer_delete', args=[self.customer.pk])
+        self.assertEqual(self.client.get(url).context['dispatch_count'], 1)
+        response = self.client.post(url)
+        self.assertRedirects(response, reverse('customer_detail', args=[self.customer.pk]))
+        self.assertTrue(Customer.objects.filter(pk=self.customer.pk).exists())
+
+
+class ApiBehaviourTests(QueryCountTestCase):
+    def post_json(self, url, payload):
+        return self.client.post(url, json.dumps(payload), content_type='application/json')
+
+    def new_dispatch(self, order_no, *codes):
+        return {
+            'OrderNo': order_no, 'Customer': self.customer.pk, 'OrderDate': date.today().isoformat(),
+            'lines': [{'Code': code, 'Qty': '10'} for code in codes],
+        }
+
+    def test_bulk_create(self):
+        response = self.post_json(reverse('api_dispatches'), [
+            self.new_dispatch('BULK-1', self.products[0].Code, self.products[1].Code),
+            self.new_dispatch('BULK-2', self.products[2].Code),
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([d['OrderNo'] for d in response.json()['created']], ['BULK-1', 'BULK-2'])
+        created = Dispatch.objects.get(OrderNo='BULK-1')
+        self.assertEqual(created.Status, 'draft')
+        self.assertEqual(list(created.details.order_by('ID').values_list('Code', 'Description')),
+                         [(p.Code, p.Description) for p in self.products[:2]])
+
+    def test_bulk_create_is_all_or_nothing(self):
+        before = (Dispatch.objects.count(), DispatchDetails.objects.count(), ChangeLog.objects.count())
+        response = self.post_json(reverse('api_dispatches'), [
+            self.new_dispatch('BULK-OK', self.products[0].Code),
+            self.new_dispatch(self.dispatch.OrderNo, 'NO-SUCH-CODE'),
+            self.new_dispatch('BULK-OK', self.products[1].Code),
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(sorted(errors), ['1', '2'])
+        self.assertIn('OrderNo', errors['1'])
+        self.assertEqual(list(errors['1']['lines']['0']), ['Code'])
+        self.assertIn("already exists", errors['2']['OrderNo'][0])  # duplicate within the request
+        self.assertEqual((Dispatch.objects.count(), DispatchDetails.objects.count(), ChangeLog.objects.count()),
+                         before)
+
+    def test_bulk_create_reports_an_order_no_taken_meanwhile(self):
+        """Another request commits the same OrderNo between the check and the insert: 400, not 500."""
+        real_build = api.build_dispatches
+
+        def build_then_race(payload, user):
+            built = real_build(payload, user)
+            Dispatch.objects.create(OrderNo='BULK-RACE', Customer=self.customer, OrderDate=date.today())
+            return built
+
+        before = DispatchDetails.objects.count()
+        with mock.patch.object(api, 'build_dispatches', build_then_race):
+            response = self.post_json(reverse('api_dispatches'), [
+                self.new_dispatch('BULK-FREE', self.products[0].Code),
+                self.new_dispatch('BULK-RACE', self.products[1].Code),
+            ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], {'1': {'OrderNo': ["OrderNo 'BULK-RACE' already exists"]}})
+        self.assertFalse(Dispatch.objects.filter(OrderNo='BULK-FREE').exists())
+        self.assertEqual(DispatchDetails.objects.count(), before)
+
+    def test_changes_cursor_has_no_gaps(self):
+        cursor = self.client.get(f"{reverse('api_changes')}?since=latest").json()['cursor']
+        line = self.dispatch.details.first()
+        line.Qty = Decimal('1')
+        line.save()
+        added = self.add_dispatch(lines=2)
+        line.delete()
+
+        seen = []
+        while True:
+            data = self.client.get(f"{reverse('api_changes')}?since={cursor}&limit=2").json()
+            seen += data['changes']
+            cursor = data['cursor']
+            if not data['has_more']:
+                break
+        ids = [c['id'] for c in seen]
+        self.assertEqual(ids, list(ChangeLog.objects.filter(id__gt=ids[0] - 1).values_list('id', flat=True)))
+        self.assertEqual(len(ids), 5)  # line save, dispatch, 2 lines, line delete
+        self.assertEqual(seen[-1]['action'], 'delete')
+        self.assertEqual({c['dispatch_id'] for c in seen}, {self.dispatch.pk, added.pk})
+        self.assertEqual(self.client.get(f"{reverse('api_changes')}?since={cursor}").json()['changes'], [])
+
+    def test_snapshot_delta_lists_deleted_keys(self):
+        version = self.client.get(reverse('api_catalog_snapshot')).json()['version']
+        edited, deleted = self.products[0], self.products[LARGE - 1]
+        edited.Description = 'Renamed'
+        edited.save()
+        deleted_code = deleted.Code
+        deleted.delete()
+        self.customer.Status = False
+        self.customer.save()
+        kept = Customer.objects.create(Customer='QC New')
+
+        data = self.client.get(f"{reverse('api_catalog_snapshot')}?since_version={version}").json()
+        self.assertFalse(data['full'])
+        self.assertGreater(data['version'], version)
+        self.assertEqual([(p['Code'], p['Description']) for p in data['products']], [(edited.Code, 'Renamed')])
+        self.assertEqual([c['CustomerID'] for c in data['customers']], [kept.pk])
+        self.assertEqual(data['deleted'], {'products': [deleted_code], 'customers': [self.customer.pk]})
+
+        latest = self.client.get(f"{reverse('api_catalog_snapshot')}?since_version={data['version']}").json()
+        self.assertEqual((latest['products'], latest['customers']), ([], []))
+
+
+class CustomerChoiceTests(QueryCountTestCase):
+    def test_inactive_customers_are_neither_offered_nor_accepted(self):
+        zeta = Customer.objects.create(Customer='Zeta Foods')
+        alpha = Customer.objects.create(Customer='Alpha Foods')
+        gone = Customer.objects.create(Customer='Gone Foods', Status=False)
+
+        field = DispatchForm().fields['Customer']
+        self.assertEqual([pk for pk, _ in field.choices if pk], [self.customer.pk, zeta.pk, alpha.pk])
+        data = {**self.edit_form_data(self.dispatch), 'Customer': gone.pk}
+        form = DispatchForm(data, instance=self.dispatch)
+        self.assertFalse(form.is_valid())
+        self.assertIn('Customer', form.errors)
+
+    def test_inactive_customer_already_on_the_dispatch_is_kept(self):
+        data = self.edit_form_data(self.dispatch)
+        Customer.objects.filter(pk=self.customer.pk).update(Status=False)
+        master_cache.customers.invalidate()
+
+        form = DispatchForm(data, instance=Dispatch.objects.get(pk=self.dispatch.pk))
+        self.assertIn(self.customer.pk, [pk for pk, _ in form.fields['Customer'].choices])
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+class ConcurrencyTests(QueryCountTestCase):
+    def test_form_rejects_a_stale_version(self):
+        data = self.edit_form_data(self.dispatch)
+        self.dispatch.Seal = 'S-OTHER'
+        self.dispatch.save()  # someone else saves meanwhile
+
+        response = self.client.post(reverse('dispatch_edit', args=[self.dispatch.pk]), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'changed by someone else')
+        self.dispatch.refresh_from_db()
+        self.assertEqual(self.dispatch.Seal, 'S-OTHER')
+
+    def test_invalid_lines_then_corrected_resubmit_saves(self):
+        """A rejected formset must not use up the version the page was opened at."""
+        data = self.edit_form_data(self.dispatch)
+        qty = next(key for key in data if key.endswith('-0-Qty'))
+        url = reverse('dispatch_edit', args=[self.dispatch.pk])
+
+        response = self.client.post(url, {**data, 'Seal': 'S-NEW', qty: 'not a number'})
+        self.assertEqual(response.status_code, 200)
+        self.dispatch.refresh_from_db()
+        self.assertEqual(self.dispatch.version, int(data['version']))
+        self.assertNotEqual(self.dispatch.Seal, 'S-NEW')
+
+        response = self.client.post(url, {**data, 'Seal': 'S-NEW'})
+        self.assertRedirects(response, reverse('home'))
+        self.dispatch.refresh_from_db()
+        self.assertEqual((self.dispatch.version, self.dispatch.Seal), (int(data['version']) + 1, 'S-NEW'))
+
+    def test_only_one_of_two_concurrent_submits_wins(self):
+        """Both forms pass clean() before either saves: the version claim stops the second."""
+        data = self.edit_form_data(self.dispatch)
+        first = DispatchForm(data, instance=Dispatch.objects.get(pk=self.dispatch.pk))
+        second = DispatchForm(data, instance=Dispatch.objects.get(pk=self.dispatch.pk))
+        self.assertTrue(first.is_valid())
+        self.assertTrue(second.is_valid())
+
+        self.assertTrue(first.claim_version())
+        first.save()
+        self.assertFalse(second.claim_version())
+        self.assertIn('changed by someone else', str(second.non_field_errors()))
+        self.dispatch.refresh_from_db()
+        self.assertEqual(self.dispatch.version, int(data['version']) + 1)
+
+    def line_url(self, line):
+        return reverse('api_dispatch_line', args=[self.dispatch.pk, line.pk])
+
+    def test_api_line_edit_with_if_match(self):
+        line = self.dispatch.details.first()
+        version = self.dispatch.version
+        response = self.client.patch(self.line_url(line), json.dumps({'Qty': '75'}),
+                                     content_type='application/json', HTTP_IF_MATCH=f'"{version}"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], version + 1)
+        line.refresh_from_db()
+        self.assertEqual(line.Qty, Decimal('75'))
+
+        # The same If-Match again is now stale
+        response = self.client.patch(self.line_url(line), json.dumps({'Qty': '10'}),
+                                     content_type='application/json', HTTP_IF_MATCH=f'"{version}"')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['errors'], {'version': version + 1})
+        line.refresh_from_db()
+        self.assertEqual(line.Qty, Decimal('75'))
+
+    def test_api_line_delete_needs_the_current_version(self):
+        line = self.dispatch.details.first()
+        response = self.client.delete(self.line_url(line))
+        self.assertEqual(response.status_code, 428)
+        response = self.client.delete(self.line_url(line), HTTP_IF_MATCH=str(self.dispatch.version - 1))
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(DispatchDetails.objects.filter(pk=line.pk).exists())
+
+        response = self.client.delete(self.line_url(line), HTTP_IF_MATCH=str(self.dispatch.version))
+        self.assertEqual(response.json(), {'version': self.dispatch.version + 1, 'deleted': line.pk})
+        self.assertFalse(DispatchDetails.objects.filter(pk=line.pk).exists())
+
+    def test_api_line_add(self):
+        url = reverse('api_dispatch_lines', args=[self.dispatch.pk])
+        payload = {'version': self.dispatch.version, 'Code': self.products[5].Code, 'Qty': '20'}
+        response = self.client.post(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['line']['Description'], self.products[5].Description)
+        response = self.client.post(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.dispatch.details.count(), SMALL + 1)
+
+
+class ImportExportTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.mkdtemp(prefix='dispatch_app_imports_')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.workdir, name)
+
+    def write_csv(self, name, rows):
+        with open(self.path(name), 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(rows)
+        return self.path(name)
+
+    def test_failures_raise_command_error(self):
+        """A failed import must exit non-zero for scripts and cron."""
+        with self.assertRaisesMessage(CommandError, 'File not found'):
+            call_command('import_customers', path=self.path('missing.csv'), stdout=StringIO())
+        path = self.write_csv('bad.csv', [['Name'], ['Someone']])
+        with self.assertRaisesMessage(CommandError, 'Missing required columns'):
+            call_command('import_customers', path=path, stdout=StringIO())
+
+    def test_dry_run_writes_nothing_and_reports_rejected_rows(self):
+        path = self.write_csv('lines.csv', [
+            ['OrderNo', 'Code', 'Qty'],
+            [self.dispatch.OrderNo, self.products[5].Code, '7'],
+            [self.dispatch.OrderNo, 'NO-SUCH-CODE', '7'],
+        ])
+        report = self.path('errors.csv')
+        call_command('import_dispatch_details', path=path, batch_size=1, dry_run=True,
+                     error_report=report, stdout=StringIO())
+        self.assertEqual(self.dispatch.details.count(), SMALL)
+        with open(report, newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0][:2], ['Row', 'Error'])
+        self.assertEqual([row[0] for row in rows[1:]], ['3'])
+        self.assertIn("'NO-SUCH-CODE' not found", rows[1][1])
+
+        call_command('import_dispatch_details', path=path, error_report=report, stdout=StringIO())
+        self.assertEqual(self.dispatch.details.count(), SMALL + 1)
+
+    def test_gzipped_csv_is_streamed(self):
+        path = self.path('Products.csv.gz')
+        with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Code', 'Description', 'ParPallet'])
+            writer.writerows([f'GZ{i}', f'Gzipped {i}', '40'] for i in range(5))
+            writer.writerow([self.products[0].Code, 'Updated from gzip', '60'])
+
+        call_command('import_products', path=path, batch_size=2, stdout=StringIO())
+        self.assertEqual(Products.objects.filter(Code__startswith='GZ').count(), 5)
+        self.assertEqual(Products.objects.get(Code='GZ3').ParPallet, Decimal('40'))
+        self.assertEqual(Products.objects.get(pk=self.products[0].pk).Description, 'Updated from gzip')
+
+    def export_all(self, suffix):
+        paths = {}
+        for table in ('customers', 'products', 'dispatches', 'dispatch_details'):
+            paths[table] = self.path(f'{table}{suffix}.csv')
+            call_command(f'export_{table}', path=paths[table], stdout=StringIO())
+        return paths
+
+    def test_export_import_round_trip(self):
+        """Export every table, import it into an empty database (another site), export again: same files."""
+        self.grow()
+        first = self.export_all('-1')
+        with open(first['dispatch_details'], encoding='utf-8') as f:
+            headers = f.readline().strip().split(',')
+        self.assertNotIn('ID', headers)  # site-local IDs stay behind unless --with-ids
+        self.assertNotIn('DispatchID', headers)
+
+        exported_id = DispatchDetails.objects.order_by('ID').values_list('ID', flat=True).first()
+        Dispatch.objects.all().delete()
+        Products.objects.all().delete()
+        Customer.objects.all().delete()
+        # The new site already has an unrelated line with one of the exported IDs
+        other = Customer.objects.create(Customer='Other Site Customer')
+        Products.objects.create(Code='LOCAL')
+        local = Dispatch.objects.create(OrderNo='LOCAL-1', Customer=other, OrderDate=date.today())
+        local_line = DispatchDetails.objects.create(ID=exported_id, DispatchID=local, Code_id='LOCAL', Qty=Decimal('1'))
+
+        for table, path in first.items():
+            call_command(f'import_{table}', path=path, stdout=StringIO())
+        local_line.refresh_from_db()
+        self.assertEqual((local_line.DispatchID_id, local_line.Code_id, local_line.Qty), (local.pk, 'LOCAL', 1))
+
+        Dispatch.objects.filter(pk=local.pk).delete()
+        Products.objects.filter(Code='LOCAL').delete()
+        other.delete()
+        second = self.export_all('-2')
+        for table in first:
+            with open(first[table], 'rb') as a, open(second[table], 'rb') as b:
+                self.assertEqual(a.read(), b.read(), f"{table} changed in the round trip")
+
+    def test_worker_resumes_a_job_whose_heartbeat_went_stale(self):
+        rows = [['Customer', 'Country']] + [[f'Worker Customer {i}', 'Oman'] for i in range(2, 7)]
+        with override_settings(MEDIA_ROOT=self.workdir):
+            os.makedirs(self.path('imports'))
+            self.write_csv(os.path.join('imports', 'Customers.csv'), rows)
+            # Rows 2-3 were committed before the worker died; only 4-6 are left
+            job = ImportJob.objects.create(
+                kind='customers', file='imports/Customers.csv', created_by=self.user, status='running',
+                last_row=3, rows_done=2, created_count=2, heartbeat_at=timezone.now() - timedelta(hours=1),
+            )
+            alive = ImportJob.objects.create(
+                kind='customers', file='imports/Customers.csv', created_by=self.user, status='running',
+                heartbeat_at=timezone.now(),
+            )
+            call_command('run_import_worker', once=True, batch_size=2, stdout=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_row, job.rows_done, job.created_count), ('done', 6, 5, 5))
+        names = set(Customer.objects.filter(Customer__startswith='Worker').values_list('Customer', flat=True))
+        self.assertEqual(names, {'Worker Customer 4', 'Worker Customer 5', 'Worker Customer 6'})
+        alive.refresh_from_db()
+        self.assertEqual((alive.status, alive.last_row), ('running', 1))  # its worker is still there
+
+    def test_skipping_done_rows_keeps_the_heartbeat(self):
+        path = self.write_csv('Customers.csv', [['Customer']] + [[f'Skip {i}'] for i in range(2, 9)])
+        command = load_command_class('dispatch_app', 'import_customers')
+        command.stdout = StringIO()
+        beats = []
+        with mock.patch.object(importers, 'SKIP_HEARTBEAT_ROWS', 2):
+            command.run(path, resume_after=6, on_skip=beats.append)
+        self.assertEqual(beats, [3, 5])
+        self.assertEqual(Customer.objects.filter(Customer__startswith='Skip ').count(), 2)
+
+
+class BenchmarkTests(QueryCountTestCase):
+    def test_run_benchmarks_measures_and_rolls_back(self):
+        before = Dispatch.objects.count(), Customer.objects.count(), Products.objects.count()
+        out = StringIO()
+        call_command('run_benchmarks', scales='20', repeat=2, only='dispatch_note,dispatch_edit,import',
+                     stdout=out, stderr=StringIO())
+        results = {r['benchmark']: r for r in json.loads(out.getvalue())['results']}
+
+        imports = [f'import {table}' for table in ('customers', 'products', 'dispatches', 'dispatch_details')]
+        self.assertEqual(set(results), {'dispatch_note', 'dispatch_edit GET', 'dispatch_edit POST', *imports})
+        self.assertEqual(results['dispatch_note']['status'], 200)
+        self.assertEqual(results['dispatch_edit POST']['status'], 302)
+        self.assertEqual(results['import dispatches']['rows'], 20 + 1)  # dry run of the seeded ones and self.dispatch
+        for result in results.values():
+            self.assertEqual((result['scale'], result['runs']), (20, 2))
+            self.assertGreater(result['queries'], 0)
+        self.assertEqual((Dispatch.objects.count(), Customer.objects.count(), Products.objects.count()), before)
+
+    def test_seeded_data_is_reproducible(self):
+        def seed(prefix):
+            call_command('seed_benchmark_data', customers=5, products=8, dispatches=15, seed=7, prefix=prefix,
+                         stdout=StringIO())
+            return [
+                (line.DispatchID.OrderNo.split('-', 1)[1], line.DispatchID.OrderDate, line.DispatchID.Status,
+                 line.Code_id.split('-', 1)[1], line.Qty)
+                for line in DispatchDetails.objects.filter(DispatchID__OrderNo__startswith=f'{prefix}-')
+                .select_related('DispatchID').order_by('DispatchID__OrderNo', 'ID')
+            ]
+
+        first = seed('S1')
+        self.assertTrue(first)
+        self.assertEqual(seed('S2'), first)
+
+
+class LoadTestTests(QueryCountTestCase):
+    class ClientUser(loadtest.VirtualUser):
+        """A virtual user that goes through the test client instead of HTTP."""
+        def __init__(self, client):
+            super().__init__('/', timeout=5)
+            self.client = client
+
+        def request(self, path, data=None):
+            url = '/' + path
+            response = self.client.get(url) if data is None else self.client.post(url, data)
+            return response.status_code, response.content.decode()
+
+    def command(self):
+        command = loadtest.Command()
+        command.run_id, command.created, command.counter_lock = 'test', 0, threading.Lock()
+        command.dispatch_ids = [self.dispatch.pk]
+        return command
+
+    def test_parse_mix(self):
+        parse = loadtest.Command().parse_mix
+        self.assertEqual(parse('home=3, edit=1,reports'), {'home': 3.0, 'edit': 1.0, 'reports': 1.0})
+        for bad, message in (('home=3,nope=1', "Unknown scenario 'nope'"), ('home=x', "Bad weight"),
+                             ('home=0', 'at least one positive weight')):
+            with self.subTest(bad), self.assertRaisesMessage(CommandError, message):
+                parse(bad)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([loadtest.percentile(values, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(loadtest.percentile([7], 99), 7)
+        self.assertIsNone(loadtest.percentile([], 50))
+
+    def test_scraped_forms_submit_like_a_browser(self):
+        user = self.ClientUser(self.client)
+        command = self.command()
+        rng = random.Random(1)
+        command.scenario_create(user, rng)
+        command.scenario_edit(user, rng)
+        self.assertEqual([(scenario, step, ok, detail) for scenario, step, _, ok, detail in user.samples], [
+            ('create', 'GET form', True, None), ('create', 'POST', True, None),
+            ('edit', 'GET form', True, None), ('edit', 'POST', True, None),
+        ])
+        created = Dispatch.objects.get(OrderNo='LT-test-00001')
+        self.assertEqual(created.details.count(), 1)
+
+        # A form saved by someone else in between is told apart from other errors
+        ok, body = user.timed('edit', 'GET form', f'dispatch/{self.dispatch.pk}/edit/')
+        Dispatch.objects.get(pk=self.dispatch.pk).save()
+        user.timed('edit', 'POST', f'dispatch/{self.dispatch.pk}/edit/', loadtest.parse_form(body).values,
+                   expect=(302,))
+        self.assertEqual(user.samples[-1][3:], (False, 'stale version'))
+
+    def test_summarize(self):
+        samples = [('home', 'GET', ms, True, None) for ms in (10, 20, 30)]
+        samples += [('edit', 'POST', 50, False, 'stale version'), ('edit', 'POST', 40, False, 'stale version')]
+        rows = {row['name']: row for row in self.command().summarize(samples, elapsed=2)['results']}
+        self.assertEqual((rows['home GET']['requests'], rows['home GET']['p50_ms'], rows['home GET']['rps']),
+                         (3, 20, 1.5))
+        self.assertEqual((rows['edit POST']['error_rate'], rows['edit POST']['error_kinds']),
+                         (1.0, {'stale version': 2}))
+        self.assertEqual((rows['TOTAL']['requests'], rows['TOTAL']['errors'], rows['TOTAL']['max_ms']), (5, 2, 50))
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp(prefix='dispatch_app_static_')
+        self.addCleanup(shutil.rmtree, self.static_root, ignore_errors=True)
+        settings = override_settings(STATIC_ROOT=self.static_root, SERVE_STATIC=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_hashed_files_are_served_compressed_and_immutable(self):
+        url = static('css/home.css')
+        self.assertRegex(url, r'^/static/css/home\.[0-9a-f]{12}\.css$')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        with open(os.path.join(self.static_root, url[len('/static/'):]), 'rb') as f:
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), f.read())
+
+    def test_unhashed_names_are_revalidated(self):
+        response = self.client.get('/static/css/home.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+
+class RouteCoverageTests(TestCase):
+    # Routes that only take POST/PATCH/DELETE or serve files, covered elsewhere or not query-bound
+    NOT_MEASURED = {'import_job_errors', 'profile_report', 'api_dispatch_lines', 'api_dispatch_line'}
+
+    def test_every_named_route_is_measured(self):
+        """A new route must get a query-count test (or an entry in NOT_MEASURED)."""
+        with open(__file__, encoding='utf-8') as f:
+            source = f.read()
+        names = {p.name for p in urls.urlpatterns if isinstance(p, URLPattern) and p.name}
+        missing = sorted(
+            name for name in names - self.NOT_MEASURED
+            if f"reverse('{name}'" not in source
+        )
+        self.assertEqual(missing, [], f"Routes without a query-count test: {missing}")
@@ -1,9 +1,10 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     # Home and Dispatch URLs
     path('', views.home, name='home'),
+    path('events/home/', views.home_events, name='home_events'),
     path('dispatch/<int:dispatch_id>/', views.dispatch_note, name='dispatch_note'),
     path('dispatch/create/', views.DispatchCreateView.as_view(), name='dispatch_create'),
     path('dispatch/<int:pk>/edit/', views.DispatchUpdateView.as_view(), name='dispatch_edit'),
@@ -11,6 +12,8 @@ urlpatterns = [
     path('dispatch/<int:dispatch_id>/loading-sheet/', views.loading_sheet, name='loading_sheet'),
     path('dispatch/<int:dispatch_id>/pallet-labels/', views.pallet_labels, name='pallet_labels'),
     path('reports/', views.reports, name='reports'),
+    path('reports/expiry/', views.expiry_report, name='expiry_report'),
+    path('reports/trace/', views.trace_report, name='trace_report'),
     
     # Product URLs
     path('products/', views.ProductListView.as_view(), name='product_list'),
@@ -29,4 +32,23 @@ urlpatterns = [
     # AJAX URLs
     path('ajax/customer/<int:customer_id>/', views.get_customer_details, name='get_customer_details'),
     path('ajax/product/<str:product_code>/', views.get_product_details, name='get_product_details'),
+
+    # Import job URLs
+    path('imports/', views.import_jobs, name='import_jobs'),
+    path('imports/<int:job_id>/progress/', views.import_job_progress, name='import_job_progress'),
+    path('imports/<int:job_id>/errors/', views.import_job_errors, name='import_job_errors'),
+
+    # Prometheus metrics
+    path('metrics', views.metrics, name='metrics'),
+
+    # Profiling reports (see ProfilingMiddleware)
+    path('profiles/<str:name>', views.profile_report, name='profile_report'),
+
+    # JSON API URLs
+    path('api/dispatches/', api.dispatches, name='api_dispatches'),
+    path('api/dispatches/<int:dispatch_id>/lines/', api.dispatch_lines, name='api_dispatch_lines'),
+    path('api/dispatches/<int:dispatch_id>/lines/<int:line_id>/', api.dispatch_line, name='api_dispatch_line'),
+    path('api/changes/', api.changes, name='api_changes'),
+    path('api/trace/', api.trace, name='api_trace'),
+    path('api/catalog/snapshot', api.catalog_snapshot, name='api_catalog_snapshot'),
 ]
\ No newline at end of file
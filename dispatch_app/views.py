@@ -1,25 +1,45 @@
 from multiprocessing import context
+import os
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views.generic import ListView, CreateView, UpdateView, DetailView, DeleteView
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.db import transaction
-from django.http import JsonResponse
-from .models import Dispatch, DispatchDetails, Customer, Products
-from .forms import DispatchForm, DispatchDetailsFormSet, ProductForm, CustomerForm
+from django.http import JsonResponse, FileResponse, Http404, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from .models import Dispatch, DispatchDetails, Customer, Products, ImportJob, TableVersion, ChangeLog, TRACE_FIELDS
+from .forms import DispatchForm, DispatchDetailsFormSet, ProductForm, CustomerForm, ImportJobForm
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import user_passes_test
 from datetime import date, timedelta
 from django.contrib.auth.mixins import LoginRequiredMixin
 from decimal import Decimal, InvalidOperation
 from .forms import DispatchDetailsFormSet, DispatchDetailsEditFormSet
+from . import customer_stats, master_cache
+from .master_cache import attach_master_data
+from .fragments import cached_document, home_rows
+from .events import home_stream, latest_cursor, pending_events, status_count_aggregates
+from . import metrics as metrics_registry
 from datetime import datetime
 import calendar
-from django.db.models import Sum, Count
+import tempfile
+from django.db.models import Sum, Count, F, Min, Q, ProtectedError
 from django.utils import timezone
 from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.views.decorators.cache import cache_control
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from functools import wraps
+from asgiref.sync import sync_to_async
+
+# How long a browser may reuse an auto-fill lookup before revalidating it
+AUTOFILL_MAX_AGE = getattr(settings, 'AUTOFILL_MAX_AGE', 300)
+# Lines expiring at most this many days after loading are flagged (form warning, expiry report)
+EXPIRY_WARNING_DAYS = getattr(settings, 'EXPIRY_WARNING_DAYS', 30)
 
 
 @login_required
@@ -28,8 +48,8 @@ def home(request):
     status = request.GET.get('status', '')
     sort_by = request.GET.get('sort_by', '')
     
-    # Base queryset
-    dispatches = Dispatch.objects.all()
+    # Base queryset; line counts come with it instead of a COUNT/EXISTS per row in the template
+    dispatches = Dispatch.objects.annotate(line_count=Count('details'))
     
     # Apply status filter if provided
     if status and status != 'all':
@@ -45,32 +65,53 @@ def home(request):
     else:
         # Default: sort by Order Date (newest first)
         dispatches = dispatches.order_by('-OrderDate')
-    
-    # Calculate status counts for the summary
-    all_dispatches = Dispatch.objects.all()
-    status_counts = {
-        'draft': all_dispatches.filter(Status='draft').count(),
-        'confirmed': all_dispatches.filter(Status='confirmed').count(),
-        'shipped': all_dispatches.filter(Status='shipped').count(),
-        'delivered': all_dispatches.filter(Status='delivered').count(),
-        'cancelled': all_dispatches.filter(Status='cancelled').count(),
-    }
-    
+
+    # Live updates start from here; taken before the rows, so a change made
+    # meanwhile is pushed again rather than missed
+    events_cursor = ChangeLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
     # Dates for highlighting
     today = date.today()
     soon_date = today + timedelta(days=3)
+
+    # Rows come from the fragment cache; only new or changed dispatches are rendered
+    dispatches = home_rows(request, list(dispatches), today, soon_date)
+    
+    # Calculate status counts for the summary (one query for all of them)
+    status_counts = Dispatch.objects.aggregate(**status_count_aggregates())
+    total_export = status_counts.pop('total')
     
     context = {
         'dispatches': dispatches,
         'status_counts': status_counts,
-        'total_export': all_dispatches.count(),
+        'total_export': total_export,
         'current_status': status,
         'current_sort': sort_by,
         'today': today,
         'soon_date': soon_date,
+        'events_cursor': events_cursor,
     }
     return render(request, 'home.html', context)
 
+@login_required
+async def home_events(request):
+    """Server-sent events that keep an open home page up to date (see events.py)"""
+    # Reconnecting browsers send the last event id; a fresh page sends ?since=
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        cursor = int(cursor)
+    except (TypeError, ValueError):
+        cursor = await latest_cursor()
+
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(home_stream(cursor), content_type='text/event-stream')
+    else:
+        # WSGI would buffer the whole async stream: answer at once, the browser polls again after RETRY_MS
+        response = HttpResponse(await pending_events(cursor), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: pass events through unbuffered
+    return response
+
 def debug_messages(request):
     """Debug view to test messages"""
     messages.success(request, 'This is a success message!')
@@ -82,39 +123,111 @@ def debug_messages(request):
 @login_required
 def dispatch_note(request, dispatch_id):
     """Individual dispatch note view"""
-    dispatch = get_object_or_404(Dispatch, pk=dispatch_id)
-    return render(request, 'dispatch_note.html', {'dispatch': dispatch})
-
-def get_customer_details(request, customer_id):
+    dispatch = get_object_or_404(Dispatch.objects.select_related('created_by', 'updated_by'), pk=dispatch_id)
+
+    def render_note():
+        dispatch.lines = attach_master_data(dispatch, dispatch.details.all())
+        return render_to_string('dispatch_note.html', {'dispatch': dispatch}, request)
+
+    # The lines are only loaded when the cached page is missing or out of date
+    return HttpResponse(cached_document('dispatch_note', request, dispatch, render_note))
+
+async def master_version(request, model):
+    """(version, updated_at) of a master-data table, read at most once per request"""
+    versions = request.__dict__.setdefault('_master_versions', {})
+    if model not in versions:
+        versions[model] = await TableVersion.acurrent(model)
+    return versions[model]
+
+async def customer_etag(request, customer_id):
+    return f'"customer-{customer_id}-v{(await master_version(request, Customer))[0]}"'
+
+async def customer_last_modified(request, customer_id):
+    return (await master_version(request, Customer))[1]
+
+async def product_etag(request, product_code):
+    return f'"product-{product_code}-v{(await master_version(request, Products))[0]}"'
+
+async def product_last_modified(request, product_code):
+    return (await master_version(request, Products))[1]
+
+def async_condition(etag_func, last_modified_func):
+    """@condition for async views, awaiting the ETag and Last-Modified coroutines"""
+    def decorator(view_func):
+        @wraps(view_func)
+        async def inner(request, *args, **kwargs):
+            etag = quote_etag(await etag_func(request, *args, **kwargs))
+            last_modified = await last_modified_func(request, *args, **kwargs)
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if timestamp and not response.has_header('Last-Modified'):
+                    response['Last-Modified'] = http_date(timestamp)
+                response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+# Conditional GET: the ETag only changes when the Customer/Products table
+# does, so a revalidation costs one TableVersion lookup and an empty 304.
+# Async: under ASGI these many small lookups are served from master_cache
+# on the event loop instead of each taking a worker thread.
+@cache_control(private=True, max_age=AUTOFILL_MAX_AGE)
+@async_condition(etag_func=customer_etag, last_modified_func=customer_last_modified)
+async def get_customer_details(request, customer_id):
     """Get customer details for auto-fill"""
-    try:
-        customer = get_object_or_404(Customer, pk=customer_id)
-        data = {
-            'Address': customer.Address or '',
-            'Country': customer.Country or '',
-            'ContactNo': customer.ContactNo or '',
-            'ContactPerson': customer.ContactPerson or '',
-            'DispatchTo': customer.DispatchTo or '',
-        }
-        return JsonResponse(data)
-    except Customer.DoesNotExist:
+    # The version the ETag was built from: the row must be at least that fresh
+    version = (await master_version(request, Customer))[0]
+    customer = await master_cache.customers.aget(customer_id, version)
+    if customer is None:
         return JsonResponse({'error': 'Customer not found'}, status=404)
 
-def get_product_details(request, product_code):
+    data = {
+        'Address': customer.Address or '',
+        'Country': customer.Country or '',
+        'ContactNo': customer.ContactNo or '',
+        'ContactPerson': customer.ContactPerson or '',
+        'DispatchTo': customer.DispatchTo or '',
+    }
+    return JsonResponse(data)
+
+@cache_control(private=True, max_age=AUTOFILL_MAX_AGE)
+@async_condition(etag_func=product_etag, last_modified_func=product_last_modified)
+async def get_product_details(request, product_code):
     """Get product details for auto-fill"""
-    try:
-        product = get_object_or_404(Products, Code=product_code)
-        data = {
-            'LocalCode': product.LocalCode or '',
-            'Description': product.Description or '',
-            'UOM': product.UOM or '',
-            'PackInCarton': str(product.PacInCtn) if product.PacInCtn else '',
-            'ParPallet': str(product.ParPallet) if product.ParPallet else '',
-        }
-        return JsonResponse(data)
-    except Products.DoesNotExist:
+    # The version the ETag was built from: the row must be at least that fresh
+    version = (await master_version(request, Products))[0]
+    product = await master_cache.products.aget(product_code, version)
+    if product is None:
         return JsonResponse({'error': 'Product not found'}, status=404)
 
+    data = {
+        'LocalCode': product.LocalCode or '',
+        'Description': product.Description or '',
+        'UOM': product.UOM or '',
+        'PackInCarton': str(product.PacInCtn) if product.PacInCtn else '',
+        'ParPallet': str(product.ParPallet) if product.ParPallet else '',
+    }
+    return JsonResponse(data)
+
+def warn_near_expiry(request, dispatch):
+    """⚠️ Dispatch form hook: flag lines that expire soon after loading (the save still goes through)"""
+    if not dispatch.LoadingDate:
+        return
+    lines = list(dispatch.details.near_expiry(EXPIRY_WARNING_DAYS).fefo().values_list('Code_id', 'ExpairyDate'))
+    if not lines:
+        return
+    listed = ', '.join(f"{code} ({expiry:%d %b %Y})" for code, expiry in lines[:5])
+    if len(lines) > 5:
+        listed += f" and {len(lines) - 5} more"
+    messages.warning(
+        request,
+        f"⚠️ {len(lines)} line(s) expire within {EXPIRY_WARNING_DAYS} days of loading "
+        f"({dispatch.LoadingDate:%d %b %Y}): {listed}."
+    )
+
 @method_decorator(login_required, name='dispatch')
 class DispatchCreateView(CreateView):
     model = Dispatch
@@ -128,6 +241,7 @@ class DispatchCreateView(CreateView):
             context['formset'] = DispatchDetailsFormSet(self.request.POST)
         else:
             context['formset'] = DispatchDetailsFormSet()  # extra=1
+        context['expiry_warning_days'] = EXPIRY_WARNING_DAYS
         return context
     
     def form_valid(self, form):
@@ -159,6 +273,7 @@ class DispatchCreateView(CreateView):
                 formset.instance = self.object
                 formset.save()
                 messages.success(self.request, 'Dispatch created successfully!')
+                warn_near_expiry(self.request, self.object)
                 return redirect('home')
             else:
                 return self.form_invalid(form)
@@ -179,24 +294,27 @@ class DispatchUpdateView(UpdateView):
             context['formset'] = DispatchDetailsEditFormSet(self.request.POST, instance=self.object)
         else:
             context['formset'] = DispatchDetailsEditFormSet(instance=self.object)
+        context['expiry_warning_days'] = EXPIRY_WARNING_DAYS
         return context
     
     def form_valid(self, form):
         form.instance.updated_by = self.request.user  # ✅ Set updater
         formset = DispatchDetailsEditFormSet(self.request.POST, instance=self.object)
         
+        # Lines first: claiming the version of a save that then fails would reject the corrected resubmit
+        if not formset.is_valid():
+            messages.error(self.request, 'Please correct the errors in product details.')
+            return self.form_invalid(form)
+
         with transaction.atomic():
-            self.object = form.save()
-            if formset.is_valid():
-                formset.instance = self.object
-                formset.save()
-                messages.success(self.request, 'Dispatch updated successfully!')
-                return redirect(self.get_success_url())
-            else:
-                # Debug info (keep during dev)
-                print("Formset errors:", formset.errors)
-                messages.error(self.request, 'Please correct the errors in product details.')
+            if not form.claim_version():
                 return self.form_invalid(form)
+            self.object = form.save()
+            formset.instance = self.object
+            formset.save()
+        messages.success(self.request, 'Dispatch updated successfully!')
+        warn_near_expiry(self.request, self.object)
+        return redirect(self.get_success_url())
 
 @method_decorator(login_required, name='dispatch')    
 class DispatchDeleteView(LoginRequiredMixin, DeleteView):
@@ -256,6 +374,7 @@ class ProductUpdateView(UpdateView):
 class ProductDetailView(DetailView):
     model = Products
     template_name = 'product_detail.html'
+    context_object_name = 'product'
 
 @method_decorator(login_required, name='dispatch')
 class ProductDeleteView(DeleteView):
@@ -305,21 +424,47 @@ class CustomerDetailView(DetailView):
     model = Customer
     template_name = 'customer_detail.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Constant work for any customer: LIMIT 5 on dispatch_customer_date_idx, precomputed stats
+        context['recent_dispatches'] = (
+            self.object.dispatch_set.order_by('-OrderDate', '-DispatchID')
+            .only('DispatchID', 'OrderNo', 'OrderDate', 'Status')[:5]
+        )
+        today = timezone.now().date()
+        context['stats'], context['trailing'] = customer_stats.for_customer(self.object.pk, today)
+        context['trailing_since'] = customer_stats.trailing_start(today)
+        return context
+
 @method_decorator(login_required, name='dispatch')
 class CustomerDeleteView(DeleteView):
     model = Customer
     template_name = 'customer_confirm_delete.html'
     success_url = reverse_lazy('customer_list')
-    
-    def delete(self, request, *args, **kwargs):
-        messages.success(request, 'Customer deleted successfully!')
-        return super().delete(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Dispatch.Customer is PROTECT: a customer with dispatches cannot be deleted
+        context['dispatch_count'] = self.object.dispatch_set.count()
+        return context
+
+    def form_valid(self, form):
+        try:
+            response = super().form_valid(form)
+        except ProtectedError:
+            messages.error(self.request, 'This customer has dispatches and cannot be deleted.')
+            return redirect('customer_detail', pk=self.object.pk)
+        messages.success(self.request, 'Customer deleted successfully!')
+        return response
 # views.py
 
 
 def superuser_required(view_func):
     return user_passes_test(lambda u: u.is_superuser)(view_func)
 
+def staff_required(view_func):
+    return user_passes_test(lambda u: u.is_staff)(view_func)
+
 # views.py
 #from django.shortcuts import render, get_object_or_404
 
@@ -331,9 +476,13 @@ def superuser_required(view_func):
 
 def loading_sheet(request, dispatch_id):
     dispatch = get_object_or_404(Dispatch, pk=dispatch_id)
-    
+    return HttpResponse(cached_document(
+        'loading_sheet', request, dispatch, lambda: render_loading_sheet(request, dispatch)
+    ))
+
+def render_loading_sheet(request, dispatch):
     pallet_rows = []
-    for item in dispatch.details.all():
+    for item in attach_master_data(dispatch, dispatch.details.all()):
         # Skip if Qty is zero, None, or invalid
         if not item.Qty:
             continue
@@ -418,14 +567,18 @@ def loading_sheet(request, dispatch_id):
         'total_pallets': total_pallets,
         'trucks_needed': trucks_needed,
     }
-    return render(request, 'loading_sheet.html', context)
+    return render_to_string('loading_sheet.html', context, request)
 
 # views.py
 def pallet_labels(request, dispatch_id):
-    dispatch = get_object_or_404(Dispatch, pk=dispatch_id)
-    
+    dispatch = get_object_or_404(Dispatch.objects.select_related('created_by'), pk=dispatch_id)
+    return HttpResponse(cached_document(
+        'pallet_labels', request, dispatch, lambda: render_pallet_labels(request, dispatch)
+    ))
+
+def render_pallet_labels(request, dispatch):
     pallet_rows = []
-    for item in dispatch.details.all():
+    for item in attach_master_data(dispatch, dispatch.details.all()):
         if not item.Qty:
             continue
         total_qty = Decimal(str(item.Qty))
@@ -473,11 +626,41 @@ def pallet_labels(request, dispatch_id):
         'dispatch': dispatch,
         'pallet_labels': pallet_rows,
     }
-    return render(request, 'pallet_labels.html', context)
-
-
-
-def reports(request):
+    return render_to_string('pallet_labels.html', context, request)
+
+
+
+REPORT_STATUS_CHOICES = [
+    ('', 'All Statuses'),
+    ('draft', 'Draft'),
+    ('confirmed', 'Confirmed'),
+    ('shipped', 'Shipped'),
+    ('delivered', 'Delivered'),
+    ('cancelled', 'Cancelled'),
+]
+
+def excel_response(filename, title, columns, rows):
+    """An .xlsx download with one sheet. CPU-bound: async views run it in a thread."""
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = title
+    ws.append(columns)
+    for row in rows:
+        ws.append(row)
+
+    response = HttpResponse(
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    wb.save(response)
+    return response
+
+# Async: a long aggregation or export awaits the database (on the request's
+# own ORM thread) and builds the workbook off the event loop, instead of
+# holding a worker while the auto-fill lookups queue behind it.
+async def reports(request):
     # Get filter parameters
     report_type = request.GET.get('report_type', 'customer')
     start_date = request.GET.get('start_date')
@@ -514,34 +697,21 @@ def reports(request):
         if status:
             dispatches = dispatches.filter(Status=status)
         
-        # Annotate with total quantity for each dispatch
+        # Annotate with total quantity and line count for each dispatch
         dispatches = dispatches.annotate(
-            total_qty=Sum('details__Qty')
+            total_qty=Sum('details__Qty'),
+            line_count=Count('details'),
         ).order_by('-OrderDate')
+        dispatches = [d async for d in dispatches]
         
         # Excel export for customer details
         if request.GET.get('format') == 'excel':
-            from openpyxl import Workbook
-            
-            wb = Workbook()
-            ws = wb.active
-            ws.title = f"{customer_name} Orders"
-            
-            # Add headers
-            ws.append(['Order No', 'Dispatch ID', 'Status', 'Order Date', 'Total Qty'])
-            
-            # Add data rows
-            for d in dispatches:
-                total_qty = d.details.aggregate(total=Sum('Qty'))['total'] or 0
-                ws.append([d.OrderNo, d.DispatchID, d.Status, d.OrderDate, float(total_qty)])
-            
-            # Prepare response
-            response = HttpResponse(
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            return await sync_to_async(excel_response, thread_sensitive=False)(
+                f'{customer_name}_orders_{timezone.now().strftime("%Y%m%d")}.xlsx',
+                f"{customer_name} Orders",
+                ['Order No', 'Dispatch ID', 'Status', 'Order Date', 'Total Qty'],
+                [[d.OrderNo, d.DispatchID, d.Status, d.OrderDate, float(d.total_qty or 0)] for d in dispatches],
             )
-            response['Content-Disposition'] = f'attachment; filename={customer_name}_orders_{timezone.now().strftime("%Y%m%d")}.xlsx'
-            wb.save(response)
-            return response
         
         context = {
             'is_customer_detail': True,
@@ -549,15 +719,8 @@ def reports(request):
             'start_date': start_date,
             'end_date': end_date,
             'status': status,
-            'dispatches': dispatches.order_by('-OrderDate'),
-            'status_choices': [  # Add status choices for dropdown
-                ('', 'All Statuses'),
-                ('draft', 'Draft'),
-                ('confirmed', 'Confirmed'),
-                ('shipped', 'Shipped'),
-                ('delivered', 'Delivered'),
-                ('cancelled', 'Cancelled'),
-            ]
+            'dispatches': dispatches,
+            'status_choices': REPORT_STATUS_CHOICES,  # Add status choices for dropdown
         }
         return render(request, 'reports.html', context)
 
@@ -591,46 +754,34 @@ def reports(request):
         ).order_by('-month')
         columns = ['Month', 'Total Dispatches', 'Total Qty']
 
+    data = [row async for row in data]
+
     # Excel export logic
     if request.GET.get('format') == 'excel':
-        from openpyxl import Workbook
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Dispatch Report"
-        
-        # Add headers
-        ws.append(columns)
-        
-        # Add data rows
+        rows = []
         for row in data:
             if report_type == 'customer':
-                ws.append([
+                rows.append([
                     row['Customer__Customer'],
                     row['total_dispatches'] or 0,
                     float(row['total_items'] or 0),
                     float(row['total_qty'] or 0)
                 ])
             elif report_type == 'product':
-                ws.append([
+                rows.append([
                     row['Code__Code'],
                     row['Code__Description'],
                     float(row['total_qty'] or 0)
                 ])
             elif report_type == 'monthly':
-                ws.append([
+                rows.append([
                     row['month'],
                     row['total_dispatches'] or 0,
                     float(row['total_qty'] or 0)
                 ])
-        
-        # Prepare response
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        return await sync_to_async(excel_response, thread_sensitive=False)(
+            f'dispatch_report_{timezone.now().strftime("%Y%m%d")}.xlsx', "Dispatch Report", columns, rows
         )
-        response['Content-Disposition'] = f'attachment; filename=dispatch_report_{timezone.now().strftime("%Y%m%d")}.xlsx'
-        wb.save(response)
-        return response
     
     # Add status to context
     context = {
@@ -641,14 +792,197 @@ def reports(request):
         'data': data,
         'columns': columns,
         # Add status choices for dropdown
-        'status_choices': [
-            ('', 'All Statuses'),
-            ('draft', 'Draft'),
-            ('confirmed', 'Confirmed'),
-            ('shipped', 'Shipped'),
-            ('delivered', 'Delivered'),
-            ('cancelled', 'Cancelled'),
-        ]
+        'status_choices': REPORT_STATUS_CHOICES,
     }
     
+    # Everything is loaded: rendering runs no queries
     return render(request, 'reports.html', context)
+
+
+# ⏳ Near-expiry lines on upcoming loadings
+
+def int_param(request, name, default):
+    try:
+        return max(0, int(request.GET.get(name, default)))
+    except ValueError:
+        return default
+
+@login_required
+async def expiry_report(request):
+    """Upcoming loadings with near-expiry lines, by product and customer, first expiry first"""
+    # One query: open dispatches via dispatch_loading_idx, their lines via details_dispatch_expiry_idx
+    days_ahead = int_param(request, 'days_ahead', 14)
+    within = int_param(request, 'within', EXPIRY_WARNING_DAYS)
+    today = timezone.now().date()
+    end_date = today + timedelta(days=days_ahead)
+
+    groups = [
+        row async for row in
+        DispatchDetails.objects.upcoming(today, end_date).near_expiry(within)
+        .values('Code_id', 'Code__Description', 'DispatchID__Customer__Customer')
+        .annotate(
+            lines=Count('ID'),
+            dispatches=Count('DispatchID', distinct=True),
+            total_qty=Sum('Qty'),
+            first_loading=Min('DispatchID__LoadingDate'),
+            first_expiry=Min('ExpairyDate'),
+            # Per line: a group's first expiry and first loading can come from different dispatches
+            expired_lines=Count('ID', filter=Q(ExpairyDate__lt=F('DispatchID__LoadingDate'))),
+        )
+        .order_by('first_expiry', 'Code_id')
+    ]
+
+    context = {
+        'groups': groups,
+        'days_ahead': days_ahead,
+        'within': within,
+        'today': today,
+        'end_date': end_date,
+    }
+    return render(request, 'expiry_report.html', context)
+
+
+# 🔎 Batch recall trace: who received product X produced on date D
+
+TRACE_PAGE_ROWS = 500  # lines shown on the page; the Excel export has all of them
+TRACE_EXPORT_CHUNK = 2000  # rows fetched per round trip while exporting
+
+def date_param(request, name):
+    try:
+        return datetime.strptime(request.GET.get(name, ''), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def trace_excel(filename, lines):
+    """Streaming .xlsx: rows go from .iterator() into a write-only workbook in a temporary file."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Trace")
+    ws.append(list(TRACE_FIELDS))
+    for row in lines.values_list(*TRACE_FIELDS.values()).iterator(chunk_size=TRACE_EXPORT_CHUNK):
+        ws.append(row)
+
+    f = tempfile.TemporaryFile()  # removed when FileResponse closes it
+    wb.save(f)
+    f.seek(0)
+    return FileResponse(
+        f, as_attachment=True, filename=filename,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+@login_required
+async def trace_report(request):
+    """Dispatches, customers and transport details for a product batch (Code + ProductionDate range)"""
+    code = request.GET.get('code', '').strip()
+    start = date_param(request, 'produced_from')
+    end = date_param(request, 'produced_to')
+    context = {'code': code, 'produced_from': start, 'produced_to': end, 'page_rows': TRACE_PAGE_ROWS}
+    if not code:
+        return render(request, 'trace.html', context)
+
+    lines = DispatchDetails.objects.trace(code, start, end)
+    if request.GET.get('format') == 'excel':
+        # On the request's ORM thread: the export reads the database while it writes
+        return await sync_to_async(trace_excel)(
+            f'trace_{code}_{timezone.now().strftime("%Y%m%d")}.xlsx', lines
+        )
+
+    # One query for the rows (details_trace_idx, dispatch and customer by pk), one for the totals
+    rows = [
+        dict(zip(TRACE_FIELDS, row)) async for row in
+        lines.values_list(*TRACE_FIELDS.values())[:TRACE_PAGE_ROWS]
+    ]
+    totals = await lines.order_by().aaggregate(
+        lines=Count('ID'),
+        total_qty=Sum('Qty'),
+        dispatches=Count('DispatchID', distinct=True),
+        customers=Count('DispatchID__Customer', distinct=True),
+    )
+    context.update({'rows': rows, 'totals': totals, 'truncated': totals['lines'] > len(rows)})
+    return render(request, 'trace.html', context)
+
+
+# Import jobs (uploaded files processed by `manage.py run_import_worker`)
+
+def import_job_data(job):
+    """Progress snapshot polled by the imports page"""
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'rows_done': job.rows_done,
+        'rows_per_sec': round(job.rows_per_sec),
+        'created': job.created_count,
+        'updated': job.updated_count,
+        'errors': job.error_count,
+        'elapsed': round(job.elapsed, 1),
+        'message': job.message,
+        'error_report_url': reverse('import_job_errors', args=[job.pk]) if job.error_count else '',
+    }
+
+@login_required
+@staff_required
+def import_jobs(request):
+    """Upload a file for background import and list recent jobs"""
+    if request.method == 'POST':
+        form = ImportJobForm(request.POST, request.FILES)
+        if form.is_valid():
+            job = form.save(commit=False)
+            job.created_by = request.user
+            job.save()
+            messages.success(request, f'File uploaded. Import job {job.pk} is queued.')
+            return redirect('import_jobs')
+        messages.error(request, 'Please correct the errors below.')
+    else:
+        form = ImportJobForm()
+
+    context = {
+        'form': form,
+        'jobs': ImportJob.objects.select_related('created_by')[:20],
+    }
+    return render(request, 'import_jobs.html', context)
+
+@login_required
+@staff_required
+def import_job_progress(request, job_id):
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return JsonResponse(import_job_data(job))
+
+@login_required
+@staff_required
+def import_job_errors(request, job_id):
+    job = get_object_or_404(ImportJob, pk=job_id)
+    if not job.error_report:
+        raise Http404('No error report for this job')
+    path = os.path.join(settings.MEDIA_ROOT, job.error_report)
+    if not os.path.exists(path):
+        raise Http404('No error report for this job')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
+
+
+@login_required
+@staff_required
+def profile_report(request, name):
+    """A report saved by ProfilingMiddleware: the HTML summary, or the .prof for snakeviz/pstats."""
+    if os.path.basename(name) != name or not name.endswith(('.html', '.prof')):
+        raise Http404('No such profile')
+    path = os.path.join(settings.MEDIA_ROOT, 'profiles', name)
+    if not os.path.exists(path):
+        raise Http404('No such profile')
+    if name.endswith('.html'):
+        return FileResponse(open(path, 'rb'), content_type='text/html; charset=utf-8')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
+
+
+def metrics(request):
+    """Prometheus text format. Open to staff, METRICS_ALLOWED_IPS, or "Authorization: Bearer <METRICS_TOKEN>"."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    allowed = (
+        request.user.is_staff
+        or request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+        or (token and request.META.get('HTTP_AUTHORIZATION') == f'Bearer {token}')
+    )
+    if not allowed:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,403 @@
+// dispatch_form.html
+$(document).ready(function() {
+    console.log("Document ready - initializing auto-fill");
+
+    // Auto-hide messages after 5 seconds
+    setTimeout(function() {
+        $('.alert').alert('close');
+    }, 5000);
+
+    // Customer auto-fill
+    $('#id_Customer').change(function() {
+        var customerId = $(this).val();
+        console.log("Customer changed:", customerId);
+        if (customerId) {
+            $.get('/ajax/customer/' + customerId + '/', function(data) {
+                console.log("Customer data received:", data);
+                if (!data.error) {
+                    $('#id_Address').val(data.Address || '');
+                    $('#id_Country').val(data.Country || '');
+                    $('#id_ContactNo').val(data.ContactNo || '');
+                    $('#id_ContactPerson').val(data.ContactPerson || '');
+                }
+            }).fail(function(xhr, status, error) {
+                console.log('Error loading customer details:', error);
+            });
+        } else {
+            // Clear fields if no customer selected
+            $('#id_Address').val('');
+            $('#id_Country').val('');
+            $('#id_ContactNo').val('');
+            $('#id_ContactPerson').val('');
+        }
+    });
+
+    // Calculate Pallet = Qty / ParPallet
+    function calculatePallet(row) {
+        var qtyInput = row.find('input[name*="Qty"]');
+        var parPalletInput = row.find('input[name*="ParPallet"]');
+        var palletField = row.find('.pallet-calculated');
+
+        var qty = parseFloat(qtyInput.val()) || 0;
+        var parPallet = parseFloat(parPalletInput.val()) || 0;
+
+        console.log("Calculating pallet: Qty=" + qty + ", ParPallet=" + parPallet);
+
+        if (parPallet > 0) {
+            var pallets = qty / parPallet;
+            palletField.val(pallets.toFixed(2));
+            console.log("Pallet calculated: " + pallets.toFixed(2));
+        } else {
+            palletField.val('-');
+            console.log("Pallet calculation: No ParPallet value");
+        }
+    }
+
+    // Update pallet calculation when Qty or ParPallet changes
+    $(document).on('input', 'input[name*="Qty"], input[name*="ParPallet"]', function() {
+        var row = $(this).closest('.formset-row');
+        calculatePallet(row);
+    });
+//date copy 
+        document.addEventListener('DOMContentLoaded', function() {
+            const applyBtn = document.getElementById('apply-dates');
+            const prodInput = document.getElementById('bulk-production-date');
+            const expiryInput = document.getElementById('bulk-expiry-date');
+            const autoExpiry = document.getElementById('auto-expiry');
+
+            // Auto-calculate expiry when production date changes
+            prodInput.addEventListener('change', function() {
+                if (autoExpiry.checked && this.value) {
+                    const prodDate = new Date(this.value);
+                    prodDate.setMonth(prodDate.getMonth() + 6);
+                    // Format as YYYY-MM-DD
+                    const year = prodDate.getFullYear();
+                    const month = String(prodDate.getMonth() + 1).padStart(2, '0');
+                    const day = String(prodDate.getDate()).padStart(2, '0');
+                    expiryInput.value = `${year}-${month}-${day}`;
+                }
+            });
+
+            // Apply dates to all formset rows
+            applyBtn.addEventListener('click', function() {
+                const prodDate = prodInput.value;
+                const expiryDate = expiryInput.value;
+
+                if (!prodDate && !expiryDate) {
+                    alert('Please select at least one date.');
+                    return;
+                }
+
+                // Loop through all formset rows
+                document.querySelectorAll('.formset-row').forEach(row => {
+                    if (prodDate) {
+                        const prodField = row.querySelector('input[name*="ProductionDate"]');
+                        if (prodField) prodField.value = prodDate;
+                    }
+                    if (expiryDate) {
+                        const expiryField = row.querySelector('input[name*="ExpairyDate"]');
+                        if (expiryField) expiryField.value = expiryDate;
+                    }
+                });
+
+                // Optional: Show success message
+                const msg = document.createElement('div');
+                msg.className = 'alert alert-success alert-dismissible fade show mt-2';
+                msg.innerHTML = 'Dates applied to all items! <button type="button" class="btn-close" data-bs-dismiss="alert"></button>';
+                applyBtn.closest('.card').after(msg);
+                setTimeout(() => msg.remove(), 3000);
+            });
+        });
+
+    // Product auto-fill function
+    function setupProductAutoFill(selectElement) {
+        $(selectElement).change(function() {
+            var productCode = $(this).val();
+            var row = $(this).closest('.formset-row');
+            console.log("Product changed:", productCode, "in row:", row.attr('id'));
+
+            if (productCode) {
+                $.get('/ajax/product/' + productCode + '/', function(data) {
+                    console.log("Product data received:", data);
+                    if (!data.error) {
+                        // Update the fields in the same row
+                        row.find('input[name*="LocalCode"]').val(data.LocalCode || '');
+                        row.find('textarea[name*="Description"]').val(data.Description || '');
+                        row.find('input[name*="UOM"]').val(data.UOM || '');
+                        row.find('input[name*="PackInCarton"]').val(data.PackInCarton || '');
+                        row.find('input[name*="ParPallet"]').val(data.ParPallet || '');
+
+                        // Add visual feedback
+                        row.find('input[name*="LocalCode"], textarea[name*="Description"], input[name*="UOM"], input[name*="PackInCarton"], input[name*="ParPallet"]')
+                           .addClass('auto-filled');
+
+                        // Recalculate pallet after product data is loaded
+                        calculatePallet(row);
+                    }
+                }).fail(function(xhr, status, error) {
+                    console.log('Error loading product details:', error);
+                    alert('Error loading product details: ' + error);
+                });
+            } else {
+                // Clear fields if no product selected
+                row.find('input[name*="LocalCode"]').val('');
+                row.find('textarea[name*="Description"]').val('');
+                row.find('input[name*="UOM"]').val('');
+                row.find('input[name*="PackInCarton"]').val('');
+                row.find('input[name*="ParPallet"]').val('');
+
+                // Remove visual feedback
+                row.find('input[name*="LocalCode"], textarea[name*="Description"], input[name*="UOM"], input[name*="PackInCarton"], input[name*="ParPallet"]')
+                   .removeClass('auto-filled');
+
+                // Recalculate pallet (will show '-')
+                calculatePallet(row);
+            }
+        });
+    }
+
+    // Initialize product auto-fill for existing rows
+    $('select[name*="Code"]').each(function() {
+        setupProductAutoFill(this);
+        // Also calculate initial pallet values for existing rows
+        calculatePallet($(this).closest('.formset-row'));
+    });
+
+    // Add more formset rows
+    $('#add-more').click(function() {
+        var totalForms = $('#id_details-TOTAL_FORMS');
+        var formCount = parseInt(totalForms.val());
+        console.log("Current form count:", formCount);
+
+        // Clone the first formset row
+        var newRow = $('.formset-row:first').clone();
+        console.log("Cloned row:", newRow);
+
+        // Clear all input values in the new row
+        newRow.find('input, select, textarea').val('');
+        newRow.find('.pallet-calculated').val('');
+
+        // Update all the names and IDs
+        newRow.find('[name]').each(function() {
+            var oldName = $(this).attr('name');
+            if (oldName) {
+                var newName = oldName.replace(/-\d+-/, '-' + formCount + '-');
+                $(this).attr('name', newName);
+
+                var oldId = $(this).attr('id');
+                if (oldId) {
+                    var newId = oldId.replace(/-\d+-/, '-' + formCount + '-');
+                    $(this).attr('id', newId);
+                }
+            }
+        });
+
+        // Remove any existing DELETE checkbox (for new rows)
+        newRow.find('input[type="checkbox"][name*="DELETE"]').remove();
+
+        // Update the row ID
+        newRow.attr('id', 'form-' + formCount);
+
+        // Append to container
+        $('#formset-container').append(newRow);
+
+        // Update the total forms count
+        totalForms.val(formCount + 1);
+
+        // Setup auto-fill for the new product select
+        var newSelect = newRow.find('select[name*="Code"]');
+        if (newSelect.length) {
+            setupProductAutoFill(newSelect[0]);
+        }
+
+        console.log("Added new row, total forms:", totalForms.val());
+    });
+
+    // Delete row
+    $(document).on('click', '.delete-row', function() {
+        var row = $(this).closest('.formset-row');
+        var deleteCheckbox = row.find('input[type="checkbox"][name*="DELETE"]');
+
+        if (deleteCheckbox.length > 0) {
+            // Existing row - mark for deletion and hide
+            deleteCheckbox.prop('checked', true);
+            row.hide();
+            console.log("Marked existing row for deletion");
+        } else {
+            // New row - remove completely
+            row.remove();
+            // Update total forms count
+            var totalForms = $('#id_details-TOTAL_FORMS');
+            totalForms.val(parseInt(totalForms.val()) - 1);
+            console.log("Removed new row, total forms:", totalForms.val());
+
+            // Re-index remaining forms
+            $('.formset-row').each(function(index) {
+                var currentRow = $(this);
+                currentRow.find('[name]').each(function() {
+                    var oldName = $(this).attr('name');
+                    if (oldName) {
+                        var newName = oldName.replace(/-\d+-/, '-' + index + '-');
+                        $(this).attr('name', newName);
+
+                        var oldId = $(this).attr('id');
+                        if (oldId) {
+                            var newId = oldId.replace(/-\d+-/, '-' + index + '-');
+                            $(this).attr('id', newId);
+                        }
+                    }
+                });
+                currentRow.attr('id', 'form-' + index);
+            });
+        }
+    });
+
+    // Debug: log all product select elements
+    console.log("Product select elements found:", $('select[name*="Code"]').length);
+
+    // Handle form submission - clean up empty rows
+    $('#dispatch-form').on('submit', function(e) {
+        console.log("Form submitted - cleaning up empty rows");
+
+        // Iterate through all formset rows
+        $('.formset-row').each(function(index) {
+            var row = $(this);
+            var codeSelect = row.find('select[name*="Code"]');
+            var qtyInput = row.find('input[name*="Qty"]');
+            var deleteCheckbox = row.find('input[type="checkbox"][name*="DELETE"]');
+
+            var code = codeSelect.val() || '';
+            var qty = qtyInput.val() || '';
+
+            // If both Code and Qty are empty, mark for deletion (if existing row)
+            if (!code.trim() && !qty.trim()) {
+                if (deleteCheckbox.length > 0) {
+                    // Existing row - check if it has an instance (pk)
+                    var instanceInput = row.find('input[name*="-id"], input[name*="-ID"]');
+                    if (instanceInput.length > 0 && instanceInput.val()) {
+                        // Has existing ID - mark for deletion
+                        deleteCheckbox.prop('checked', true);
+                        console.log("Row " + index + " marked for deletion (empty but has ID)");
+                    }
+                } else {
+                    // New row - remove from formset count won't help at this point,
+                    // but the backend validation should handle it
+                    console.log("Row " + index + " is empty new row");
+                }
+            }
+        });
+
+        console.log("Ready to submit form");
+    });
+});
+
+document.addEventListener('DOMContentLoaded', function() {
+    const prodInput = document.getElementById('bulk-production-date');
+    const expiryInput = document.getElementById('bulk-expiry-date');
+    const autoExpiry = document.getElementById('auto-expiry');
+    const applyBtn = document.getElementById('apply-dates');
+
+    // Auto-calculate expiry when production date changes
+    prodInput.addEventListener('change', function() {
+        if (autoExpiry.checked && this.value) {
+            const prodDate = new Date(this.value);
+            prodDate.setMonth(prodDate.getMonth() + 6);
+            const year = prodDate.getFullYear();
+            const month = String(prodDate.getMonth() + 1).padStart(2, '0');
+            const day = String(prodDate.getDate()).padStart(2, '0');
+            expiryInput.value = `${year}-${month}-${day}`;
+        }
+    });
+
+    // Apply dates to all formset rows
+    applyBtn.addEventListener('click', function() {
+        const prodDate = prodInput.value;
+        const expiryDate = expiryInput.value;
+
+        if (!prodDate && !expiryDate) {
+            alert('Please select at least one date.');
+            return;
+        }
+
+        let appliedCount = 0;
+        document.querySelectorAll('.formset-row').forEach(row => {
+            // Skip deleted rows
+            const deleteCheckbox = row.querySelector('input[name*="DELETE"]');
+            if (deleteCheckbox && deleteCheckbox.checked) return;
+
+            if (prodDate) {
+                const prodField = row.querySelector('input[name*="ProductionDate"]');
+                if (prodField) {
+                    prodField.value = prodDate;
+                    appliedCount++;
+                }
+            }
+            if (expiryDate) {
+                const expiryField = row.querySelector('input[name*="ExpairyDate"]');
+                if (expiryField) {
+                    expiryField.value = expiryDate;
+                    appliedCount++;
+                }
+            }
+        });
+
+        // Show success feedback
+        if (appliedCount > 0) {
+            const alert = document.createElement('div');
+            alert.className = 'alert alert-success alert-dismissible fade show mt-3';
+            alert.innerHTML = `
+                <strong>Success!</strong> Dates applied to ${Math.ceil(appliedCount / 2)} item(s).
+                <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
+            `;
+            document.querySelector('.card-body').appendChild(alert);
+            setTimeout(() => alert.remove(), 3000);
+        }
+    });
+
+    // Set today as default production date
+    const today = new Date().toISOString().split('T')[0];
+    prodInput.value = today;
+
+    // Set default expiry (today + 6 months)
+    if (autoExpiry.checked) {
+        const defaultExpiry = new Date();
+        defaultExpiry.setMonth(defaultExpiry.getMonth() + 6);
+        const y = defaultExpiry.getFullYear();
+        const m = String(defaultExpiry.getMonth() + 1).padStart(2, '0');
+        const d = String(defaultExpiry.getDate()).padStart(2, '0');
+        expiryInput.value = `${y}-${m}-${d}`;
+    }
+});
+
+// ⚠️ Near-expiry hint: lines expiring within EXPIRY_WARNING_DAYS of the loading date (the server warns again on save)
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('dispatch-form');
+    const loadingInput = document.getElementById('id_LoadingDate');
+    const warningDays = parseInt(form.dataset.expiryWarningDays, 10);
+    if (!loadingInput || isNaN(warningDays)) return;
+
+    const DAY = 24 * 60 * 60 * 1000;
+
+    function checkExpiry() {
+        const loading = loadingInput.value ? new Date(loadingInput.value) : null;
+        document.querySelectorAll('.formset-row input[name*="ExpairyDate"]').forEach(input => {
+            const old = input.parentNode.querySelector('.expiry-warning');
+            if (old) old.remove();
+            input.classList.remove('border-warning', 'border-danger');
+            if (!loading || !input.value) return;
+
+            const daysLeft = Math.round((new Date(input.value) - loading) / DAY);
+            if (daysLeft > warningDays) return;
+            const hint = document.createElement('div');
+            hint.className = `form-text expiry-warning ${daysLeft < 0 ? 'text-danger' : 'text-warning'}`;
+            hint.textContent = daysLeft < 0 ? '⚠️ Expired at loading' : `⚠️ ${daysLeft} days left at loading`;
+            input.classList.add(daysLeft < 0 ? 'border-danger' : 'border-warning');
+            input.parentNode.appendChild(hint);
+        });
+    }
+
+    // Delegated: also covers rows added later; "Apply to all" sets values without a change event
+    form.addEventListener('change', checkExpiry);
+    document.getElementById('apply-dates')?.addEventListener('click', checkExpiry);
+    checkExpiry();
+});
@@ -0,0 +1,117 @@
+// home.html
+    document.addEventListener('DOMContentLoaded', function() {
+    const searchInput = document.getElementById('order-search');
+    const clearBtn = document.getElementById('clear-search');
+    const rows = document.querySelectorAll('tbody tr'); // ✅ Simpler selector
+
+    // Live search as you type
+    searchInput.addEventListener('input', function() {
+        const searchTerm = this.value.trim().toLowerCase();
+        let visibleCount = 0;
+
+        rows.forEach(row => {
+            // Order No is in the 2nd <td> (index 1)
+            const orderNoCell = row.cells[1]; // ✅ Direct access to 2nd column
+            if (orderNoCell) {
+                const orderNo = orderNoCell.textContent.trim().toLowerCase();
+                if (orderNo.includes(searchTerm)) {
+                    row.style.display = '';
+                    visibleCount++;
+                } else {
+                    row.style.display = 'none';
+                }
+            }
+        });
+
+        // Optional: Show "No results" message
+        if (visibleCount === 0 && searchTerm !== '') {
+            showMessage(`No orders found matching "${searchTerm}"`, 'info');
+        }
+    });
+
+    // Clear search
+    clearBtn.addEventListener('click', function() {
+        searchInput.value = '';
+        // Trigger input event to show all rows
+        searchInput.dispatchEvent(new Event('input'));
+    });
+
+    // Show temporary message
+    function showMessage(message, type) {
+        // Remove existing message
+        const existing = document.querySelector('.search-alert');
+        if (existing) existing.remove();
+
+        const alert = document.createElement('div');
+        alert.className = `alert alert-${type} search-alert alert-dismissible fade show mt-2`;
+        alert.innerHTML = `
+            ${message}
+            <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
+        `;
+        document.querySelector('.input-group').parentNode.insertAdjacentElement('afterend', alert);
+        setTimeout(() => {
+            if (alert.parentNode) alert.remove();
+        }, 3000);
+    }
+});
+
+// 🔴 Live updates: server-sent events from /events/home/ (dispatch_app/events.py)
+document.addEventListener('DOMContentLoaded', function() {
+    const notice = document.getElementById('live-updates');
+    if (!notice || !window.EventSource) return;
+
+    const currentStatus = notice.dataset.status;
+    const STATUS_CLASSES = {draft: 'bg-secondary', confirmed: 'bg-primary', shipped: 'bg-warning', delivered: 'bg-success'};
+    let newDispatches = 0;
+
+    // Reconnects by itself (with Last-Event-ID) when the stream ends or drops
+    const source = new EventSource(notice.dataset.url);
+
+    source.addEventListener('dispatch', function(event) {
+        const change = JSON.parse(event.data);
+        const row = document.querySelector(`tr[data-dispatch-id="${change.id}"]`);
+        const shown = !change.deleted && (!currentStatus || change.status === currentStatus);
+        if (!row) {
+            // Not on this page: new, or newly matching the filter
+            if (shown) {
+                newDispatches++;
+                notice.querySelector('.live-message').textContent =
+                    `${newDispatches} new or changed dispatch${newDispatches === 1 ? '' : 'es'} not shown.`;
+                notice.classList.remove('d-none');
+            }
+        } else if (!shown) {
+            row.remove();
+        } else {
+            patchRow(row, change);
+        }
+    });
+
+    source.addEventListener('counts', function(event) {
+        const counts = JSON.parse(event.data);
+        document.querySelectorAll('[data-count]').forEach(el => {
+            if (counts[el.dataset.count] !== undefined) el.textContent = counts[el.dataset.count];
+        });
+    });
+
+    function patchRow(row, change) {
+        const badge = row.querySelector('.status-badge');
+        badge.className = `badge ${STATUS_CLASSES[change.status] || 'bg-danger'} status-badge`;
+        badge.textContent = change.status.charAt(0).toUpperCase() + change.status.slice(1);
+        row.querySelector('.lines-badge').textContent = `${change.lines} items`;
+
+        // Same highlighting as the server-rendered row (home_row.html)
+        row.classList.toggle('loading-date-past', change.urgency === 'past');
+        row.classList.toggle('loading-date-urgent', change.urgency === 'soon');
+        const cell = row.querySelector('.loading-cell');
+        cell.querySelectorAll('.urgency-badge').forEach(label => label.remove());
+        if (change.urgency) {
+            const label = document.createElement('span');
+            label.className = `badge ${change.urgency === 'past' ? 'bg-danger' : 'bg-warning'} ms-1 d-none d-lg-inline urgency-badge`;
+            label.textContent = change.urgency === 'past' ? 'Overdue' : 'Soon';
+            cell.appendChild(label);
+        }
+
+        row.classList.add('row-updated');
+        setTimeout(() => row.classList.remove('row-updated'), 2000);
+    }
+});
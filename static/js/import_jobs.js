@@ -0,0 +1,37 @@
+// import_jobs.html
+document.addEventListener('DOMContentLoaded', function() {
+    const badgeClass = {queued: 'bg-secondary', running: 'bg-primary', done: 'bg-success', failed: 'bg-danger'};
+
+    function poll(row) {
+        fetch(row.dataset.progressUrl, {credentials: 'same-origin'})
+            .then(response => response.json())
+            .then(data => {
+                const badge = row.querySelector('.job-status');
+                badge.className = 'badge job-status ' + badgeClass[data.status];
+                badge.textContent = data.status_display;
+                row.querySelector('.job-message').textContent = data.message;
+                row.querySelector('.job-rows').textContent = data.rows_done;
+                row.querySelector('.job-rate').textContent = data.rows_per_sec;
+                row.querySelector('.job-counts').textContent = data.created + ' / ' + data.updated;
+                const errors = row.querySelector('.job-errors');
+                errors.textContent = data.errors + ' ';
+                if (data.error_report_url) {
+                    const link = document.createElement('a');
+                    link.href = data.error_report_url;
+                    link.className = 'btn btn-outline-danger btn-sm';
+                    link.textContent = 'Report';
+                    errors.appendChild(link);
+                }
+                row.dataset.status = data.status;
+                if (data.status === 'queued' || data.status === 'running') {
+                    setTimeout(() => poll(row), 2000);
+                }
+            });
+    }
+
+    document.querySelectorAll('tr[data-job-id]').forEach(row => {
+        if (row.dataset.status === 'queued' || row.dataset.status === 'running') {
+            poll(row);
+        }
+    });
+});
@@ -0,0 +1,2 @@
+// pallet_labels.html
+window.print();